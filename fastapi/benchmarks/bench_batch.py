@@ -0,0 +1,60 @@
+"""独立した SELECT を 1 件ずつ送る場合と execute_batch でまとめて送る場合の比較。
+
+テナントのシード読み込み (テナント・特典ルール・店舗) と同じ 3 文を繰り返し実行する。
+差は DB までの往復時間にほぼ比例するため、本番に近いネットワーク越しの DB で測ること。
+
+    python -m benchmarks.bench_batch --tenant takizawa --iterations 500
+"""
+import argparse
+import asyncio
+import time
+from typing import List, Tuple
+
+from database.async_database import AsyncDatabaseService
+
+STATEMENTS = [
+    "SELECT tenant_id, company_name, is_active, config, content_version FROM tenants WHERE tenant_id = %s",
+    "SELECT threshold, label, icon FROM reward_rules WHERE tenant_id = %s ORDER BY threshold",
+    "SELECT store_id, name, lat, lng, description, image_url, stamp_mark FROM stores WHERE tenant_id = %s ORDER BY name",
+]
+
+
+async def _sequential(db: AsyncDatabaseService, statements: List[Tuple[str, tuple]]) -> None:
+    for query, params in statements:
+        await db.execute_query(query, params, row_format="row")
+
+
+async def _batched(db: AsyncDatabaseService, statements: List[Tuple[str, tuple]]) -> None:
+    await db.execute_batch(statements, row_format="row")
+
+
+async def run(tenant_id: str, iterations: int) -> None:
+    statements = [(query, (tenant_id,)) for query in STATEMENTS]
+    try:
+        async with AsyncDatabaseService() as db:
+            for label, runner in (("sequential", _sequential), ("batch", _batched)):
+                await runner(db, statements)
+                timings = []
+                for _ in range(iterations):
+                    started = time.perf_counter()
+                    await runner(db, statements)
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                print(
+                    f"{label:<10} statements={len(statements)}  "
+                    f"p50={timings[len(timings) // 2]:7.3f}ms  p95={timings[int(len(timings) * 0.95)]:7.3f}ms"
+                )
+    finally:
+        await AsyncDatabaseService.close_connection_pool()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tenant", default="takizawa")
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(run(args.tenant, args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""キャンペーン期間判定の旧実装 (リクエストごとに設定を解釈) とコンパイル済みカレンダーの比較。
+
+DB には接続しない。旧実装は record_stamp がリクエストごとに行っていた処理
+(タイムゾーン文字列の正規表現・ZoneInfo の生成・期間の ISO 文字列の解析・現在時刻の取得) を再現する。
+
+    python -m benchmarks.bench_campaign_calendar --iterations 200000
+"""
+import argparse
+import re
+import time
+from datetime import date, datetime, timedelta, timezone
+from datetime import time as dt_time
+from typing import Any, Callable, Dict, Optional
+from zoneinfo import ZoneInfo
+
+from services.campaign_calendar import OPEN, campaign_calendar, compile_calendar
+from services.tenant_cache import TenantSnapshot
+
+_UTC_OFFSET_PATTERN = re.compile(r"^UTC([+-])(?:(\d{1,2})(?::([0-5]\d))?)$")
+
+CONFIGS = {
+    "offset": {"campaignStart": "2025-04-01", "campaignEnd": "2099-12-31", "campaignTimezone": "UTC+09:00"},
+    "iana": {"campaignStart": "2025-04-01T09:00:00", "campaignEnd": "2099-12-31", "campaignTimezone": "Asia/Tokyo"},
+}
+
+
+def _legacy_tzinfo_from_offset(value: Optional[str]):
+    if not value:
+        return None
+    match = _UTC_OFFSET_PATTERN.fullmatch(value.strip())
+    if not match:
+        return None
+    sign, hours_text, minutes_text = match.groups()
+    offset = timedelta(hours=int(hours_text), minutes=int(minutes_text or "00"))
+    return timezone(-offset if sign == "-" else offset)
+
+
+def _legacy_parse_boundary(value: Optional[str], *, end: bool, tz) -> Optional[datetime]:
+    if not value:
+        return None
+    text = value.strip()
+    try:
+        normalized = text[:-1] + "+00:00" if text.endswith("Z") else text
+        if "T" in normalized or "+" in normalized:
+            dt = datetime.fromisoformat(normalized)
+            return dt.replace(tzinfo=tz) if dt.tzinfo is None else dt.astimezone(tz)
+        return datetime.combine(date.fromisoformat(normalized), dt_time.max if end else dt_time.min, tzinfo=tz)
+    except ValueError:
+        return None
+
+
+def legacy_phase(config_data: Dict[str, Any]) -> str:
+    """旧 _ensure_within_campaign と同じ手順で判定する"""
+    start_value = config_data.get("campaignStart") or config_data.get("campaign_start")
+    end_value = config_data.get("campaignEnd") or config_data.get("campaign_end")
+    if not start_value and not end_value:
+        return OPEN
+    tz_value = config_data.get("campaignTimezone") or config_data.get("campaign_timezone")
+    tz = _legacy_tzinfo_from_offset(tz_value)
+    if tz is None:
+        try:
+            tz = ZoneInfo(tz_value)
+        except Exception:
+            tz = timezone.utc
+    start_dt = _legacy_parse_boundary(start_value, end=False, tz=tz)
+    end_dt = _legacy_parse_boundary(end_value, end=True, tz=tz)
+    now = datetime.now(tz)
+    if start_dt and now < start_dt:
+        return "before"
+    if end_dt and now > end_dt:
+        return "after"
+    return OPEN
+
+
+def _measure(label: str, iterations: int, check: Callable[[], str]) -> float:
+    check()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        check()
+    per_call_us = (time.perf_counter() - started) / iterations * 1e6
+    print(f"{label:<24} {per_call_us:8.3f} us/call")
+    return per_call_us
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    for name, config in CONFIGS.items():
+        snapshot = TenantSnapshot("bench", "Bench", True, config, [], [], 1)
+        assert legacy_phase(config) == compile_calendar(config).phase() == OPEN
+        legacy = _measure(f"{name}: legacy", args.iterations, lambda: legacy_phase(config))
+        compiled = _measure(f"{name}: calendar", args.iterations, lambda: campaign_calendar(snapshot).phase())
+        print(f"{name}: {legacy / compiled:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
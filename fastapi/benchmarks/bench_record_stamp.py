@@ -0,0 +1,158 @@
+"""record_stamp の旧実装 (逐次 ~12 往復) と 1 ステートメント版を比較するベンチマーク。
+
+使い方 (fastapi ディレクトリで実行、.env の DB に接続する):
+
+    python -m benchmarks.bench_record_stamp --users 200 --stores 10
+
+専用テナント ``bench-stamp`` を作成し、終了時に削除する。
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Any, Dict, List
+
+from database.async_database import AsyncDatabaseService
+from services.stamps import record_stamp_once
+
+BENCH_TENANT = "bench-stamp"
+
+
+async def legacy_record_stamp(db: AsyncDatabaseService, user_id: int, tenant_id: str, store_id: str) -> Dict[str, Any]:
+    """旧 record_stamp と同じ順序でクエリを発行する (キャンペーン判定は省略)"""
+    cursor = db.cursor
+    await cursor.execute(
+        "SELECT store_id, name FROM stores WHERE tenant_id = %s AND store_id = %s",
+        (tenant_id, store_id),
+    )
+    if await cursor.fetchone() is None:
+        await cursor.execute("SELECT stamps FROM user_progress WHERE user_id = %s", (user_id,))
+        await cursor.fetchone()
+        await db.connection.commit()
+        return {"status": "store-not-found"}
+    await cursor.execute("SELECT config FROM tenants WHERE tenant_id = %s", (tenant_id,))
+    await cursor.fetchone()
+    await cursor.execute(
+        "INSERT INTO user_progress (user_id, tenant_id, stamps) VALUES (%s, %s, 0) ON CONFLICT (user_id) DO NOTHING",
+        (user_id, tenant_id),
+    )
+    await cursor.execute(
+        "SELECT 1 FROM user_store_stamps WHERE user_id = %s AND store_id = %s",
+        (user_id, store_id),
+    )
+    if await cursor.fetchone():
+        await cursor.execute("SELECT stamps FROM user_progress WHERE user_id = %s", (user_id,))
+        await cursor.fetchone()
+        await cursor.execute("SELECT store_id FROM user_store_stamps WHERE user_id = %s", (user_id,))
+        await cursor.fetchall()
+        await db.connection.commit()
+        return {"status": "already_stamped"}
+    await cursor.execute(
+        "INSERT INTO user_store_stamps (user_id, tenant_id, store_id) VALUES (%s, %s, %s)",
+        (user_id, tenant_id, store_id),
+    )
+    await cursor.execute(
+        "UPDATE user_progress SET stamps = stamps + 1, updated_at = CURRENT_TIMESTAMP WHERE user_id = %s RETURNING stamps",
+        (user_id,),
+    )
+    stamps = (await cursor.fetchone())[0]
+    await cursor.execute("SELECT coupon_id FROM user_coupons WHERE user_id = %s", (user_id,))
+    existing = {row[0] for row in await cursor.fetchall()}
+    await cursor.execute(
+        "SELECT threshold, label, icon FROM reward_rules WHERE tenant_id = %s ORDER BY threshold",
+        (tenant_id,),
+    )
+    for threshold, label, _icon in await cursor.fetchall():
+        coupon_id = f"tenant-{tenant_id}-rule-{threshold}"
+        if threshold <= stamps and coupon_id not in existing:
+            await cursor.execute(
+                """
+                INSERT INTO user_coupons (user_id, tenant_id, coupon_id, title, description, used)
+                VALUES (%s, %s, %s, %s, %s, FALSE)
+                RETURNING coupon_id, tenant_id, title, description, used
+                """,
+                (user_id, tenant_id, coupon_id, label, f"{threshold}個達成で獲得したクーポン"),
+            )
+            await cursor.fetchone()
+    await cursor.execute("SELECT store_id FROM user_store_stamps WHERE user_id = %s", (user_id,))
+    await cursor.fetchall()
+    await db.connection.commit()
+    return {"status": "stamped"}
+
+
+async def single_round_trip(db: AsyncDatabaseService, user_id: int, tenant_id: str, store_id: str) -> Dict[str, Any]:
+    async with db.transaction():
+        return await record_stamp_once(db, user_id, tenant_id, store_id, "ja")
+
+
+async def _setup(db: AsyncDatabaseService, users: int, stores: int) -> List[int]:
+    await _teardown(db)
+    await db.execute_query(
+        "INSERT INTO tenants (tenant_id, company_name, config) VALUES (%s, %s, '{}'::jsonb)",
+        (BENCH_TENANT, "Benchmark"),
+    )
+    await db.bulk_insert(
+        "stores",
+        ["tenant_id", "store_id", "name", "lat", "lng"],
+        ((BENCH_TENANT, f"bench-s{index}", f"Bench store {index}", 0, 0) for index in range(stores)),
+    )
+    await db.bulk_insert(
+        "reward_rules",
+        ["tenant_id", "threshold", "label"],
+        ((BENCH_TENANT, threshold, f"Reward {threshold}") for threshold in (2, 4, 6)),
+    )
+    created = await db.bulk_insert(
+        "users",
+        ["tenant_id", "username", "email", "password_hash"],
+        (
+            (BENCH_TENANT, f"bench-{index}", f"bench-{index}@example.invalid", "x")
+            for index in range(users * 2)
+        ),
+        returning=["id"],
+    )
+    user_ids = [row["id"] for row in created]
+    return user_ids
+
+
+async def _teardown(db: AsyncDatabaseService) -> None:
+    await db.execute_query("DELETE FROM tenants WHERE tenant_id = %s", (BENCH_TENANT,))
+
+
+async def _measure(name: str, func, db: AsyncDatabaseService, user_ids: List[int], stores: int) -> None:
+    timings = []
+    for user_id in user_ids:
+        for index in range(stores):
+            started = time.perf_counter()
+            await func(db, user_id, BENCH_TENANT, f"bench-s{index}")
+            timings.append((time.perf_counter() - started) * 1000)
+        # 重複スキャン (already_stamped) も 1 回計測する
+        started = time.perf_counter()
+        await func(db, user_id, BENCH_TENANT, "bench-s0")
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    print(
+        f"{name:<20} n={len(timings):>6}  mean={statistics.mean(timings):7.3f}ms  "
+        f"p50={timings[len(timings) // 2]:7.3f}ms  p95={timings[int(len(timings) * 0.95)]:7.3f}ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--stores", type=int, default=8)
+    args = parser.parse_args()
+
+    async with AsyncDatabaseService() as db:
+        async with db.transaction():
+            user_ids = await _setup(db, args.users, args.stores)
+        try:
+            await _measure("legacy (sequential)", legacy_record_stamp, db, user_ids[: args.users], args.stores)
+            await _measure("single statement", single_round_trip, db, user_ids[args.users:], args.stores)
+        finally:
+            async with db.transaction():
+                await _teardown(db)
+    await AsyncDatabaseService.close_connection_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
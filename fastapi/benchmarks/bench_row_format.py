@@ -0,0 +1,65 @@
+"""execute_query の行表現 (dict / row / tuple) の生成コストとメモリを比較するマイクロベンチマーク。
+
+DB には接続せず、店舗一覧と同じ 7 列のタプルをドライバの戻り値に見立てて変換する。
+
+    python -m benchmarks.bench_row_format --rows 100000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from typing import Any, List, Tuple
+
+from database.rows import build_rows
+
+DESCRIPTION = [
+    (name,)
+    for name in ("store_id", "name", "lat", "lng", "description", "image_url", "stamp_mark")
+]
+
+
+def _driver_rows(count: int) -> List[Tuple[Any, ...]]:
+    return [
+        (f"store-{index}", f"Store {index}", 39.7 + index * 1e-6, 141.1, None, None, "stamp")
+        for index in range(count)
+    ]
+
+
+def _read(rows: List[Any], row_format: str) -> float:
+    if row_format == "tuple":
+        return sum(row[2] for row in rows)
+    return sum(row["lat"] for row in rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    driver_rows = _driver_rows(args.rows)
+    for row_format in ("dict", "row", "tuple"):
+        timings = []
+        for _ in range(args.repeat):
+            gc.collect()
+            started = time.perf_counter()
+            rows = build_rows(DESCRIPTION, driver_rows, row_format)
+            _read(rows, row_format)
+            timings.append((time.perf_counter() - started) * 1000)
+            del rows
+
+        gc.collect()
+        tracemalloc.start()
+        rows = build_rows(DESCRIPTION, driver_rows, row_format)
+        retained, _peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del rows
+
+        print(
+            f"{row_format:<6} rows={args.rows:>7}  build+read best={min(timings):8.2f}ms  "
+            f"retained={retained / 1024 / 1024:7.2f}MiB  ({retained / args.rows:6.1f} B/row)"
+        )
+
+
+if __name__ == "__main__":
+    main()
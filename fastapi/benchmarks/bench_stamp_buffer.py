@@ -0,0 +1,88 @@
+"""ピーク時の同時スキャンを想定し、1 件ずつのトランザクションと書き込みバッファを比較する。
+
+使い方 (fastapi ディレクトリで実行、.env の DB に接続する):
+
+    python -m benchmarks.bench_stamp_buffer --users 500 --stores 4 --concurrency 200
+
+bench_record_stamp と同じ専用テナント ``bench-stamp`` を作成し、終了時に削除する。
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+from benchmarks.bench_record_stamp import BENCH_TENANT, _setup, _teardown
+from database.async_database import AsyncDatabaseService
+from services.stamp_buffer import ACCEPT, COMMIT, StampBuffer
+from services.stamps import record_stamp_once
+from services.tenant_cache import tenant_cache
+
+
+async def direct(user_id: int, store_id: str) -> None:
+    async with AsyncDatabaseService() as db:
+        await record_stamp_once(db, user_id, BENCH_TENANT, store_id, "ja")
+
+
+def buffered(buffer: StampBuffer):
+    async def submit(user_id: int, store_id: str) -> None:
+        snapshot = await tenant_cache.get(None, BENCH_TENANT)
+        async with AsyncDatabaseService() as db:
+            await buffer.submit(db, user_id, BENCH_TENANT, store_id, "ja", snapshot)
+
+    return submit
+
+
+async def _measure(name: str, func, user_ids: List[int], stores: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+    timings: List[float] = []
+
+    async def one(user_id: int, store_id: str) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await func(user_id, store_id)
+            timings.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *[one(user_id, f"bench-s{index}") for index in range(stores) for user_id in user_ids]
+    )
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    print(
+        f"{name:<16} n={len(timings):>6}  {len(timings) / elapsed:8.0f} stamps/s  "
+        f"p50={statistics.median(timings):7.2f}ms  p95={timings[int(len(timings) * 0.95)]:7.2f}ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--stores", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--flush-interval-ms", type=int, default=20)
+    args = parser.parse_args()
+
+    async with AsyncDatabaseService() as db:
+        async with db.transaction():
+            user_ids = await _setup(db, args.users, args.stores)
+    # bench_record_stamp の _setup は users * 2 人を作るので、3 通りに分ける
+    third = len(user_ids) // 3
+    try:
+        await _measure("direct", direct, user_ids[:third], args.stores, args.concurrency)
+        for durability, users in ((COMMIT, user_ids[third : third * 2]), (ACCEPT, user_ids[third * 2 :])):
+            buffer = StampBuffer(True, durability, args.flush_interval_ms / 1000, args.batch_size, 1_000_000)
+            await _measure(f"buffer ({durability})", buffered(buffer), users, args.stores, args.concurrency)
+            await buffer.close()
+            stats = buffer.stats()
+            print(f"{'':<16} batches={stats['batches']} written={stats['written']} fallbacks={stats['fallbacks']}")
+    finally:
+        async with AsyncDatabaseService() as db:
+            async with db.transaction():
+                await _teardown(db)
+        await AsyncDatabaseService.close_connection_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""店舗の近傍検索: 全店舗の haversine 総当たりと KD 木 (services/store_locator.py) の比較。
+
+DB には接続しない。岩手県程度の範囲に乱数で店舗を置き、ランダムな地点から検索する。
+
+    python -m benchmarks.bench_store_locator --sizes 10000 100000 --queries 2000
+"""
+import argparse
+import heapq
+import random
+import time
+from typing import Any, Callable, Dict, List
+
+from services.store_locator import StoreLocator, haversine_meters
+
+LAT_RANGE = (38.7, 40.4)
+LNG_RANGE = (140.6, 142.1)
+
+
+def _stores(count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    return [
+        {"store_id": f"s{index}", "name": f"Store {index}", "lat": rng.uniform(*LAT_RANGE), "lng": rng.uniform(*LNG_RANGE)}
+        for index in range(count)
+    ]
+
+
+def brute_force(stores, lat, lng, limit, radius=None, exclude=frozenset()):
+    """旧来のクライアント側と同じく、全店舗の距離を計算して近い順に選ぶ"""
+    candidates = (
+        (haversine_meters(lat, lng, store["lat"], store["lng"]), store["store_id"])
+        for store in stores
+        if store["store_id"] not in exclude
+    )
+    if radius is not None:
+        candidates = (item for item in candidates if item[0] <= radius)
+    return heapq.nsmallest(limit, candidates)
+
+
+def _measure(label: str, points, run: Callable[[float, float], Any]) -> float:
+    started = time.perf_counter()
+    for lat, lng in points:
+        run(lat, lng)
+    per_query_us = (time.perf_counter() - started) / len(points) * 1e6
+    print(f"  {label:<34} {per_query_us:10.1f} us/query")
+    return per_query_us
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--brute-force-queries", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    for size in args.sizes:
+        stores = _stores(size, rng)
+        started = time.perf_counter()
+        locator = StoreLocator(stores)
+        print(f"{size} stores: build {(time.perf_counter() - started) * 1000:.0f} ms")
+        points = [(rng.uniform(*LAT_RANGE), rng.uniform(*LNG_RANGE)) for _ in range(args.queries)]
+        exclude = frozenset(f"s{index}" for index in rng.sample(range(size), min(size, 50)))
+
+        for lat, lng in points[: args.brute_force_queries]:
+            expected = [store_id for _, store_id in brute_force(stores, lat, lng, 10, exclude=exclude)]
+            actual = [row["store_id"] for row, _ in locator.nearest(lat, lng, 10, exclude=exclude)]
+            assert actual == expected, (lat, lng)
+
+        _measure("brute force k=10", points[: args.brute_force_queries], lambda lat, lng: brute_force(stores, lat, lng, 10))
+        _measure("kd-tree k=10", points, lambda lat, lng: locator.nearest(lat, lng, 10))
+        _measure("kd-tree k=10, radius 2 km", points, lambda lat, lng: locator.nearest(lat, lng, 10, radius_meters=2000))
+        _measure(
+            "kd-tree k=10, 50 stamped excluded",
+            points,
+            lambda lat, lng: locator.nearest(lat, lng, 10, exclude=exclude),
+        )
+        _measure("kd-tree k=100", points, lambda lat, lng: locator.nearest(lat, lng, 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,17 +9,59 @@ class Settings(BaseSettings):
     DB_NAME: str = "stamprally-db"
     DB_USER: str = "fricton"
     DB_PASSWORD: str = "fricton99"
+    DB_POOL_MIN_SIZE: int = 1
+    DB_POOL_MAX_SIZE: int = 20
+    DB_POOL_TIMEOUT: float = 5.0  # 接続待ちの上限 (秒)。超えたリクエストは 503
+    DB_POOL_MAX_IDLE: float = 600.0  # 最小数を超えたアイドル接続を閉じるまでの秒数
+    DB_POOL_MAX_LIFETIME: float = 3600.0  # 接続を作り直すまでの秒数
+    DB_STREAM_ITERSIZE: int = 2000  # ストリーミング時にサーバーから 1 回で取得する行数
+    DB_STATEMENT_TIMEOUT_MS: int = 2000  # 1 文の実行時間の上限 (ミリ秒)。スタンプ・進捗など通常のルート
+    DB_LOCK_TIMEOUT_MS: int = 1000  # 行ロック待ちの上限 (ミリ秒)
+    DB_REPORT_STATEMENT_TIMEOUT_MS: int = 30000  # ダッシュボード・CSV 出力など集計系ルートの上限 (ミリ秒)
+    DB_REPLICA_URLS: str = ""  # 読み取りレプリカの接続文字列 (カンマ区切り、空ならすべてプライマリ)
+    DB_REPLICA_MAX_LAG_SECONDS: float = 2.0  # これ以上遅れているレプリカは使わない (秒)
+    DB_REPLICA_LAG_CHECK_INTERVAL: float = 1.0  # レプリカの遅延を測り直す間隔 (秒)
+    DB_READ_YOUR_WRITES_SECONDS: float = 5.0  # 書き込んだ利用者の読み取りをプライマリに向ける秒数
+    DB_SLOW_QUERY_MS: float = 200.0  # これを超えたクエリをログに出す (ミリ秒)
+    DB_EXPLAIN_SAMPLE_RATE: float = 0.0  # 遅い SELECT で EXPLAIN (ANALYZE, BUFFERS) を取る割合 (0 で無効)
+    DB_EXPLAIN_MIN_INTERVAL: float = 60.0  # 同じ文の EXPLAIN を取り直すまでの秒数
+    DB_MIGRATE_ON_STARTUP: bool = True  # 起動時に未適用の移行を適用する (false なら起動を中止)
 
     # Security
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    PASSWORD_HASH_WORKERS: int = 2  # bcrypt 用プロセス数 (0 ならスレッドで実行)
+    PASSWORD_HASH_MAX_CONCURRENCY: int = 4  # 同時に計算するハッシュ数の上限 (超えた分は待ち行列)
 
     # Application
     APP_NAME: str = "stamprally-app"
     DEBUG: bool = False
     CORS_ORIGINS: str = "http://localhost:8080"
     DEFAULT_TIMEZONE: Optional[str] = None
+    DIAGNOSTICS_ADMINS: str = ""  # GET /api/diagnostics を見られる利用者 (tenant_id:username のカンマ区切り、空なら誰も見られない)
+
+    # Cache
+    TENANT_CACHE_TTL_SECONDS: float = 5.0  # 他ワーカーでの変更が反映されるまでの最大秒数
+    TENANT_SEED_MAX_AGE: int = 0  # GET /api/tenants/{tenant_id} の Cache-Control max-age (秒)
+    USER_CACHE_TTL_SECONDS: float = 30.0  # 認証済みユーザーを再取得するまでの秒数 (0 で無効)
+    USER_CACHE_MAX_ENTRIES: int = 10000
+    IDEMPOTENCY_TTL_SECONDS: float = 86400.0  # Idempotency-Key の応答を再送に返す期間 (秒)
+    IDEMPOTENCY_CACHE_MAX_ENTRIES: int = 10000  # ワーカー内に保持する応答の件数上限
+
+    # Stamp buffer (イベントのピーク向けにスタンプをまとめて書き込む)
+    STAMP_BUFFER_ENABLED: bool = False
+    STAMP_BUFFER_DURABILITY: str = "commit"  # commit: 書き込みの確定を待って応答 / accept: 受け付けた時点で仮の応答
+    STAMP_BUFFER_FLUSH_INTERVAL_MS: int = 50  # 最初の 1 件を積んでから書き込むまでの最大待ち時間 (ミリ秒)
+    STAMP_BUFFER_BATCH_SIZE: int = 200  # 1 トランザクションで書き込む最大件数
+    STAMP_BUFFER_MAX_PENDING: int = 5000  # 未書き込みの上限。超えた分は 503 (Retry-After) で断る
+    STAMP_BUFFER_MAX_RETRIES: int = 3  # accept モードで書き込みに失敗した分を積み直す回数
+    STAMP_BUFFER_RETRY_BACKOFF_MS: int = 500  # 最初の積み直しまでの待ち時間 (ミリ秒、以後は倍にする)
+
+    # Geofence (スタンプ記録時の位置確認)
+    STAMP_GEOFENCE_RADIUS_METERS: float = 0.0  # 店舗に半径がないときの既定 (メートル、0 なら確認しない)
+    STAMP_GEOFENCE_MAX_ACCURACY_METERS: float = 100.0  # 端末が申告する誤差 (accuracy) として認める上限 (メートル)
+    STAMP_GEOFENCE_REQUIRE_LOCATION: bool = False  # 半径のある店舗で位置のないリクエストを断る
 
     # Tenant (optional)
     DEFAULT_TENANT_ID: Optional[str] = None
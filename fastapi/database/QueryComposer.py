@@ -1,9 +1,103 @@
+from functools import lru_cache
 from pydantic import BaseModel
-from typing import Dict, List, Optional
-from datetime import datetime, date, time
+from typing import Any, Dict, List, Optional, Tuple, Type
 import re
 
+ComposedQuery = Tuple[str, Tuple[Any, ...]]
+
+
+def _convert_to_snake_case(name: str) -> str:
+    """Convert PascalCase to snake_case for table names"""
+    snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', name)
+    return snake_case.lower()
+
+
+def _where_clause(condition_shape: Tuple[Tuple[str, bool], ...], tenant_column: Optional[str]) -> str:
+    """条件の形 ((列名, IS NULL か), ...) から WHERE 句を組み立てる"""
+    where_conditions = [
+        f"{field} IS NULL" if is_null else f"{field} = %s"
+        for field, is_null in condition_shape
+    ]
+    if tenant_column:
+        where_conditions.append(f"{tenant_column} = %s")
+    if not where_conditions:
+        return ""
+    return " WHERE " + " AND ".join(where_conditions)
+
+
+def _model_class(model: Any) -> Type[BaseModel]:
+    """モデルのインスタンスでもクラスでも、キャッシュのキーにするクラスを返す"""
+    return model if isinstance(model, type) else type(model)
+
+
+@lru_cache(maxsize=512)
+def _compile(
+    model_class: Type[BaseModel],
+    sqltype: str,
+    condition_shape: Tuple[Tuple[str, bool], ...],
+    schema: Optional[str],
+    tenant_scoped: bool,
+    value_fields: Tuple[str, ...] = (),
+    related_models: Tuple[Type[BaseModel], ...] = (),
+    addSqlQuery: str = "",
+    join_clause: Optional[str] = None,
+    select_fields: Optional[str] = None,
+) -> str:
+    """クエリの形ごとに SQL テンプレートを組み立てる (値は含まないのでキャッシュできる)"""
+    table_name = _convert_to_snake_case(model_class.__name__)
+    if schema:
+        table_name = f"{schema}.{table_name}"
+
+    if sqltype == "select":
+        base_fields = ", ".join([f"{table_name}.{field}" for field in model_class.model_fields.keys()])
+        related_fields = ""
+        for model in related_models:
+            model_fields = ", ".join(model.model_fields.keys())
+            related_fields += ", " + model_fields if model_fields else ""
+        all_select_fields = select_fields if select_fields else base_fields + related_fields
+        join_sql = join_clause if join_clause else ""
+
+        where_clause = _where_clause(condition_shape, f"{table_name}.tenant_id" if tenant_scoped else None)
+        additional_clauses = ""
+        if addSqlQuery:
+            if addSqlQuery.strip().upper().startswith('WHERE'):
+                where_part = addSqlQuery.strip()[len('WHERE'):].strip()
+                if where_clause:
+                    where_clause += f" AND {where_part}"
+                else:
+                    where_clause = f" WHERE {where_part}"
+            else:
+                additional_clauses = f" {addSqlQuery}"
+
+        query = f"""SELECT {all_select_fields} FROM {table_name}{join_sql}{where_clause}{additional_clauses};"""
+        return query.replace("\n", "")
+
+    elif sqltype == "insert":
+        fields = ", ".join(value_fields)
+        placeholders = ", ".join(["%s"] * len(value_fields))
+        return f"INSERT INTO {table_name} ({fields}) VALUES ({placeholders}) RETURNING *;"
+
+    elif sqltype == "update":
+        where_clause = _where_clause(condition_shape, "tenant_id" if tenant_scoped else None)
+        update_values = ", ".join([f"{field} = %s" for field in value_fields])
+        return f"UPDATE {table_name} SET {update_values} {where_clause} RETURNING *;"
+
+    elif sqltype == "delete":
+        where_clause = _where_clause(condition_shape, "tenant_id" if tenant_scoped else None)
+        return f"DELETE FROM {table_name} {where_clause} RETURNING *;"
+
+    raise ValueError("無効なSQLタイプです。対応している種類: 'select', 'insert', 'update', 'delete'")
+
+
 class QueryComposer:
+    """Pydantic モデルから (SQL, パラメータ) を組み立てる。
+
+    値はすべてプレースホルダ (%s) で渡すため、同じ形のクエリは同じ SQL 文字列になり、
+    テンプレートはモデルクラス・SQL 種別・条件キー・スキーマなどの形ごとにキャッシュされる。
+    ``addSqlQuery`` / ``join_clause`` / ``select_fields`` は SQL 断片としてそのまま埋め込まれる
+    (リテラルの ``%`` は ``%%`` と書くこと)。
+    """
+
     default_schema = None
 
     def __init__(self, tenant_id: Optional[str] = None, schema: Optional[str] = default_schema):
@@ -12,8 +106,7 @@ class QueryComposer:
 
     def _convert_to_snake_case(self, name: str) -> str:
         """Convert PascalCase to snake_case for table names"""
-        snake_case = re.sub('([a-z0-9])([A-Z])', r'\1_\2', name)
-        return snake_case.lower()
+        return _convert_to_snake_case(name)
 
     def generate_query(
         self,
@@ -24,116 +117,51 @@ class QueryComposer:
         conditions: Optional[Dict] = None,
         join_clause: Optional[str] = None,
         select_fields: Optional[str] = None
-    ) -> str:
-        related_fields = ""
-        if related_models:
-            for model in related_models:
-                model_fields = ", ".join([f"{field}" for field in model.__fields__.keys()])
-                related_fields += ", " + model_fields if model_fields else ""
-
-        table_name = self._convert_to_snake_case(datamodel.__class__.__name__)
-        if self.schema:
-            table_name = f"{self.schema}.{table_name}"
-
-        where_clause = ""
-        if conditions and isinstance(conditions, dict):
-            where_conditions = []
-            for field, value in conditions.items():
-                if value is None:
-                    where_conditions.append(f"{field} IS NULL")
-                elif isinstance(value, (str, date, datetime, time)):
-                    where_conditions.append(f"{field} = '{value}'")
-                elif isinstance(value, bool):
-                    where_conditions.append(f"{field} = {str(value).lower()}")
-                else:
-                    where_conditions.append(f"{field} = {value}")
-            if where_conditions:
-                where_clause = " WHERE " + " AND ".join(where_conditions)
+    ) -> ComposedQuery:
+        model_class = _model_class(datamodel)
+        tenant_scoped = bool(self.tenant_id) and 'tenant_id' in model_class.model_fields
 
-        if sqltype == "select":
-            base_fields = ", ".join([f"{table_name}.{field}" for field in datamodel.__fields__.keys()])
-            join_sql = join_clause if join_clause else ""
+        condition_items = list(conditions.items()) if isinstance(conditions, dict) else []
+        condition_shape = tuple((field, value is None) for field, value in condition_items)
+        condition_params = [value for _, value in condition_items if value is not None]
+        tenant_params = [self.tenant_id] if tenant_scoped else []
 
-            if select_fields:
-                all_select_fields = select_fields
-            else:
-                all_select_fields = base_fields + related_fields
-
-            if self.tenant_id and 'tenant_id' in datamodel.__fields__:
-                tenant_condition = f"{table_name}.tenant_id = '{self.tenant_id}'"
-                if where_clause:
-                    where_clause = where_clause + f" AND {tenant_condition}"
-                else:
-                    where_clause = f" WHERE {tenant_condition}"
-
-            additional_clauses = ""
-            if addSqlQuery:
-                if addSqlQuery.strip().upper().startswith('WHERE'):
-                    where_part = addSqlQuery.lstrip('WHERE ')
-                    if where_clause:
-                        where_clause += f" AND {where_part}"
-                    else:
-                        where_clause = f" WHERE {where_part}"
-                else:
-                    additional_clauses = f" {addSqlQuery}"
-
-            query = f"""SELECT {all_select_fields} FROM {table_name}{join_sql}{where_clause}{additional_clauses};"""
-            query = query.replace("\n", "")
-            return query
+        if sqltype == "select":
+            sql = _compile(
+                model_class,
+                sqltype,
+                condition_shape,
+                self.schema,
+                tenant_scoped,
+                related_models=tuple(_model_class(model) for model in related_models or ()),
+                addSqlQuery=addSqlQuery,
+                join_clause=join_clause,
+                select_fields=select_fields,
+            )
+            return sql, tuple(condition_params + tenant_params)
 
         elif sqltype == "insert":
-            data_map = datamodel.dict(exclude_unset=True)
-            if self.tenant_id and 'tenant_id' in datamodel.__fields__:
+            data_map = datamodel.model_dump(exclude_unset=True)
+            if tenant_scoped:
                 data_map["tenant_id"] = self.tenant_id
-            fields = ", ".join(data_map.keys())
-            values = []
-            for value in data_map.values():
-                if value is None:
-                    values.append("NULL")
-                elif isinstance(value, (str, date, datetime, time)):
-                    values.append(f"'{value}'")
-                elif isinstance(value, bool):
-                    values.append(str(value).lower())
-                else:
-                    values.append(str(value))
-            values_str = ", ".join(values)
-            return f"INSERT INTO {table_name} ({fields}) VALUES ({values_str}) RETURNING *;"
-
-        elif sqltype == "update":
-            if where_clause == "":
-                raise ValueError("更新条件が指定されていません")
+            sql = _compile(model_class, sqltype, (), self.schema, False, value_fields=tuple(data_map.keys()))
+            return sql, tuple(data_map.values())
 
-            if self.tenant_id and 'tenant_id' in datamodel.__fields__:
-                tenant_condition = f"tenant_id = '{self.tenant_id}'"
-                if where_clause:
-                    where_clause = where_clause + f" AND {tenant_condition}"
-                else:
-                    where_clause = f" WHERE {tenant_condition}"
-
-            update_values = []
-            for field, value in datamodel.dict(exclude_unset=True).items():
-                if value is None:
-                    update_values.append(f"{field} = NULL")
-                elif isinstance(value, (str, date, datetime, time)):
-                    update_values.append(f"{field} = '{value}'")
-                elif isinstance(value, bool):
-                    update_values.append(f"{field} = {str(value).lower()}")
-                else:
-                    update_values.append(f"{field} = {value}")
-            return f"UPDATE {table_name} SET {', '.join(update_values)} {where_clause} RETURNING *;"
-
-        elif sqltype == "delete":
-            if where_clause == "":
+        elif sqltype in ("update", "delete"):
+            if not condition_shape:
+                if sqltype == "update":
+                    raise ValueError("更新条件が指定されていません")
                 raise ValueError("削除条件が指定されていません")
-
-            if self.tenant_id and 'tenant_id' in datamodel.__fields__:
-                tenant_condition = f"tenant_id = '{self.tenant_id}'"
-                if where_clause:
-                    where_clause = where_clause + f" AND {tenant_condition}"
-                else:
-                    where_clause = f" WHERE {tenant_condition}"
-
-            return f"DELETE FROM {table_name} {where_clause} RETURNING *;"
+            data_map = datamodel.model_dump(exclude_unset=True) if sqltype == "update" else {}
+            sql = _compile(
+                model_class,
+                sqltype,
+                condition_shape,
+                self.schema,
+                tenant_scoped,
+                value_fields=tuple(data_map.keys()),
+            )
+            return sql, tuple(list(data_map.values()) + condition_params + tenant_params)
 
         else:
             raise ValueError("無効なSQLタイプです。対応している種類: 'select', 'insert', 'update', 'delete'")
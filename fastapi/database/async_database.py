@@ -0,0 +1,574 @@
+import asyncio
+import itertools
+import logging
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import Depends, Request
+from jose import JWTError, jwt
+from psycopg import AsyncClientCursor, errors
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+
+from config import settings
+from database import bulk
+from database.query_stats import query_stats
+from database.replicas import ReplicaSet, parse_replica_urls
+from database.rows import build_rows, row_maker
+
+logger = logging.getLogger(__name__)
+
+_cursor_names = itertools.count(1)
+# 読み取り専用トランザクションで処理する HTTP メソッド
+READ_ONLY_METHODS = frozenset({"GET", "HEAD"})
+# 時間切れとして扱うドライバの例外 (statement_timeout / lock_timeout / プールの接続待ち)
+_TIMEOUT_ERRORS = (errors.QueryCanceled, errors.LockNotAvailable, PoolTimeout)
+# 既定と異なる時間予算を設定した接続 (プールに戻すときに RESET する)
+_custom_timeouts: "weakref.WeakSet[Any]" = weakref.WeakSet()
+
+
+class DatabaseTimeoutError(Exception):
+    """クエリ・ロック待ち・接続待ちが時間予算を超えた (main.py で 503 に変換する)"""
+
+
+def database_error(exc: Exception) -> Exception:
+    """ドライバの例外をアプリ側の例外に置き換える。時間切れは DatabaseTimeoutError にする"""
+    if isinstance(exc, _TIMEOUT_ERRORS):
+        return DatabaseTimeoutError(f"Database timeout: {exc}")
+    return Exception(f"Database error: {exc}")
+
+
+def build_conninfo(dsn: Optional[str] = None) -> str:
+    """設定値 (レプリカなら ``dsn``) から libpq 形式の接続文字列を組み立てる
+
+    既定の statement_timeout / lock_timeout は接続時のオプションで渡すため、
+    既定の時間予算で済むリクエストでは設定のための往復が発生しない。
+    """
+    options = f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS} -c lock_timeout={settings.DB_LOCK_TIMEOUT_MS}"
+    if dsn:
+        return make_conninfo(dsn, options=options)
+    return make_conninfo(
+        host=settings.DB_HOST,
+        port=settings.DB_PORT,
+        dbname=settings.DB_NAME,
+        user=settings.DB_USER,
+        password=settings.DB_PASSWORD,
+        options=options,
+    )
+
+
+def routing_key(tenant_id: Optional[str], username: Optional[str]) -> Optional[str]:
+    """書き込み直後の読み取りをプライマリに向けるための利用者キー"""
+    if not username:
+        return None
+    return f"{tenant_id or ''}:{username}"
+
+
+def _request_routing_key(request: Request) -> Optional[str]:
+    """Bearer トークンの利用者キー (振り分けにしか使わないので署名は検証しない)"""
+    authorization = request.headers.get("authorization")
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        claims = jwt.get_unverified_claims(authorization[7:].strip())
+    except JWTError:
+        return None
+    return routing_key(claims.get("tenant_id"), claims.get("sub"))
+
+
+async def _open_pool(conninfo: str) -> AsyncConnectionPool:
+    connection_pool = AsyncConnectionPool(
+        conninfo,
+        min_size=settings.DB_POOL_MIN_SIZE,
+        max_size=settings.DB_POOL_MAX_SIZE,
+        timeout=settings.DB_POOL_TIMEOUT,
+        max_idle=settings.DB_POOL_MAX_IDLE,
+        max_lifetime=settings.DB_POOL_MAX_LIFETIME,
+        check=AsyncConnectionPool.check_connection,
+        reset=_reset_session,
+        open=False,
+    )
+    await connection_pool.open()
+    return connection_pool
+
+
+def _pool_stats(pool: AsyncConnectionPool) -> Dict[str, Any]:
+    stats = pool.get_stats()
+    size = stats.get("pool_size", 0)
+    idle = stats.get("pool_available", 0)
+    requests = stats.get("requests_num", 0)
+    return {
+        "min_size": pool.min_size,
+        "max_size": pool.max_size,
+        "size": size,
+        "in_use": size - idle,
+        "idle": idle,
+        "waiting": stats.get("requests_waiting", 0),
+        "requests": requests,
+        "requests_waited": stats.get("requests_queued", 0),
+        "timeouts": stats.get("requests_errors", 0),
+        "avg_wait_ms": round(stats.get("requests_wait_ms", 0) / requests, 3) if requests else 0.0,
+        "connections_created": stats.get("connections_num", 0),
+        "connections_discarded": stats.get("connections_lost", 0),
+    }
+
+
+async def _reset_session(connection) -> None:
+    """プールに戻った接続のセッション設定を既定に戻す (読み取り専用指定・時間予算)"""
+    if connection.read_only is not None:
+        await connection.set_read_only(None)
+    if connection in _custom_timeouts:
+        await connection.execute("RESET statement_timeout; RESET lock_timeout")
+        await connection.commit()
+        _custom_timeouts.discard(connection)
+
+
+class AsyncDatabaseService:
+    """DatabaseService の asyncio 版。イベントループをブロックせずにクエリを実行する。"""
+
+    _connection_pool: Optional[AsyncConnectionPool] = None
+    _pool_lock = asyncio.Lock()
+
+    @classmethod
+    async def get_connection_pool(cls) -> AsyncConnectionPool:
+        """非同期コネクションプールのシングルトンを取得"""
+        if cls._connection_pool is None:
+            async with cls._pool_lock:
+                if cls._connection_pool is None:
+                    try:
+                        cls._connection_pool = await _open_pool(build_conninfo())
+                        logger.info("Async database connection pool created successfully")
+                    except Exception as e:
+                        logger.error(f"Failed to create async connection pool: {e}")
+                        raise
+        return cls._connection_pool
+
+    @classmethod
+    def pool_stats(cls) -> Dict[str, Any]:
+        """プールの稼働カウンタを返す (未作成なら空)"""
+        if cls._connection_pool is None:
+            return {}
+        return _pool_stats(cls._connection_pool)
+
+    @classmethod
+    def replica_stats(cls) -> List[Dict[str, Any]]:
+        """レプリカごとの状態 (遅延・プール) を返す"""
+        return replica_set.stats(_pool_stats)
+
+    @classmethod
+    async def close_connection_pool(cls) -> None:
+        """アプリケーション終了時にプールを閉じる (レプリカのプールも含む)"""
+        if cls._connection_pool is not None:
+            await cls._connection_pool.close()
+            cls._connection_pool = None
+        await replica_set.close()
+
+    def __init__(
+        self,
+        read_only: bool = False,
+        statement_timeout_ms: Optional[int] = None,
+        lock_timeout_ms: Optional[int] = None,
+        replica: bool = False,
+    ):
+        self.pool: Optional[AsyncConnectionPool] = None
+        self.connection = None
+        self.cursor = None
+        self.read_only = read_only
+        # True なら使えるレプリカから読む (read_only のときだけ)
+        self.replica = replica and read_only
+        self.replica_name: Optional[str] = None
+        # 書き込みを確定したときに記録する利用者キー (routing_key)
+        self.routing_key: Optional[str] = None
+        self.statement_timeout_ms = statement_timeout_ms
+        self.lock_timeout_ms = lock_timeout_ms
+        self._depth = 0
+        # コミット後に呼ぶ関数 (ロールバックなら捨てる)
+        self._on_commit: List[Callable[[], None]] = []
+
+    async def __aenter__(self):
+        """非同期コンテキストマネージャーのエントリ
+
+        ブロック全体が 1 つのトランザクションになり、抜けるときに 1 回だけ COMMIT する
+        (例外なら ROLLBACK)。``read_only=True`` なら BEGIN READ ONLY で始まる。
+        接続待ちが ``DB_POOL_TIMEOUT`` を超えたら DatabaseTimeoutError を送出する。
+        ``replica=True`` ならレプリカから借り、借りられなければプライマリを使う。
+        """
+        await self._acquire()
+        return self
+
+    async def _acquire(self) -> None:
+        replica = replica_set.choose() if self.replica else None
+        if replica is not None:
+            try:
+                self.connection = await replica.pool.getconn()
+                self.pool = replica.pool
+                self.replica_name = replica.name
+            except Exception as exc:  # noqa: BLE001
+                replica_set.mark_down(replica, exc)
+        if self.connection is None:
+            self.pool = await AsyncDatabaseService.get_connection_pool()
+            try:
+                self.connection = await self.pool.getconn()
+            except PoolTimeout as exc:
+                logger.warning("Timed out waiting for a database connection: %s", exc)
+                raise database_error(exc)
+        if self.read_only:
+            await self.connection.set_read_only(True)
+        self.cursor = self.connection.cursor()
+        if self.statement_timeout_ms is not None or self.lock_timeout_ms is not None:
+            await self.set_timeouts(self.statement_timeout_ms, self.lock_timeout_ms)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """非同期コンテキストマネージャーの終了"""
+        if self.cursor:
+            await self.cursor.close()
+        if self.connection:
+            try:
+                if exc_type is None:
+                    await self.connection.commit()
+                    self._committed()
+                else:
+                    self._on_commit.clear()
+                    await self.connection.rollback()
+            finally:
+                await self.pool.putconn(self.connection)
+
+    async def release(self) -> None:
+        """接続を先にプールへ返す (リクエストの残りで DB を使わないとき)
+
+        未確定の変更はコミットする。以降このインスタンスではクエリを実行できない。
+        """
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        cursor, self.cursor = self.cursor, None
+        try:
+            await cursor.close()
+            await connection.commit()
+            self._committed()
+        finally:
+            await self.pool.putconn(connection)
+
+    async def reacquire(self) -> None:
+        """release() の後でもう一度接続を借りる (新しいトランザクションになる)
+
+        パスワードのハッシュ計算のように時間のかかる処理を、接続を持たずに挟むときに使う。
+        時間予算と読み取り専用指定は最初に借りたときと同じ。返却はブロックを抜けるときに行う。
+        """
+        if self.connection is not None:
+            return
+        self.pool = None
+        self.replica_name = None
+        await self._acquire()
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator["AsyncDatabaseService"]:
+        """作業単位。最も外側のブロックを抜けるときに COMMIT し、入れ子はセーブポイントにする
+
+        FastAPI の依存関数の後始末はレスポンス送信後に走るため、書き込む処理は
+        このブロックで囲んでレスポンスを返す前に確定させる。
+        """
+        if self._depth == 0:
+            self._depth = 1
+            try:
+                yield self
+            except BaseException:
+                self._depth = 0
+                self._on_commit.clear()
+                await self.connection.rollback()
+                raise
+            self._depth = 0
+            await self.connection.commit()
+            self._committed()
+            return
+
+        savepoint = f"uow_{self._depth}"
+        self._depth += 1
+        await self.cursor.execute(f"SAVEPOINT {savepoint}")
+        try:
+            yield self
+        except BaseException:
+            await self.cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+            raise
+        else:
+            await self.cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+        finally:
+            self._depth -= 1
+
+    async def set_timeouts(
+        self, statement_timeout_ms: Optional[int] = None, lock_timeout_ms: Optional[int] = None
+    ) -> None:
+        """この接続の statement_timeout / lock_timeout を変える (ミリ秒、None は既定のまま)
+
+        超えた文はサーバー側で取り消され、DatabaseTimeoutError になる。既定と同じなら何もしない。
+        変更はセッション単位で、接続がプールに戻るときに既定へ戻される。
+        """
+        statement_timeout_ms = settings.DB_STATEMENT_TIMEOUT_MS if statement_timeout_ms is None else statement_timeout_ms
+        lock_timeout_ms = settings.DB_LOCK_TIMEOUT_MS if lock_timeout_ms is None else lock_timeout_ms
+        self.statement_timeout_ms = statement_timeout_ms
+        self.lock_timeout_ms = lock_timeout_ms
+        if (
+            statement_timeout_ms == settings.DB_STATEMENT_TIMEOUT_MS
+            and lock_timeout_ms == settings.DB_LOCK_TIMEOUT_MS
+            and self.connection not in _custom_timeouts
+        ):
+            return
+        await self.execute_query(
+            "SELECT set_config('statement_timeout', %s, false), set_config('lock_timeout', %s, false)",
+            (str(int(statement_timeout_ms)), str(int(lock_timeout_ms))),
+            row_format="tuple",
+        )
+        _custom_timeouts.add(self.connection)
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        """現在のトランザクションがコミットされたら ``callback`` を呼ぶ (ロールバックなら呼ばない)"""
+        self._on_commit.append(callback)
+
+    def _committed(self) -> None:
+        """書き込みを確定した利用者の読み取りを、しばらくプライマリに向ける"""
+        if not self.read_only:
+            replica_set.mark_write(self.routing_key)
+        callbacks, self._on_commit = self._on_commit, []
+        for callback in callbacks:
+            callback()
+
+    async def _abort(self) -> None:
+        """文が失敗したときの後始末。transaction() の中ならそのスコープに任せる"""
+        if self._depth == 0:
+            self._on_commit.clear()
+            await self.connection.rollback()
+
+    async def execute_query(
+        self,
+        query: str,
+        params: tuple = None,
+        tenant_id: str = None,
+        prepare: bool = False,
+        row_format: str = "dict",
+    ) -> List[Any]:
+        """クエリを実行して結果を返す
+
+        psycopg 3 は同じクエリが繰り返されると自動でプリペアするが、
+        ``prepare=True`` なら初回からサーバー側で PREPARE する。
+        ``row_format`` は "dict" (既定) / "row" / "tuple" (database/rows.py を参照)。
+        実行時間は database/query_stats.py に記録される。
+        """
+        started = time.perf_counter()
+        result = await self._execute_query(query, params, prepare, row_format)
+        duration_ms = (time.perf_counter() - started) * 1000
+        if query_stats.record(query, duration_ms, max(len(result), self.cursor.rowcount)):
+            await self._capture_plan(query, params)
+        return result
+
+    async def _capture_plan(self, query: str, params: tuple = None) -> None:
+        """遅い SELECT の実行計画をセーブポイント内で取得して記録する"""
+        try:
+            async with self.connection.transaction():
+                cursor = self.connection.cursor()
+                await cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query}", params or None)
+                plan = "\n".join(row[0] for row in await cursor.fetchall())
+                await cursor.close()
+            query_stats.store_plan(query, plan)
+        except Exception as exc:
+            logger.warning("Failed to capture query plan: %s", exc)
+
+    async def _execute_query(self, query: str, params: tuple, prepare: bool, row_format: str) -> List[Any]:
+        try:
+            if prepare:
+                await self.cursor.execute(query, params, prepare=True)
+            elif params:
+                await self.cursor.execute(query, params)
+            else:
+                await self.cursor.execute(query)
+
+            # コミットはトランザクションの境界 (transaction() / __aexit__) でまとめて行う
+            if self.cursor.description is None:
+                return []
+            rows = await self.cursor.fetchall()
+            return build_rows(self.cursor.description, rows, row_format)
+        except Exception as e:
+            await self._abort()
+            logger.error(f"Database error: {e}")
+            raise database_error(e)
+
+    async def execute_batch(
+        self,
+        statements: Sequence[Tuple[str, Optional[tuple]]],
+        row_format: str = "dict",
+    ) -> List[List[Any]]:
+        """互いに依存しない SELECT を 1 回の送信にまとめて実行し、文ごとの結果を返す
+
+        パラメータをクライアント側で埋め込んだ複数文を simple query で送り、結果セットを
+        順に受け取るため、待ち時間は N 往復ではなく 1 往復になる。前の結果を使う文や
+        書き込みには使わないこと。各文の実行時間にはバッチ全体の所要時間が記録される。
+        """
+        if not statements:
+            return []
+        started = time.perf_counter()
+        sql = ";\n".join(query.strip().rstrip(";") for query, _ in statements)
+        params = tuple(value for _, values in statements for value in (values or ()))
+        cursor = AsyncClientCursor(self.connection)
+        try:
+            # 空タプルでも渡す (%% を常に % に戻すため)
+            await cursor.execute(sql, params)
+            results = [build_rows(cursor.description, await cursor.fetchall(), row_format)]
+            while cursor.nextset():
+                results.append(build_rows(cursor.description, await cursor.fetchall(), row_format))
+        except Exception as e:
+            await self._abort()
+            logger.error(f"Database error: {e}")
+            raise database_error(e)
+        finally:
+            await cursor.close()
+        if len(results) != len(statements):
+            raise Exception(f"Database error: expected {len(statements)} result sets, got {len(results)}")
+        duration_ms = (time.perf_counter() - started) * 1000
+        for (query, _), result in zip(statements, results):
+            query_stats.record(query, duration_ms, len(result))
+        return results
+
+    async def stream_query(
+        self,
+        query: str,
+        params: tuple = None,
+        itersize: Optional[int] = None,
+        row_format: str = "dict",
+    ) -> AsyncIterator[Any]:
+        """名前付き (サーバーサイド) カーソルで結果を ``itersize`` 行ずつ取得しながら返す
+
+        StreamingResponse などで結果全体をメモリに載せずに送るために使う。
+        """
+        cursor = self.connection.cursor(name=f"stream_{next(_cursor_names)}")
+        cursor.itersize = itersize or settings.DB_STREAM_ITERSIZE
+        try:
+            await cursor.execute(query, params)
+            make_row = row_maker(cursor.description, row_format)
+            async for row in cursor:
+                yield make_row(row)
+        except Exception as e:
+            await self._abort()
+            logger.error(f"Database error: {e}")
+            raise database_error(e)
+        finally:
+            if not cursor.closed:
+                await cursor.close()
+
+    async def _insert_batches(
+        self,
+        table: str,
+        columns: Sequence[str],
+        rows: Iterable[bulk.Row],
+        suffix: str,
+        batch_size: int,
+    ) -> List[Dict[str, Any]]:
+        prefix = bulk.insert_prefix(table, columns)
+        row_placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        batch_size = max(1, min(batch_size, bulk.MAX_BIND_PARAMS // len(columns)))
+        fetch = " RETURNING " in suffix
+        results: List[Dict[str, Any]] = []
+        try:
+            for batch in bulk.iter_batches(rows, columns, batch_size):
+                sql = prefix + ", ".join([row_placeholder] * len(batch)) + suffix
+                await self.cursor.execute(sql, [value for row in batch for value in row])
+                if fetch:
+                    names = [desc[0] for desc in self.cursor.description]
+                    results.extend(dict(zip(names, row)) for row in await self.cursor.fetchall())
+            return results
+        except Exception as e:
+            await self._abort()
+            logger.error(f"Database error: {e}")
+            raise database_error(e)
+
+    async def bulk_insert(
+        self,
+        table: str,
+        columns: Sequence[str],
+        rows: Iterable[bulk.Row],
+        *,
+        returning: Optional[Sequence[str]] = None,
+        batch_size: int = bulk.DEFAULT_BATCH_SIZE,
+    ) -> List[Dict[str, Any]]:
+        """複数行 VALUES でまとめて INSERT する (returning 指定時は返却行を返す)"""
+        suffix = bulk.insert_suffix(columns, returning=returning)
+        return await self._insert_batches(table, columns, rows, suffix, batch_size)
+
+    async def bulk_upsert(
+        self,
+        table: str,
+        columns: Sequence[str],
+        rows: Iterable[bulk.Row],
+        conflict_columns: Sequence[str],
+        *,
+        update_columns: Optional[Sequence[str]] = None,
+        returning: Optional[Sequence[str]] = None,
+        batch_size: int = bulk.DEFAULT_BATCH_SIZE,
+    ) -> List[Dict[str, Any]]:
+        """INSERT ... ON CONFLICT DO UPDATE でまとめて書き込む
+
+        ``update_columns`` 省略時は衝突キー以外の全列を更新し、空なら DO NOTHING にする。
+        """
+        suffix = bulk.insert_suffix(
+            columns,
+            conflict_columns=conflict_columns,
+            update_columns=update_columns,
+            returning=returning,
+        )
+        return await self._insert_batches(table, columns, rows, suffix, batch_size)
+
+    async def copy_from_iter(self, table: str, columns: Sequence[str], rows: Iterable[bulk.Row]) -> int:
+        """COPY FROM STDIN で行を流し込み、件数を返す (行は逐次送られる)"""
+        count = 0
+        try:
+            async with self.cursor.copy(bulk.copy_sql(table, columns)) as copy:
+                for row in rows:
+                    await copy.write_row(bulk.row_values(row, columns))
+                    count += 1
+            return count
+        except Exception as e:
+            await self._abort()
+            logger.error(f"Database error: {e}")
+            raise database_error(e)
+
+
+async def get_async_db_service(request: Request):
+    """依存性注入用の非同期データベースサービス取得関数
+
+    リクエストごとに 1 トランザクション。GET / HEAD は読み取り専用トランザクションになり、
+    レプリカがあればそちらで読む (直前に書き込んだ利用者はプライマリ)。
+    時間予算は既定 (``DB_STATEMENT_TIMEOUT_MS`` / ``DB_LOCK_TIMEOUT_MS``) で、
+    ルートごとに変えるときは ``db_deadline`` を使う。
+    """
+    read_only = request.method in READ_ONLY_METHODS
+    key = _request_routing_key(request) if replica_set.configured else None
+    async with AsyncDatabaseService(
+        read_only=read_only,
+        replica=read_only and not replica_set.recently_wrote(key),
+    ) as db:
+        db.routing_key = key
+        yield db
+
+
+def db_deadline(statement_timeout_ms: int, lock_timeout_ms: Optional[int] = None):
+    """ルート単位の時間予算を設定する依存関数を返す
+
+        @router.get("/dashboard", dependencies=[Depends(db_deadline(settings.DB_REPORT_STATEMENT_TIMEOUT_MS))])
+
+    ``dependencies=`` に渡すとルートの引数より先に解決されるため、認証のクエリを含め
+    リクエスト内のすべての文に適用される (get_async_db_service と同じ接続を共有する)。
+    """
+
+    async def apply_deadline(db: AsyncDatabaseService = Depends(get_async_db_service)) -> None:
+        await db.set_timeouts(statement_timeout_ms, lock_timeout_ms)
+
+    return apply_deadline
+
+
+replica_set = ReplicaSet(
+    parse_replica_urls(settings.DB_REPLICA_URLS),
+    open_pool=lambda dsn: _open_pool(build_conninfo(dsn)),
+    max_lag_seconds=settings.DB_REPLICA_MAX_LAG_SECONDS,
+    check_interval=settings.DB_REPLICA_LAG_CHECK_INTERVAL,
+    read_your_writes_seconds=settings.DB_READ_YOUR_WRITES_SECONDS,
+)
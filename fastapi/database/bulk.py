@@ -0,0 +1,122 @@
+"""一括書き込み (bulk_insert / bulk_upsert / copy_from_iter) の共通処理。
+
+行は dict (列名で値を取り出す) でもタプル (列順) でもよい。
+イテラブルは一度に読み込まず、バッチ単位で取り出して送る。
+"""
+import io
+import json
+from datetime import date, datetime, time
+from itertools import islice
+from typing import Any, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+Row = Union[Mapping[str, Any], Sequence[Any]]
+
+DEFAULT_BATCH_SIZE = 1000
+# PostgreSQL のバインドパラメータ数の上限
+MAX_BIND_PARAMS = 65535
+
+
+def quote_ident(name: str) -> str:
+    """識別子をクォートする (``schema.table`` も可)"""
+    return ".".join('"' + part.replace('"', '""') + '"' for part in name.split("."))
+
+
+def row_values(row: Row, columns: Sequence[str]) -> Tuple[Any, ...]:
+    if isinstance(row, Mapping):
+        return tuple(row.get(column) for column in columns)
+    values = tuple(row)
+    if len(values) != len(columns):
+        raise ValueError(f"Expected {len(columns)} values per row, got {len(values)}")
+    return values
+
+
+def iter_batches(rows: Iterable[Row], columns: Sequence[str], batch_size: int) -> Iterator[List[Tuple[Any, ...]]]:
+    iterator = iter(rows)
+    while True:
+        batch = [row_values(row, columns) for row in islice(iterator, batch_size)]
+        if not batch:
+            return
+        yield batch
+
+
+def insert_prefix(table: str, columns: Sequence[str]) -> str:
+    column_list = ", ".join(quote_ident(column) for column in columns)
+    return f"INSERT INTO {quote_ident(table)} ({column_list}) VALUES "
+
+
+def insert_suffix(
+    columns: Sequence[str],
+    *,
+    conflict_columns: Optional[Sequence[str]] = None,
+    update_columns: Optional[Sequence[str]] = None,
+    returning: Optional[Sequence[str]] = None,
+) -> str:
+    suffix = ""
+    if conflict_columns:
+        targets = ", ".join(quote_ident(column) for column in conflict_columns)
+        if update_columns is None:
+            update_columns = [column for column in columns if column not in conflict_columns]
+        if update_columns:
+            assignments = ", ".join(
+                f"{quote_ident(column)} = EXCLUDED.{quote_ident(column)}" for column in update_columns
+            )
+            suffix += f" ON CONFLICT ({targets}) DO UPDATE SET {assignments}"
+        else:
+            suffix += f" ON CONFLICT ({targets}) DO NOTHING"
+    if returning:
+        suffix += " RETURNING " + ", ".join(
+            "*" if column == "*" else quote_ident(column) for column in returning
+        )
+    return suffix
+
+
+def copy_sql(table: str, columns: Sequence[str]) -> str:
+    column_list = ", ".join(quote_ident(column) for column in columns)
+    return f"COPY {quote_ident(table)} ({column_list}) FROM STDIN"
+
+
+def _copy_text_value(value: Any) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, dict):
+        value = json.dumps(value, ensure_ascii=False)
+    elif isinstance(value, (date, datetime, time)):
+        value = value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class CopyTextStream(io.TextIOBase):
+    """行のイテラブルを COPY の text 形式として少しずつ読み出せるファイルにする"""
+
+    def __init__(self, rows: Iterable[Row], columns: Sequence[str]):
+        self._rows = iter(rows)
+        self._columns = columns
+        self._buffer = ""
+        self.row_count = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: Optional[int] = -1) -> str:
+        if size is None or size < 0:
+            size = 1 << 62
+        while len(self._buffer) < size:
+            try:
+                row = next(self._rows)
+            except StopIteration:
+                break
+            self._buffer += "\t".join(_copy_text_value(value) for value in row_values(row, self._columns)) + "\n"
+            self.row_count += 1
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+    def readline(self, size: Optional[int] = -1) -> str:
+        return self.read(size)
@@ -1,23 +1,53 @@
-import psycopg2
-from psycopg2 import pool
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Sequence, Tuple
+import hashlib
+import itertools
 import logging
+import re
+import time
+import weakref
+from contextlib import contextmanager
+from psycopg2.extras import execute_values
 from config import settings
+from database import bulk
+from database.query_stats import query_stats
+from database.rows import build_rows, row_maker
+from database.pool import BoundedConnectionPool
 
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+_cursor_names = itertools.count(1)
+_PLACEHOLDER_PATTERN = re.compile(r"%(s|%)")
+# 接続ごとに PREPARE 済みの文 (名前 -> パラメータ数)。接続が破棄されれば消える
+_prepared_statements: "weakref.WeakKeyDictionary[Any, Dict[str, int]]" = weakref.WeakKeyDictionary()
+
+
+def _to_server_placeholders(query: str) -> Tuple[str, int]:
+    """%s を $1, $2 ... に置き換える (%% は % に戻す)"""
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        if match.group(1) == "%":
+            return "%"
+        count += 1
+        return f"${count}"
+
+    return _PLACEHOLDER_PATTERN.sub(replace, query), count
+
 class DatabaseService:
-    _connection_pool: Optional[pool.SimpleConnectionPool] = None
+    _connection_pool: Optional[BoundedConnectionPool] = None
 
     @classmethod
     def get_connection_pool(cls):
         """コネクションプールのシングルトンを取得"""
         if cls._connection_pool is None:
             try:
-                cls._connection_pool = psycopg2.pool.SimpleConnectionPool(
-                    1,  # 最小接続数
-                    20,  # 最大接続数
+                cls._connection_pool = BoundedConnectionPool(
+                    settings.DB_POOL_MIN_SIZE,
+                    settings.DB_POOL_MAX_SIZE,
+                    timeout=settings.DB_POOL_TIMEOUT,
+                    max_idle=settings.DB_POOL_MAX_IDLE,
+                    max_lifetime=settings.DB_POOL_MAX_LIFETIME,
                     host=settings.DB_HOST,
                     port=settings.DB_PORT,
                     database=settings.DB_NAME,
@@ -30,10 +60,25 @@ class DatabaseService:
                 raise
         return cls._connection_pool
 
+    @classmethod
+    def pool_stats(cls) -> Dict[str, Any]:
+        """プールの稼働カウンタを返す (未作成なら空)"""
+        if cls._connection_pool is None:
+            return {}
+        return cls._connection_pool.stats()
+
+    @classmethod
+    def close_connection_pool(cls) -> None:
+        """プールの接続をすべて閉じる (次に使うときに作り直される)"""
+        if cls._connection_pool is not None:
+            cls._connection_pool.closeall()
+            cls._connection_pool = None
+
     def __init__(self):
         self.pool = DatabaseService.get_connection_pool()
         self.connection = None
         self.cursor = None
+        self._depth = 0
 
     def __enter__(self):
         """コンテキストマネージャーのエントリ"""
@@ -52,30 +97,208 @@ class DatabaseService:
                 self.connection.rollback()
             self.pool.putconn(self.connection)
 
-    def execute_query(self, query: str, params: tuple = None, tenant_id: str = None) -> List[Dict[str, Any]]:
-        """クエリを実行して結果を返す"""
+    @contextmanager
+    def transaction(self) -> Iterator["DatabaseService"]:
+        """作業単位。最も外側のブロックを抜けるときに COMMIT し、入れ子はセーブポイントにする"""
+        if self._depth == 0:
+            self._depth = 1
+            try:
+                yield self
+            except BaseException:
+                self._depth = 0
+                self.connection.rollback()
+                raise
+            self._depth = 0
+            self.connection.commit()
+            return
+
+        savepoint = f"uow_{self._depth}"
+        self._depth += 1
+        self.cursor.execute(f"SAVEPOINT {savepoint}")
+        try:
+            yield self
+        except BaseException:
+            self.cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+            raise
+        else:
+            self.cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+        finally:
+            self._depth -= 1
+
+    def _abort(self) -> None:
+        """文が失敗したときの後始末。transaction() の中ならそのスコープに任せる"""
+        if self._depth == 0:
+            self.connection.rollback()
+
+    def _prepare(self, query: str) -> Tuple[str, int]:
+        """この接続でクエリを PREPARE し、文の名前とパラメータ数を返す"""
+        statement = query.strip().rstrip(";")
+        name = "qc_" + hashlib.sha1(statement.encode("utf-8")).hexdigest()[:16]
+        prepared = _prepared_statements.setdefault(self.connection, {})
+        if name not in prepared:
+            server_sql, param_count = _to_server_placeholders(statement)
+            self.cursor.execute(f"PREPARE {name} AS {server_sql}")
+            prepared[name] = param_count
+        return name, prepared[name]
+
+    def execute_query(
+        self,
+        query: str,
+        params: tuple = None,
+        tenant_id: str = None,
+        prepare: bool = False,
+        row_format: str = "dict",
+    ) -> List[Any]:
+        """クエリを実行して結果を返す
+
+        ``prepare=True`` の場合はサーバー側のプリペアドステートメントとして実行する
+        (QueryComposer が返す同じ形のクエリを繰り返し実行するときに使う)。
+        ``row_format`` は "dict" (既定) / "row" / "tuple" (database/rows.py を参照)。
+        実行時間は database/query_stats.py に記録される。
+        """
+        started = time.perf_counter()
+        result = self._execute_query(query, params, prepare, row_format)
+        duration_ms = (time.perf_counter() - started) * 1000
+        if query_stats.record(query, duration_ms, max(len(result), self.cursor.rowcount)):
+            self._capture_plan(query, params)
+        return result
+
+    def _capture_plan(self, query: str, params: tuple = None) -> None:
+        """遅い SELECT の実行計画をセーブポイント内で取得して記録する"""
         try:
-            if params:
+            self.cursor.execute("SAVEPOINT query_stats_explain")
+            self.cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query}", params or None)
+            plan = "\n".join(row[0] for row in self.cursor.fetchall())
+            self.cursor.execute("RELEASE SAVEPOINT query_stats_explain")
+            query_stats.store_plan(query, plan)
+        except Exception as exc:
+            logger.warning("Failed to capture query plan: %s", exc)
+            try:
+                self.cursor.execute("ROLLBACK TO SAVEPOINT query_stats_explain")
+            except Exception:
+                self.connection.rollback()
+
+    def _execute_query(self, query: str, params: tuple, prepare: bool, row_format: str) -> List[Any]:
+        try:
+            if prepare:
+                name, param_count = self._prepare(query)
+                arguments = f" ({', '.join(['%s'] * param_count)})" if param_count else ""
+                self.cursor.execute(f"EXECUTE {name}{arguments}", params or None)
+            elif params:
                 self.cursor.execute(query, params)
             else:
                 self.cursor.execute(query)
 
-            if query.strip().upper().startswith("SELECT"):
-                columns = [desc[0] for desc in self.cursor.description]
-                rows = self.cursor.fetchall()
-                return [dict(zip(columns, row)) for row in rows]
-            else:
-                self.connection.commit()
-                if query.strip().upper().startswith("INSERT") or query.strip().upper().startswith("UPDATE"):
-                    try:
-                        columns = [desc[0] for desc in self.cursor.description]
-                        rows = self.cursor.fetchall()
-                        return [dict(zip(columns, row)) for row in rows]
-                    except:
-                        return []
+            # コミットはトランザクションの境界 (transaction() / __exit__) でまとめて行う
+            if self.cursor.description is None:
                 return []
+            rows = self.cursor.fetchall()
+            return build_rows(self.cursor.description, rows, row_format)
         except Exception as e:
-            self.connection.rollback()
+            self._abort()
+            logger.error(f"Database error: {e}")
+            raise Exception(f"Database error: {str(e)}")
+
+    def stream_query(
+        self,
+        query: str,
+        params: tuple = None,
+        itersize: Optional[int] = None,
+        row_format: str = "dict",
+    ) -> Iterator[Any]:
+        """名前付き (サーバーサイド) カーソルで結果を ``itersize`` 行ずつ取得しながら返す
+
+        結果全体をメモリに載せないため、大きなエクスポートや集計に使う。
+        カーソルはトランザクション内でのみ有効なので、読み切るまで接続を返さないこと。
+        """
+        cursor = self.connection.cursor(name=f"stream_{next(_cursor_names)}")
+        cursor.itersize = itersize or settings.DB_STREAM_ITERSIZE
+        try:
+            cursor.execute(query, params)
+            make_row = None
+            for row in cursor:
+                if make_row is None:
+                    make_row = row_maker(cursor.description, row_format)
+                yield make_row(row)
+        except Exception as e:
+            self._abort()
+            logger.error(f"Database error: {e}")
+            raise Exception(f"Database error: {str(e)}")
+        finally:
+            # ロールバック後は名前付きカーソルがサーバー側で消えているため閉じるだけにする
+            if not cursor.closed:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+
+    def _insert_batches(
+        self,
+        table: str,
+        columns: Sequence[str],
+        rows: Iterable[bulk.Row],
+        suffix: str,
+        batch_size: int,
+    ) -> List[Dict[str, Any]]:
+        sql = bulk.insert_prefix(table, columns) + "%s" + suffix
+        fetch = " RETURNING " in suffix
+        results: List[Dict[str, Any]] = []
+        try:
+            for batch in bulk.iter_batches(rows, columns, batch_size):
+                returned = execute_values(self.cursor, sql, batch, page_size=len(batch), fetch=fetch)
+                if fetch:
+                    names = [desc[0] for desc in self.cursor.description]
+                    results.extend(dict(zip(names, row)) for row in returned)
+            return results
+        except Exception as e:
+            self._abort()
+            logger.error(f"Database error: {e}")
+            raise Exception(f"Database error: {str(e)}")
+
+    def bulk_insert(
+        self,
+        table: str,
+        columns: Sequence[str],
+        rows: Iterable[bulk.Row],
+        *,
+        returning: Optional[Sequence[str]] = None,
+        batch_size: int = bulk.DEFAULT_BATCH_SIZE,
+    ) -> List[Dict[str, Any]]:
+        """複数行 VALUES でまとめて INSERT する (returning 指定時は返却行を返す)"""
+        suffix = bulk.insert_suffix(columns, returning=returning)
+        return self._insert_batches(table, columns, rows, suffix, batch_size)
+
+    def bulk_upsert(
+        self,
+        table: str,
+        columns: Sequence[str],
+        rows: Iterable[bulk.Row],
+        conflict_columns: Sequence[str],
+        *,
+        update_columns: Optional[Sequence[str]] = None,
+        returning: Optional[Sequence[str]] = None,
+        batch_size: int = bulk.DEFAULT_BATCH_SIZE,
+    ) -> List[Dict[str, Any]]:
+        """INSERT ... ON CONFLICT DO UPDATE でまとめて書き込む
+
+        ``update_columns`` 省略時は衝突キー以外の全列を更新し、空なら DO NOTHING にする。
+        """
+        suffix = bulk.insert_suffix(
+            columns,
+            conflict_columns=conflict_columns,
+            update_columns=update_columns,
+            returning=returning,
+        )
+        return self._insert_batches(table, columns, rows, suffix, batch_size)
+
+    def copy_from_iter(self, table: str, columns: Sequence[str], rows: Iterable[bulk.Row]) -> int:
+        """COPY FROM STDIN で行を流し込み、件数を返す (行は逐次読み出される)"""
+        stream = bulk.CopyTextStream(rows, columns)
+        try:
+            self.cursor.copy_expert(bulk.copy_sql(table, columns), stream)
+            return stream.row_count
+        except Exception as e:
+            self._abort()
             logger.error(f"Database error: {e}")
             raise Exception(f"Database error: {str(e)}")
 
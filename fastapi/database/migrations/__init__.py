@@ -0,0 +1,173 @@
+"""バージョン付きスキーマ移行。
+
+``versions/`` に ``NNNN_説明.sql`` または ``NNNN_説明.py`` (``upgrade(cursor)`` を定義) を置くと、
+番号順に 1 回だけ適用され、``schema_migrations`` に記録される。適用はアドバイザリロックで
+直列化されるため、複数ワーカーが同時に起動しても移行を実行するのは 1 プロセスだけになる。
+
+ワーカーの起動時は ``ensure_schema_current()`` が適用済みバージョンを確認するだけで、
+未適用の移行があるときだけロックを取って適用する (``DB_MIGRATE_ON_STARTUP=false`` なら起動を中止)。
+
+    python -m database.migrations status
+    python -m database.migrations upgrade [--target N]
+"""
+import argparse
+import hashlib
+import importlib.util
+import logging
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config import settings
+from database.database import DatabaseService
+
+logger = logging.getLogger(__name__)
+
+VERSIONS_DIR = Path(__file__).resolve().parent / "versions"
+# pg_advisory_lock のキー (アプリ内で一意な固定値)
+MIGRATION_LOCK_KEY = 0x5354414D50  # "STAMP"
+
+_FILENAME = re.compile(r"^(\d+)_(\w+)\.(sql|py)$")
+
+LEDGER_DDL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    checksum CHAR(64) NOT NULL,
+    duration_ms INTEGER NOT NULL DEFAULT 0,
+    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+class PendingMigrationsError(RuntimeError):
+    """未適用の移行が残っている (自動適用が無効な場合)"""
+
+
+class Migration:
+    __slots__ = ("version", "name", "path")
+
+    def __init__(self, version: int, name: str, path: Path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    @property
+    def checksum(self) -> str:
+        return hashlib.sha256(self.path.read_bytes()).hexdigest()
+
+    def apply(self, cursor) -> None:
+        if self.path.suffix == ".sql":
+            cursor.execute(self.path.read_text(encoding="utf-8"))
+            return
+        spec = importlib.util.spec_from_file_location(f"database.migrations.versions.m{self.version:04d}", self.path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.upgrade(cursor)
+
+    def __repr__(self) -> str:
+        return f"Migration({self.version:04d}_{self.name})"
+
+
+def discover_migrations(directory: Path = VERSIONS_DIR) -> List[Migration]:
+    """移行ファイルを番号順に返す (番号の重複はエラー)"""
+    migrations: Dict[int, Migration] = {}
+    for path in sorted(directory.iterdir()):
+        match = _FILENAME.match(path.name)
+        if match is None:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise ValueError(f"Duplicate migration version {version}: {migrations[version].path.name}, {path.name}")
+        migrations[version] = Migration(version, match.group(2), path)
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def _applied_checksums(cursor) -> Dict[int, str]:
+    cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return {}
+    cursor.execute("SELECT version, checksum FROM schema_migrations")
+    return {version: checksum for version, checksum in cursor.fetchall()}
+
+
+def pending_migrations(cursor, migrations: Optional[List[Migration]] = None) -> List[Migration]:
+    """未適用の移行を返す。適用済みファイルの書き換えは警告する"""
+    migrations = discover_migrations() if migrations is None else migrations
+    applied = _applied_checksums(cursor)
+    pending = []
+    for migration in migrations:
+        checksum = applied.get(migration.version)
+        if checksum is None:
+            pending.append(migration)
+        elif checksum != migration.checksum:
+            logger.warning("Migration %r was modified after it was applied", migration)
+    return pending
+
+
+def run_migrations(target: Optional[int] = None) -> List[Migration]:
+    """未適用の移行を適用する。移行ごとに 1 トランザクションで、成功したら記録する"""
+    migrations = [m for m in discover_migrations() if target is None or m.version <= target]
+    applied: List[Migration] = []
+    with DatabaseService() as db:
+        db.connection.commit()
+        db.cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        try:
+            db.cursor.execute(LEDGER_DDL)
+            db.connection.commit()
+            # ロック待ちの間に他のワーカーが適用した分は除かれる
+            for migration in pending_migrations(db.cursor, migrations):
+                started = time.perf_counter()
+                logger.info("Applying %r", migration)
+                try:
+                    migration.apply(db.cursor)
+                    duration_ms = int((time.perf_counter() - started) * 1000)
+                    db.cursor.execute(
+                        "INSERT INTO schema_migrations (version, name, checksum, duration_ms) VALUES (%s, %s, %s, %s)",
+                        (migration.version, migration.name, migration.checksum, duration_ms),
+                    )
+                    db.connection.commit()
+                except Exception:
+                    db.connection.rollback()
+                    logger.exception("Migration %r failed", migration)
+                    raise
+                applied.append(migration)
+        finally:
+            db.cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+            db.connection.commit()
+    return applied
+
+
+def ensure_schema_current() -> None:
+    """起動時の確認。未適用の移行があれば設定に応じて適用するか起動を止める"""
+    with DatabaseService() as db:
+        pending = pending_migrations(db.cursor)
+    if not pending:
+        return
+    if not settings.DB_MIGRATE_ON_STARTUP:
+        raise PendingMigrationsError(
+            "Pending migrations: " + ", ".join(repr(m) for m in pending)
+            + " (run `python -m database.migrations upgrade`)"
+        )
+    run_migrations()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="スキーマ移行を確認・適用する")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("status", help="適用状況を表示する")
+    upgrade = subcommands.add_parser("upgrade", help="未適用の移行を適用する")
+    upgrade.add_argument("--target", type=int, help="このバージョンまで適用する")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "upgrade":
+        applied = run_migrations(args.target)
+        print(f"Applied {len(applied)} migration(s)")
+        return
+    with DatabaseService() as db:
+        applied_versions = _applied_checksums(db.cursor)
+    for migration in discover_migrations():
+        state = "applied" if migration.version in applied_versions else "pending"
+        print(f"{migration.version:04d}  {state:8}  {migration.name}")
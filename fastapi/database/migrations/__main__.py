@@ -0,0 +1,3 @@
+from database.migrations import main
+
+main()
@@ -0,0 +1,54 @@
+-- 初期スキーマ以前の環境を現在の列構成に揃える。
+-- 型変更はテーブルを書き換えるため、型が異なる列だけを対象にする。
+
+DO $$
+DECLARE
+    target RECORD;
+BEGIN
+    FOR target IN
+        SELECT table_name
+        FROM information_schema.columns
+        WHERE table_schema = current_schema()
+          AND column_name = 'tenant_id'
+          AND table_name IN ('tenants', 'users', 'stores', 'reward_rules', 'user_progress', 'user_coupons', 'user_store_stamps')
+          AND (data_type <> 'character varying' OR character_maximum_length IS DISTINCT FROM 32)
+    LOOP
+        EXECUTE format('ALTER TABLE %I ALTER COLUMN tenant_id TYPE VARCHAR(32)', target.table_name);
+    END LOOP;
+END $$;
+
+ALTER TABLE tenants ADD COLUMN IF NOT EXISTS admin_password_hash VARCHAR(255);
+ALTER TABLE tenants ADD COLUMN IF NOT EXISTS admin_password_must_change BOOLEAN DEFAULT FALSE;
+ALTER TABLE tenants ADD COLUMN IF NOT EXISTS config JSONB DEFAULT '{}'::jsonb;
+ALTER TABLE tenants ADD COLUMN IF NOT EXISTS content_version INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS gender VARCHAR(20);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS age INTEGER CHECK (age >= 0 AND age <= 120);
+
+-- ユーザー名・メールアドレスの一意制約をテナント単位に置き換える
+ALTER TABLE users DROP CONSTRAINT IF EXISTS users_username_key;
+ALTER TABLE users DROP CONSTRAINT IF EXISTS users_email_key;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'users'::regclass AND contype = 'u'
+          AND conkey = ARRAY[
+              (SELECT attnum FROM pg_attribute WHERE attrelid = 'users'::regclass AND attname = 'tenant_id'),
+              (SELECT attnum FROM pg_attribute WHERE attrelid = 'users'::regclass AND attname = 'username')
+          ]::smallint[]
+    ) THEN
+        ALTER TABLE users ADD CONSTRAINT users_tenant_username_unique UNIQUE (tenant_id, username);
+    END IF;
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'users'::regclass AND contype = 'u'
+          AND conkey = ARRAY[
+              (SELECT attnum FROM pg_attribute WHERE attrelid = 'users'::regclass AND attname = 'tenant_id'),
+              (SELECT attnum FROM pg_attribute WHERE attrelid = 'users'::regclass AND attname = 'email')
+          ]::smallint[]
+    ) THEN
+        ALTER TABLE users ADD CONSTRAINT users_tenant_email_unique UNIQUE (tenant_id, email);
+    END IF;
+END $$;
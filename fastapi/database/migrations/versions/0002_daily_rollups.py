@@ -0,0 +1,135 @@
+"""ダッシュボード用日次ロールアップのテーブル・トリガーを作り、既存データから集計する
+
+適用済みの移行は書き換えないので、この時点の定義をここに固定している
+(現在の定義は ``database.rollups``)。
+"""
+
+DAILY_ROLLUP_DDL = """
+CREATE TABLE IF NOT EXISTS tenant_daily_stats (
+    tenant_id VARCHAR(32) NOT NULL REFERENCES tenants(tenant_id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    stamps INTEGER NOT NULL DEFAULT 0,
+    users INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tenant_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS tenant_daily_active_users (
+    tenant_id VARCHAR(32) NOT NULL REFERENCES tenants(tenant_id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    user_id INTEGER NOT NULL,
+    PRIMARY KEY (tenant_id, day, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS tenant_daily_coupon_stats (
+    tenant_id VARCHAR(32) NOT NULL REFERENCES tenants(tenant_id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    coupon_id VARCHAR(128) NOT NULL,
+    title VARCHAR(255),
+    description TEXT,
+    acquired INTEGER NOT NULL DEFAULT 0,
+    used INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tenant_id, day, coupon_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_store_stamps_tenant_stamped
+    ON user_store_stamps(tenant_id, stamped_at);
+
+CREATE OR REPLACE FUNCTION rollup_user_store_stamp()
+RETURNS TRIGGER AS $$
+DECLARE
+    stamp_day DATE := COALESCE(NEW.stamped_at, CURRENT_TIMESTAMP)::date;
+    new_users INTEGER;
+BEGIN
+    INSERT INTO tenant_daily_active_users (tenant_id, day, user_id)
+    VALUES (NEW.tenant_id, stamp_day, NEW.user_id)
+    ON CONFLICT DO NOTHING;
+    GET DIAGNOSTICS new_users = ROW_COUNT;
+
+    INSERT INTO tenant_daily_stats (tenant_id, day, stamps, users)
+    VALUES (NEW.tenant_id, stamp_day, 1, new_users)
+    ON CONFLICT (tenant_id, day) DO UPDATE
+        SET stamps = tenant_daily_stats.stamps + 1,
+            users = tenant_daily_stats.users + EXCLUDED.users;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_user_coupon()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO tenant_daily_coupon_stats (tenant_id, day, coupon_id, title, description, acquired, used)
+        VALUES (
+            NEW.tenant_id,
+            COALESCE(NEW.created_at, CURRENT_TIMESTAMP)::date,
+            NEW.coupon_id,
+            NEW.title,
+            NEW.description,
+            1,
+            0
+        )
+        ON CONFLICT (tenant_id, day, coupon_id) DO UPDATE
+            SET acquired = tenant_daily_coupon_stats.acquired + 1;
+    END IF;
+    IF NEW.used AND (TG_OP = 'INSERT' OR NOT OLD.used) THEN
+        INSERT INTO tenant_daily_coupon_stats (tenant_id, day, coupon_id, title, description, acquired, used)
+        VALUES (
+            NEW.tenant_id,
+            COALESCE(NEW.updated_at, CURRENT_TIMESTAMP)::date,
+            NEW.coupon_id,
+            NEW.title,
+            NEW.description,
+            0,
+            1
+        )
+        ON CONFLICT (tenant_id, day, coupon_id) DO UPDATE
+            SET used = tenant_daily_coupon_stats.used + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER rollup_user_store_stamps AFTER INSERT ON user_store_stamps
+    FOR EACH ROW EXECUTE FUNCTION rollup_user_store_stamp();
+
+CREATE OR REPLACE TRIGGER rollup_user_coupons AFTER INSERT OR UPDATE OF used ON user_coupons
+    FOR EACH ROW EXECUTE FUNCTION rollup_user_coupon();
+"""
+
+# トリガーによる加算と競合しないよう、集計の間は集計テーブルへの書き込みを待たせる
+BACKFILL = """
+LOCK TABLE tenant_daily_stats, tenant_daily_active_users, tenant_daily_coupon_stats IN EXCLUSIVE MODE;
+DELETE FROM tenant_daily_stats;
+DELETE FROM tenant_daily_active_users;
+DELETE FROM tenant_daily_coupon_stats;
+
+INSERT INTO tenant_daily_active_users (tenant_id, day, user_id)
+SELECT DISTINCT tenant_id, stamped_at::date, user_id
+FROM user_store_stamps
+WHERE stamped_at IS NOT NULL;
+
+INSERT INTO tenant_daily_stats (tenant_id, day, stamps, users)
+SELECT tenant_id, stamped_at::date, COUNT(*), COUNT(DISTINCT user_id)
+FROM user_store_stamps
+WHERE stamped_at IS NOT NULL
+GROUP BY tenant_id, stamped_at::date;
+
+INSERT INTO tenant_daily_coupon_stats (tenant_id, day, coupon_id, title, description, acquired, used)
+SELECT tenant_id, day, coupon_id, MAX(title), MAX(description), SUM(acquired), SUM(used)
+FROM (
+    SELECT tenant_id, created_at::date AS day, coupon_id, title, description, 1 AS acquired, 0 AS used
+    FROM user_coupons
+    WHERE created_at IS NOT NULL
+    UNION ALL
+    SELECT tenant_id, updated_at::date, coupon_id, title, description, 0, 1
+    FROM user_coupons
+    WHERE used = TRUE
+      AND updated_at IS NOT NULL
+) AS events
+GROUP BY tenant_id, day, coupon_id;
+"""
+
+
+def upgrade(cursor) -> None:
+    cursor.execute(DAILY_ROLLUP_DDL)
+    cursor.execute(BACKFILL)
@@ -0,0 +1,2 @@
+-- スタンプ記録時の位置確認に使う店舗ごとの半径 (メートル、NULL なら STAMP_GEOFENCE_RADIUS_METERS)
+ALTER TABLE stores ADD COLUMN IF NOT EXISTS geofence_radius_m DOUBLE PRECISION CHECK (geofence_radius_m >= 0);
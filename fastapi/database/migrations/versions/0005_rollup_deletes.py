@@ -0,0 +1,115 @@
+"""日次ロールアップでスタンプ・ユーザーの削除を差し引くトリガーを入れ、削除済みの分を集計し直す
+
+適用済みの移行は書き換えないので、この時点の定義をここに固定している
+(現在の定義は ``database.rollups``)。
+"""
+
+ROLLUP_DELETE_DDL = """
+CREATE OR REPLACE FUNCTION rollup_user_store_stamp()
+RETURNS TRIGGER AS $$
+DECLARE
+    stamp_day DATE;
+    new_users INTEGER;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        IF OLD.stamped_at IS NULL THEN
+            RETURN NULL;
+        END IF;
+        stamp_day := OLD.stamped_at::date;
+        UPDATE tenant_daily_stats
+        SET stamps = stamps - 1
+        WHERE tenant_id = OLD.tenant_id AND day = stamp_day;
+        -- その日のスタンプが残っていなければ利用者から外す (users は下の削除トリガーで減らす)
+        IF NOT EXISTS (
+            SELECT 1
+            FROM user_store_stamps
+            WHERE user_id = OLD.user_id
+              AND tenant_id = OLD.tenant_id
+              AND stamped_at >= stamp_day
+              AND stamped_at < stamp_day + 1
+        ) THEN
+            DELETE FROM tenant_daily_active_users
+            WHERE tenant_id = OLD.tenant_id AND day = stamp_day AND user_id = OLD.user_id;
+        END IF;
+        RETURN NULL;
+    END IF;
+
+    stamp_day := COALESCE(NEW.stamped_at, CURRENT_TIMESTAMP)::date;
+    INSERT INTO tenant_daily_active_users (tenant_id, day, user_id)
+    VALUES (NEW.tenant_id, stamp_day, NEW.user_id)
+    ON CONFLICT DO NOTHING;
+    GET DIAGNOSTICS new_users = ROW_COUNT;
+
+    INSERT INTO tenant_daily_stats (tenant_id, day, stamps, users)
+    VALUES (NEW.tenant_id, stamp_day, 1, new_users)
+    ON CONFLICT (tenant_id, day) DO UPDATE
+        SET stamps = tenant_daily_stats.stamps + 1,
+            users = tenant_daily_stats.users + EXCLUDED.users;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 利用者の行はスタンプ削除のほか、ユーザー削除の外部キーでも消える。どちらが先に
+-- 消しても 1 回だけ数えるよう、users は消えた行から減らす
+CREATE OR REPLACE FUNCTION rollup_removed_daily_active_users()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE tenant_daily_stats AS stats
+    SET users = stats.users - removed.user_count
+    FROM (
+        SELECT tenant_id, day, COUNT(*) AS user_count
+        FROM removed_daily_active_users
+        GROUP BY tenant_id, day
+    ) AS removed
+    WHERE stats.tenant_id = removed.tenant_id
+      AND stats.day = removed.day;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER rollup_user_store_stamps AFTER INSERT OR DELETE ON user_store_stamps
+    FOR EACH ROW EXECUTE FUNCTION rollup_user_store_stamp();
+
+CREATE OR REPLACE TRIGGER rollup_tenant_daily_active_users AFTER DELETE ON tenant_daily_active_users
+    REFERENCING OLD TABLE AS removed_daily_active_users
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_removed_daily_active_users();
+"""
+
+# これまでに削除されたスタンプ・ユーザーの分を数え直す。集計の間は集計テーブルへの書き込みを待たせる。
+# tenant_daily_stats を先に空にするので、利用者の行を消しても削除トリガーは何も減らさない
+BACKFILL = """
+LOCK TABLE tenant_daily_stats, tenant_daily_active_users IN EXCLUSIVE MODE;
+DELETE FROM tenant_daily_stats;
+DELETE FROM tenant_daily_active_users;
+
+INSERT INTO tenant_daily_active_users (tenant_id, day, user_id)
+SELECT DISTINCT tenant_id, stamped_at::date, user_id
+FROM user_store_stamps
+WHERE stamped_at IS NOT NULL;
+
+INSERT INTO tenant_daily_stats (tenant_id, day, stamps, users)
+SELECT tenant_id, stamped_at::date, COUNT(*), COUNT(DISTINCT user_id)
+FROM user_store_stamps
+WHERE stamped_at IS NOT NULL
+GROUP BY tenant_id, stamped_at::date;
+"""
+
+ACTIVE_USERS_FOREIGN_KEY = """
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'tenant_daily_active_users_user_id_fkey'
+    ) THEN
+        ALTER TABLE tenant_daily_active_users
+            ADD CONSTRAINT tenant_daily_active_users_user_id_fkey
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE;
+    END IF;
+END $$;
+"""
+
+
+def upgrade(cursor) -> None:
+    cursor.execute(ROLLUP_DELETE_DDL)
+    # 作り直しで削除済みユーザーの行も消えるので、その後に外部キーを付ける
+    cursor.execute(BACKFILL)
+    cursor.execute(ACTIVE_USERS_FOREIGN_KEY)
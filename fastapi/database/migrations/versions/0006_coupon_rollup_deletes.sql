@@ -0,0 +1,74 @@
+-- 利用者・テナントの削除で消えたクーポンも日次ロールアップから差し引く
+CREATE OR REPLACE FUNCTION rollup_user_coupon()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        IF OLD.created_at IS NOT NULL THEN
+            UPDATE tenant_daily_coupon_stats
+            SET acquired = acquired - 1
+            WHERE tenant_id = OLD.tenant_id AND day = OLD.created_at::date AND coupon_id = OLD.coupon_id;
+        END IF;
+        IF OLD.used AND OLD.updated_at IS NOT NULL THEN
+            UPDATE tenant_daily_coupon_stats
+            SET used = used - 1
+            WHERE tenant_id = OLD.tenant_id AND day = OLD.updated_at::date AND coupon_id = OLD.coupon_id;
+        END IF;
+        DELETE FROM tenant_daily_coupon_stats
+        WHERE tenant_id = OLD.tenant_id
+          AND coupon_id = OLD.coupon_id
+          AND day IN (OLD.created_at::date, OLD.updated_at::date)
+          AND acquired <= 0
+          AND used <= 0;
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO tenant_daily_coupon_stats (tenant_id, day, coupon_id, title, description, acquired, used)
+        VALUES (
+            NEW.tenant_id,
+            COALESCE(NEW.created_at, CURRENT_TIMESTAMP)::date,
+            NEW.coupon_id,
+            NEW.title,
+            NEW.description,
+            1,
+            0
+        )
+        ON CONFLICT (tenant_id, day, coupon_id) DO UPDATE
+            SET acquired = tenant_daily_coupon_stats.acquired + 1;
+    END IF;
+    IF NEW.used AND (TG_OP = 'INSERT' OR NOT OLD.used) THEN
+        INSERT INTO tenant_daily_coupon_stats (tenant_id, day, coupon_id, title, description, acquired, used)
+        VALUES (
+            NEW.tenant_id,
+            COALESCE(NEW.updated_at, CURRENT_TIMESTAMP)::date,
+            NEW.coupon_id,
+            NEW.title,
+            NEW.description,
+            0,
+            1
+        )
+        ON CONFLICT (tenant_id, day, coupon_id) DO UPDATE
+            SET used = tenant_daily_coupon_stats.used + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER rollup_user_coupons AFTER INSERT OR UPDATE OF used OR DELETE ON user_coupons
+    FOR EACH ROW EXECUTE FUNCTION rollup_user_coupon();
+
+-- これまでの削除で残っていた分を数え直す
+LOCK TABLE tenant_daily_coupon_stats IN EXCLUSIVE MODE;
+DELETE FROM tenant_daily_coupon_stats;
+INSERT INTO tenant_daily_coupon_stats (tenant_id, day, coupon_id, title, description, acquired, used)
+SELECT tenant_id, day, coupon_id, MAX(title), MAX(description), SUM(acquired), SUM(used)
+FROM (
+    SELECT tenant_id, created_at::date AS day, coupon_id, title, description, 1 AS acquired, 0 AS used
+    FROM user_coupons
+    WHERE created_at IS NOT NULL
+    UNION ALL
+    SELECT tenant_id, updated_at::date, coupon_id, title, description, 0, 1
+    FROM user_coupons
+    WHERE used = TRUE
+      AND updated_at IS NOT NULL
+) AS events
+GROUP BY tenant_id, day, coupon_id;
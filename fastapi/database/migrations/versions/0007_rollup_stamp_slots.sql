@@ -0,0 +1,113 @@
+-- スタンプの日次集計をテナント・日ごとの 1 行から、接続ごとのスロットに分ける。
+-- 同じテナントのスタンプを記録するトランザクションが 1 行の行ロックで直列にならないよう、
+-- 加算は自分の接続のスロット (pg_backend_pid() % 16) に入れ、読み取り側でスロットを合計する。
+-- 行ごとのトリガーは文ごと (遷移テーブル) に置き換え、まとめて挿入した分は 1 回の加算にする。
+ALTER TABLE tenant_daily_stats ADD COLUMN IF NOT EXISTS slot SMALLINT NOT NULL DEFAULT 0;
+ALTER TABLE tenant_daily_stats DROP CONSTRAINT IF EXISTS tenant_daily_stats_pkey;
+ALTER TABLE tenant_daily_stats ADD PRIMARY KEY (tenant_id, day, slot);
+
+DROP TRIGGER IF EXISTS rollup_user_store_stamps ON user_store_stamps;
+DROP FUNCTION IF EXISTS rollup_user_store_stamp();
+
+CREATE OR REPLACE FUNCTION rollup_inserted_user_store_stamps()
+RETURNS TRIGGER AS $$
+BEGIN
+    WITH added AS (
+        SELECT tenant_id, COALESCE(stamped_at, CURRENT_TIMESTAMP)::date AS day, user_id
+        FROM inserted_user_store_stamps
+    ),
+    new_users AS (
+        INSERT INTO tenant_daily_active_users (tenant_id, day, user_id)
+        SELECT DISTINCT tenant_id, day, user_id
+        FROM added
+        ON CONFLICT DO NOTHING
+        RETURNING tenant_id, day
+    )
+    INSERT INTO tenant_daily_stats (tenant_id, day, slot, stamps, users)
+    SELECT stamped.tenant_id, stamped.day, (pg_backend_pid() % 16)::smallint, stamped.stamp_count, COALESCE(joined.user_count, 0)
+    FROM (
+        SELECT tenant_id, day, COUNT(*) AS stamp_count
+        FROM added
+        GROUP BY tenant_id, day
+    ) AS stamped
+    LEFT JOIN (
+        SELECT tenant_id, day, COUNT(*) AS user_count
+        FROM new_users
+        GROUP BY tenant_id, day
+    ) AS joined USING (tenant_id, day)
+    ON CONFLICT (tenant_id, day, slot) DO UPDATE
+        SET stamps = tenant_daily_stats.stamps + EXCLUDED.stamps,
+            users = tenant_daily_stats.users + EXCLUDED.users;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 削除はまれなので、その日の既存スロットのうち 1 行から減らす (テナント削除の途中なら行がなく何もしない)
+CREATE OR REPLACE FUNCTION rollup_deleted_user_store_stamps()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE tenant_daily_stats AS stats
+    SET stamps = stats.stamps - removed.stamp_count
+    FROM (
+        SELECT tenant_id, stamped_at::date AS day, COUNT(*) AS stamp_count
+        FROM deleted_user_store_stamps
+        WHERE stamped_at IS NOT NULL
+        GROUP BY tenant_id, stamped_at::date
+    ) AS removed
+    WHERE stats.tenant_id = removed.tenant_id
+      AND stats.day = removed.day
+      AND stats.slot = (
+          SELECT MIN(other.slot)
+          FROM tenant_daily_stats AS other
+          WHERE other.tenant_id = removed.tenant_id AND other.day = removed.day
+      );
+    -- その日のスタンプが残っていない利用者を外す (users は下の削除トリガーで減らす)
+    DELETE FROM tenant_daily_active_users AS active
+    USING (
+        SELECT DISTINCT tenant_id, stamped_at::date AS day, user_id
+        FROM deleted_user_store_stamps
+        WHERE stamped_at IS NOT NULL
+    ) AS removed
+    WHERE active.tenant_id = removed.tenant_id
+      AND active.day = removed.day
+      AND active.user_id = removed.user_id
+      AND NOT EXISTS (
+          SELECT 1
+          FROM user_store_stamps AS remaining
+          WHERE remaining.user_id = removed.user_id
+            AND remaining.tenant_id = removed.tenant_id
+            AND remaining.stamped_at >= removed.day
+            AND remaining.stamped_at < removed.day + 1
+      );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_removed_daily_active_users()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE tenant_daily_stats AS stats
+    SET users = stats.users - removed.user_count
+    FROM (
+        SELECT tenant_id, day, COUNT(*) AS user_count
+        FROM removed_daily_active_users
+        GROUP BY tenant_id, day
+    ) AS removed
+    WHERE stats.tenant_id = removed.tenant_id
+      AND stats.day = removed.day
+      AND stats.slot = (
+          SELECT MIN(other.slot)
+          FROM tenant_daily_stats AS other
+          WHERE other.tenant_id = removed.tenant_id AND other.day = removed.day
+      );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER rollup_inserted_user_store_stamps AFTER INSERT ON user_store_stamps
+    REFERENCING NEW TABLE AS inserted_user_store_stamps
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_inserted_user_store_stamps();
+
+CREATE OR REPLACE TRIGGER rollup_deleted_user_store_stamps AFTER DELETE ON user_store_stamps
+    REFERENCING OLD TABLE AS deleted_user_store_stamps
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_deleted_user_store_stamps();
@@ -0,0 +1,89 @@
+-- クーポンを使った日を updated_at ではなく、未使用→使用済みになったときだけ入る used_at で数える。
+-- updated_at はどの UPDATE でも進むため、使用済みのクーポンを更新し直すと日次集計の日がずれていた。
+ALTER TABLE user_coupons ADD COLUMN IF NOT EXISTS used_at TIMESTAMP;
+
+-- 既存の使用済みクーポンは updated_at を使った日とみなす。updated_at を進めないよう更新トリガーを止めておく
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgname = 'update_user_coupons_updated_at' AND tgrelid = 'user_coupons'::regclass
+    ) THEN
+        ALTER TABLE user_coupons DISABLE TRIGGER update_user_coupons_updated_at;
+        UPDATE user_coupons SET used_at = updated_at WHERE used AND used_at IS NULL;
+        ALTER TABLE user_coupons ENABLE TRIGGER update_user_coupons_updated_at;
+    ELSE
+        UPDATE user_coupons SET used_at = updated_at WHERE used AND used_at IS NULL;
+    END IF;
+END $$;
+
+CREATE OR REPLACE FUNCTION rollup_user_coupon()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        IF OLD.created_at IS NOT NULL THEN
+            UPDATE tenant_daily_coupon_stats
+            SET acquired = acquired - 1
+            WHERE tenant_id = OLD.tenant_id AND day = OLD.created_at::date AND coupon_id = OLD.coupon_id;
+        END IF;
+        IF OLD.used AND OLD.used_at IS NOT NULL THEN
+            UPDATE tenant_daily_coupon_stats
+            SET used = used - 1
+            WHERE tenant_id = OLD.tenant_id AND day = OLD.used_at::date AND coupon_id = OLD.coupon_id;
+        END IF;
+        DELETE FROM tenant_daily_coupon_stats
+        WHERE tenant_id = OLD.tenant_id
+          AND coupon_id = OLD.coupon_id
+          AND day IN (OLD.created_at::date, OLD.used_at::date)
+          AND acquired <= 0
+          AND used <= 0;
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO tenant_daily_coupon_stats (tenant_id, day, coupon_id, title, description, acquired, used)
+        VALUES (
+            NEW.tenant_id,
+            COALESCE(NEW.created_at, CURRENT_TIMESTAMP)::date,
+            NEW.coupon_id,
+            NEW.title,
+            NEW.description,
+            1,
+            0
+        )
+        ON CONFLICT (tenant_id, day, coupon_id) DO UPDATE
+            SET acquired = tenant_daily_coupon_stats.acquired + 1;
+    END IF;
+    IF NEW.used AND (TG_OP = 'INSERT' OR NOT OLD.used) THEN
+        INSERT INTO tenant_daily_coupon_stats (tenant_id, day, coupon_id, title, description, acquired, used)
+        VALUES (
+            NEW.tenant_id,
+            COALESCE(NEW.used_at, CURRENT_TIMESTAMP)::date,
+            NEW.coupon_id,
+            NEW.title,
+            NEW.description,
+            0,
+            1
+        )
+        ON CONFLICT (tenant_id, day, coupon_id) DO UPDATE
+            SET used = tenant_daily_coupon_stats.used + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ずれていた分を used_at で数え直す
+LOCK TABLE tenant_daily_coupon_stats IN EXCLUSIVE MODE;
+DELETE FROM tenant_daily_coupon_stats;
+INSERT INTO tenant_daily_coupon_stats (tenant_id, day, coupon_id, title, description, acquired, used)
+SELECT tenant_id, day, coupon_id, MAX(title), MAX(description), SUM(acquired), SUM(used)
+FROM (
+    SELECT tenant_id, created_at::date AS day, coupon_id, title, description, 1 AS acquired, 0 AS used
+    FROM user_coupons
+    WHERE created_at IS NOT NULL
+    UNION ALL
+    SELECT tenant_id, used_at::date, coupon_id, title, description, 0, 1
+    FROM user_coupons
+    WHERE used = TRUE
+      AND used_at IS NOT NULL
+) AS events
+GROUP BY tenant_id, day, coupon_id;
@@ -0,0 +1,88 @@
+-- クーポンの日次集計もスタンプと同じく接続ごとのスロット (pg_backend_pid() % 16) に分ける。
+-- しきい値を越えたスタンプは同じトランザクションでクーポンを配るため、同じ
+-- (テナント, 日, クーポン) の 1 行を更新するトランザクションがコミットまで直列になっていた。
+-- 読み取り側は (クーポン, 日) ごとにスロットを合計する。
+ALTER TABLE tenant_daily_coupon_stats ADD COLUMN IF NOT EXISTS slot SMALLINT NOT NULL DEFAULT 0;
+ALTER TABLE tenant_daily_coupon_stats DROP CONSTRAINT IF EXISTS tenant_daily_coupon_stats_pkey;
+ALTER TABLE tenant_daily_coupon_stats ADD PRIMARY KEY (tenant_id, day, coupon_id, slot);
+
+CREATE OR REPLACE FUNCTION rollup_user_coupon()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        -- 削除はまれなので、その日の既存スロットのうち 1 行から減らす
+        IF OLD.created_at IS NOT NULL THEN
+            UPDATE tenant_daily_coupon_stats AS stats
+            SET acquired = stats.acquired - 1
+            WHERE stats.tenant_id = OLD.tenant_id
+              AND stats.day = OLD.created_at::date
+              AND stats.coupon_id = OLD.coupon_id
+              AND stats.slot = (
+                  SELECT MIN(other.slot)
+                  FROM tenant_daily_coupon_stats AS other
+                  WHERE other.tenant_id = OLD.tenant_id
+                    AND other.day = OLD.created_at::date
+                    AND other.coupon_id = OLD.coupon_id
+              );
+        END IF;
+        IF OLD.used AND OLD.used_at IS NOT NULL THEN
+            UPDATE tenant_daily_coupon_stats AS stats
+            SET used = stats.used - 1
+            WHERE stats.tenant_id = OLD.tenant_id
+              AND stats.day = OLD.used_at::date
+              AND stats.coupon_id = OLD.coupon_id
+              AND stats.slot = (
+                  SELECT MIN(other.slot)
+                  FROM tenant_daily_coupon_stats AS other
+                  WHERE other.tenant_id = OLD.tenant_id
+                    AND other.day = OLD.used_at::date
+                    AND other.coupon_id = OLD.coupon_id
+              );
+        END IF;
+        -- スロットの合計が 0 になった日は一覧に出さないよう消す
+        DELETE FROM tenant_daily_coupon_stats AS stats
+        WHERE stats.tenant_id = OLD.tenant_id
+          AND stats.coupon_id = OLD.coupon_id
+          AND stats.day IN (OLD.created_at::date, OLD.used_at::date)
+          AND (
+              SELECT SUM(other.acquired) <= 0 AND SUM(other.used) <= 0
+              FROM tenant_daily_coupon_stats AS other
+              WHERE other.tenant_id = stats.tenant_id
+                AND other.day = stats.day
+                AND other.coupon_id = stats.coupon_id
+          );
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO tenant_daily_coupon_stats (tenant_id, day, coupon_id, slot, title, description, acquired, used)
+        VALUES (
+            NEW.tenant_id,
+            COALESCE(NEW.created_at, CURRENT_TIMESTAMP)::date,
+            NEW.coupon_id,
+            (pg_backend_pid() % 16)::smallint,
+            NEW.title,
+            NEW.description,
+            1,
+            0
+        )
+        ON CONFLICT (tenant_id, day, coupon_id, slot) DO UPDATE
+            SET acquired = tenant_daily_coupon_stats.acquired + 1;
+    END IF;
+    IF NEW.used AND (TG_OP = 'INSERT' OR NOT OLD.used) THEN
+        INSERT INTO tenant_daily_coupon_stats (tenant_id, day, coupon_id, slot, title, description, acquired, used)
+        VALUES (
+            NEW.tenant_id,
+            COALESCE(NEW.used_at, CURRENT_TIMESTAMP)::date,
+            NEW.coupon_id,
+            (pg_backend_pid() % 16)::smallint,
+            NEW.title,
+            NEW.description,
+            0,
+            1
+        )
+        ON CONFLICT (tenant_id, day, coupon_id, slot) DO UPDATE
+            SET used = tenant_daily_coupon_stats.used + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
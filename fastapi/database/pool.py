@@ -0,0 +1,297 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+logger = logging.getLogger(__name__)
+
+# この秒数以上アイドルだった接続はチェックアウト時に SELECT 1 で生存確認する
+_PING_AFTER_IDLE = 5.0
+
+
+class PoolTimeout(PoolError):
+    """待ち行列で acquire タイムアウトに達したときに送出される"""
+
+
+class _Waiter:
+    __slots__ = ("event", "connection", "cancelled")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.connection = None
+        # タイムアウトで待つのをやめた (ロック保持中に設定する)
+        self.cancelled = False
+
+
+class _PooledConnection:
+    __slots__ = ("connection", "created_at", "returned_at")
+
+    def __init__(self, connection):
+        now = time.monotonic()
+        self.connection = connection
+        self.created_at = now
+        self.returned_at = now
+
+
+class BoundedConnectionPool:
+    """スレッドセーフな psycopg2 コネクションプール。
+
+    上限に達した場合は PoolError を即座に送出せず FIFO の待ち行列に並び、
+    ``timeout`` 秒以内に返却された接続を受け取る。チェックアウト時の生存確認、
+    アイドル接続の間引き、``max_lifetime`` による接続の作り直しも行う。
+    """
+
+    def __init__(
+        self,
+        minconn: int,
+        maxconn: int,
+        *,
+        timeout: float = 30.0,
+        max_idle: float = 600.0,
+        max_lifetime: float = 3600.0,
+        connection_factory: Optional[Callable[[], Any]] = None,
+        **connect_kwargs: Any,
+    ):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("invalid pool size: minconn=%s maxconn=%s" % (minconn, maxconn))
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self._connection_factory = connection_factory or (lambda: psycopg2.connect(**connect_kwargs))
+
+        self._lock = threading.Lock()
+        self._idle: Deque[_PooledConnection] = deque()
+        self._in_use: Dict[int, _PooledConnection] = {}
+        self._waiters: Deque[_Waiter] = deque()
+        self._size = 0
+        self._closed = False
+
+        self._requests = 0
+        self._waited_requests = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._connections_created = 0
+        self._connections_discarded = 0
+
+        for _ in range(minconn):
+            self._idle.append(self._connect())
+            self._size += 1
+
+    def _connect(self) -> _PooledConnection:
+        connection = self._connection_factory()
+        self._connections_created += 1
+        return _PooledConnection(connection)
+
+    def _discard(self, pooled: _PooledConnection) -> None:
+        self._connections_discarded += 1
+        try:
+            pooled.connection.close()
+        except Exception:
+            pass
+
+    def _is_expired(self, pooled: _PooledConnection, now: float) -> bool:
+        return self.max_lifetime > 0 and now - pooled.created_at >= self.max_lifetime
+
+    def _is_alive(self, pooled: _PooledConnection, now: float) -> bool:
+        connection = pooled.connection
+        if connection.closed:
+            return False
+        if connection.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if now - pooled.returned_at < _PING_AFTER_IDLE:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _prune_idle(self, now: float) -> List[_PooledConnection]:
+        """ロック保持中に呼ぶ。最小数を超えて長くアイドルな接続を取り除く"""
+        removed: List[_PooledConnection] = []
+        if self.max_idle <= 0:
+            return removed
+        while self._size > self.minconn and self._idle:
+            oldest = self._idle[0]
+            if now - oldest.returned_at < self.max_idle:
+                break
+            self._idle.popleft()
+            self._size -= 1
+            removed.append(oldest)
+        return removed
+
+    def getconn(self, timeout: Optional[float] = None):
+        """接続を取得する。空きがなければ FIFO で待機する"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        while True:
+            pooled = None
+            create = False
+            waiter = None
+            with self._lock:
+                if self._closed:
+                    raise PoolError("connection pool is closed")
+                stale = self._prune_idle(started)
+                if self._idle and not self._waiters:
+                    pooled = self._idle.pop()
+                elif self._size < self.maxconn and not self._waiters:
+                    self._size += 1
+                    create = True
+                else:
+                    waiter = _Waiter()
+                    self._waiters.append(waiter)
+            for item in stale:
+                self._discard(item)
+
+            if waiter is not None:
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0 or not waiter.event.wait(remaining):
+                    with self._lock:
+                        if waiter.connection is None:
+                            # _wake_next が新規接続を作っている最中なら、その接続は他へ回される
+                            waiter.cancelled = True
+                            try:
+                                self._waiters.remove(waiter)
+                            except ValueError:
+                                pass
+                            self._timeouts += 1
+                            raise PoolTimeout(
+                                "couldn't get a connection after %.2f sec" % timeout
+                            )
+                pooled = waiter.connection
+
+            if create:
+                try:
+                    pooled = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                    self._wake_next()
+                    raise
+            else:
+                now = time.monotonic()
+                if self._is_expired(pooled, now) or not self._is_alive(pooled, now):
+                    self._discard(pooled)
+                    with self._lock:
+                        self._size -= 1
+                    self._wake_next()
+                    continue
+
+            wait = time.monotonic() - started
+            with self._lock:
+                self._in_use[id(pooled.connection)] = pooled
+                self._requests += 1
+                self._total_wait += wait
+                if waiter is not None:
+                    self._waited_requests += 1
+                if wait > self._max_wait:
+                    self._max_wait = wait
+            return pooled.connection
+
+    def _pop_waiter(self) -> Optional[_Waiter]:
+        """ロック保持中に呼ぶ。タイムアウト済みを飛ばして先頭の待機者を取り出す"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.cancelled:
+                return waiter
+        return None
+
+    def _deliver(self, pooled: _PooledConnection, waiter: Optional[_Waiter] = None) -> None:
+        """ロック保持中に呼ぶ。待機者に接続を渡し、待機者がいなければアイドルに戻す"""
+        if waiter is None or waiter.cancelled:
+            waiter = self._pop_waiter()
+        if waiter is None:
+            self._idle.append(pooled)
+            return
+        waiter.connection = pooled
+        waiter.event.set()
+
+    def _wake_next(self) -> None:
+        """接続枠が空いたとき、先頭の待機者に新規接続を作らせる"""
+        with self._lock:
+            if self._size >= self.maxconn:
+                return
+            waiter = self._pop_waiter()
+            if waiter is None:
+                return
+            self._size += 1
+        try:
+            pooled = self._connect()
+        except Exception as exc:
+            logger.error("Failed to open replacement connection: %s", exc)
+            with self._lock:
+                self._size -= 1
+                if not waiter.cancelled:
+                    self._waiters.appendleft(waiter)
+            return
+        with self._lock:
+            # 接続を作っている間に待機者がタイムアウトしていれば、次の待機者かアイドルへ回す
+            self._deliver(pooled, waiter)
+
+    def putconn(self, connection, close: bool = False) -> None:
+        """接続を返却する。待機者がいれば FIFO 順に直接引き渡す"""
+        with self._lock:
+            pooled = self._in_use.pop(id(connection), None)
+        if pooled is None:
+            raise PoolError("trying to put unkeyed connection")
+
+        now = time.monotonic()
+        if not close and not connection.closed:
+            status = connection.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except Exception:
+                    close = True
+        if close or connection.closed or self._closed or self._is_expired(pooled, now):
+            self._discard(pooled)
+            with self._lock:
+                self._size -= 1
+            self._wake_next()
+            return
+
+        pooled.returned_at = now
+        with self._lock:
+            self._deliver(pooled)
+
+    def closeall(self) -> None:
+        """アイドル接続をすべて閉じ、以降の取得を拒否する"""
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for pooled in idle:
+            self._discard(pooled)
+
+    def stats(self) -> Dict[str, Any]:
+        """プールの現在値と累積カウンタを返す"""
+        with self._lock:
+            requests = self._requests
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "size": self._size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "waiting": len(self._waiters),
+                "requests": requests,
+                "requests_waited": self._waited_requests,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": round(self._total_wait / requests * 1000, 3) if requests else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 3),
+                "connections_created": self._connections_created,
+                "connections_discarded": self._connections_discarded,
+            }
@@ -0,0 +1,166 @@
+"""クエリごとの実行時間の計測。
+
+リテラルを ``?`` に置き換え空白を詰めた文 (フィンガープリント) 単位で、回数・行数・
+実行時間のヒストグラムを保持する。``DB_SLOW_QUERY_MS`` を超えたクエリはログに出し、
+``DB_EXPLAIN_SAMPLE_RATE`` の割合で ``EXPLAIN (ANALYZE, BUFFERS)`` の結果も残す。
+"""
+import bisect
+import hashlib
+import logging
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# ヒストグラムのバケット上限 (ミリ秒)。最後のバケットはそれ以上
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(query: str) -> str:
+    """値を取り除いた正規化済みの文を返す"""
+    text = _STRING_LITERAL.sub("?", query)
+    text = _NUMBER_LITERAL.sub("?", text)
+    return _WHITESPACE.sub(" ", text).strip().rstrip(";").strip()
+
+
+def is_explainable(query: str) -> bool:
+    """EXPLAIN ANALYZE で再実行しても副作用のない文か (SELECT のみ)"""
+    return query.lstrip().upper().startswith("SELECT")
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "calls", "rows", "total_ms", "max_ms", "slow", "buckets", "plan", "plan_at")
+
+    def __init__(self, statement: str):
+        self.fingerprint = statement
+        self.calls = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.slow = 0
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.plan: Optional[str] = None
+        self.plan_at = 0.0
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """ヒストグラムから求めたおおよその分位点 (バケット上限)"""
+        if not self.calls:
+            return None
+        target = self.calls * fraction
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target:
+                return float(HISTOGRAM_BOUNDS_MS[index]) if index < len(HISTOGRAM_BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "id": hashlib.sha1(self.fingerprint.encode("utf-8")).hexdigest()[:12],
+            "fingerprint": self.fingerprint,
+            "calls": self.calls,
+            "rows": self.rows,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "slow_calls": self.slow,
+            "histogram": {
+                **{f"le_{bound}ms": count for bound, count in zip(HISTOGRAM_BOUNDS_MS, self.buckets)},
+                f"gt_{HISTOGRAM_BOUNDS_MS[-1]}ms": self.buckets[-1],
+            },
+            "explain": self.plan,
+        }
+
+
+class QueryStats:
+    """フィンガープリント単位の実行統計 (プロセス内、スレッドセーフ)"""
+
+    def __init__(
+        self,
+        slow_query_ms: float,
+        explain_sample_rate: float = 0.0,
+        explain_min_interval: float = 60.0,
+        max_fingerprints: int = 500,
+    ):
+        self.slow_query_ms = slow_query_ms
+        self.explain_sample_rate = explain_sample_rate
+        self.explain_min_interval = explain_min_interval
+        self.max_fingerprints = max_fingerprints
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def record(self, query: str, duration_ms: float, rows: int = 0) -> bool:
+        """1 回の実行を記録する。EXPLAIN を取得すべき場合は True を返す"""
+        statement = fingerprint(query)
+        slow = duration_ms >= self.slow_query_ms
+        with self._lock:
+            entry = self._entries.get(statement)
+            if entry is None:
+                if len(self._entries) >= self.max_fingerprints:
+                    self.dropped += 1
+                    entry = None
+                else:
+                    entry = self._entries[statement] = _Entry(statement)
+            if entry is not None:
+                entry.calls += 1
+                entry.rows += max(rows, 0)
+                entry.total_ms += duration_ms
+                entry.max_ms = max(entry.max_ms, duration_ms)
+                entry.buckets[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, duration_ms)] += 1
+                if slow:
+                    entry.slow += 1
+        if not slow:
+            return False
+        logger.warning("Slow query (%.1f ms, %d rows): %s", duration_ms, rows, statement)
+        return entry is not None and self._should_explain(entry, query)
+
+    def _should_explain(self, entry: _Entry, query: str) -> bool:
+        if self.explain_sample_rate <= 0 or not is_explainable(query):
+            return False
+        now = time.monotonic()
+        if entry.plan is not None and now - entry.plan_at < self.explain_min_interval:
+            return False
+        if random.random() >= self.explain_sample_rate:
+            return False
+        entry.plan_at = now
+        return True
+
+    def store_plan(self, query: str, plan: str) -> None:
+        with self._lock:
+            entry = self._entries.get(fingerprint(query))
+            if entry is not None:
+                entry.plan = plan
+                entry.plan_at = time.monotonic()
+
+    def snapshot(self, limit: int = 50, order_by: str = "total_ms") -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = [entry.as_dict() for entry in self._entries.values()]
+        entries.sort(key=lambda item: item.get(order_by) or 0, reverse=True)
+        return entries[:limit]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.dropped = 0
+
+
+query_stats = QueryStats(
+    settings.DB_SLOW_QUERY_MS,
+    explain_sample_rate=settings.DB_EXPLAIN_SAMPLE_RATE,
+    explain_min_interval=settings.DB_EXPLAIN_MIN_INTERVAL,
+)
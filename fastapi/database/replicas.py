@@ -0,0 +1,185 @@
+"""読み取りレプリカへの振り分け。
+
+``DB_REPLICA_URLS`` (カンマ区切りの接続文字列) にレプリカを並べると、GET / HEAD の
+リクエストはレプリカのプールから接続を借りる (順番に使い回す)。レプリカごとに
+``DB_REPLICA_LAG_CHECK_INTERVAL`` 秒おきに再生の遅れを測り、``DB_REPLICA_MAX_LAG_SECONDS`` を
+超えたものや接続できないものは外す。使えるレプリカがなければプライマリで読む。
+
+書き込んだ利用者は ``DB_READ_YOUR_WRITES_SECONDS`` の間プライマリで読む (スタンプ直後の
+進捗取得で、今押したスタンプが見えないことを防ぐ)。この記録はワーカー内だけなので、
+別のワーカーに振られた読み取りの鮮度は遅延の上限で抑える。
+
+リカバリ中でないインスタンス (独立した 2 つ目の Postgres など) は遅延 0 として扱う。
+"""
+import asyncio
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from psycopg.conninfo import conninfo_to_dict
+
+logger = logging.getLogger(__name__)
+
+# レプリカの再生の遅れ (秒)。受信済みの WAL をすべて再生していれば 0
+LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+# 読み取り後の記録がこの件数を超えたら期限切れを掃除する
+_STICKY_PRUNE_SIZE = 10000
+
+
+def parse_replica_urls(value: str) -> List[str]:
+    """カンマ区切りの設定値を接続文字列のリストにする"""
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def describe_conninfo(conninfo: str) -> str:
+    """パスワードを含まない表示用の名前 (host:port/dbname)"""
+    try:
+        params = conninfo_to_dict(conninfo)
+    except Exception:  # noqa: BLE001
+        return "replica"
+    return f"{params.get('host', 'localhost')}:{params.get('port', 5432)}/{params.get('dbname', '')}"
+
+
+class Replica:
+    __slots__ = ("name", "conninfo", "pool", "lag", "healthy", "checked_at", "error", "checking")
+
+    def __init__(self, conninfo: str):
+        self.name = describe_conninfo(conninfo)
+        self.conninfo = conninfo
+        self.pool = None
+        self.lag: Optional[float] = None
+        # 最初の確認が済むまでは使わない
+        self.healthy = False
+        self.checked_at = 0.0
+        self.error: Optional[str] = None
+        self.checking = False
+
+
+class ReplicaSet:
+    """レプリカのプール・遅延・書き込み直後の利用者を管理する (ワーカー内)"""
+
+    def __init__(
+        self,
+        conninfos: Sequence[str],
+        open_pool: Callable[[str], Awaitable[Any]],
+        max_lag_seconds: float = 2.0,
+        check_interval: float = 1.0,
+        read_your_writes_seconds: float = 5.0,
+    ):
+        self.replicas = [Replica(conninfo) for conninfo in conninfos]
+        self.open_pool = open_pool
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval = check_interval
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self._next = itertools.count()
+        self._recent_writers: Dict[str, float] = {}
+        self._tasks: set = set()
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.replicas)
+
+    def choose(self) -> Optional[Replica]:
+        """使えるレプリカを 1 つ返す (なければ None)。確認の期限が来たものは裏で測り直す"""
+        if not self.replicas:
+            return None
+        now = time.monotonic()
+        candidates = []
+        for replica in self.replicas:
+            if now - replica.checked_at >= self.check_interval:
+                self._schedule_check(replica)
+            # 確認が止まっている (interval の 3 倍以上古い) 値は信用しない
+            fresh = now - replica.checked_at < self.check_interval * 3
+            if replica.healthy and fresh and replica.lag is not None and replica.lag <= self.max_lag_seconds:
+                candidates.append(replica)
+        if not candidates:
+            return None
+        return candidates[next(self._next) % len(candidates)]
+
+    def mark_down(self, replica: Replica, exc: BaseException) -> None:
+        """接続を借りられなかったレプリカを次の確認まで外す"""
+        if replica.healthy:
+            logger.warning("Replica %s unavailable, reading from primary: %s", replica.name, exc)
+        replica.healthy = False
+        replica.error = str(exc)
+
+    def _schedule_check(self, replica: Replica) -> None:
+        if replica.checking:
+            return
+        replica.checking = True
+        task = asyncio.get_running_loop().create_task(self.check(replica))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def check(self, replica: Replica) -> None:
+        """レプリカの遅れを測る"""
+        try:
+            if replica.pool is None:
+                replica.pool = await self.open_pool(replica.conninfo)
+            async with replica.pool.connection(timeout=max(self.check_interval, 1.0)) as connection:
+                cursor = await connection.execute(LAG_SQL)
+                lag = float((await cursor.fetchone())[0])
+            if lag > self.max_lag_seconds and (replica.lag is None or replica.lag <= self.max_lag_seconds):
+                logger.warning("Replica %s is %.1fs behind, reading from primary", replica.name, lag)
+            if not replica.healthy:
+                logger.info("Replica %s available (lag %.3fs)", replica.name, lag)
+            replica.lag = lag
+            replica.healthy = True
+            replica.error = None
+        except Exception as exc:  # noqa: BLE001
+            self.mark_down(replica, exc)
+        finally:
+            replica.checked_at = time.monotonic()
+            replica.checking = False
+
+    def mark_write(self, key: Optional[str]) -> None:
+        """この利用者の読み取りをしばらくプライマリに向ける"""
+        if not key or not self.replicas or self.read_your_writes_seconds <= 0:
+            return
+        now = time.monotonic()
+        if len(self._recent_writers) >= _STICKY_PRUNE_SIZE:
+            self._recent_writers = {k: until for k, until in self._recent_writers.items() if until > now}
+        self._recent_writers[key] = now + self.read_your_writes_seconds
+
+    def recently_wrote(self, key: Optional[str]) -> bool:
+        if not key:
+            return False
+        until = self._recent_writers.get(key)
+        if until is None:
+            return False
+        if until <= time.monotonic():
+            self._recent_writers.pop(key, None)
+            return False
+        return True
+
+    def stats(self, pool_stats: Callable[[Any], Dict[str, Any]]) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "name": replica.name,
+                "healthy": replica.healthy,
+                "lag_seconds": None if replica.lag is None else round(replica.lag, 3),
+                "checked_seconds_ago": round(now - replica.checked_at, 1) if replica.checked_at else None,
+                "error": replica.error,
+                "pool": pool_stats(replica.pool) if replica.pool is not None else {},
+            }
+            for replica in self.replicas
+        ]
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        for replica in self.replicas:
+            if replica.pool is not None:
+                await replica.pool.close()
+                replica.pool = None
+            replica.healthy = False
+            replica.checked_at = 0.0
@@ -0,0 +1,89 @@
+"""テナントダッシュボード用の日次ロールアップ。
+
+スタンプ・クーポンの挿入/利用時にトリガーで日次集計を更新するため、
+ダッシュボードは期間中の日数分の行だけを読めばよい。店舗・ユーザー・テナントの削除で
+スタンプやクーポンが消えたときもトリガーで差し引く。
+スタンプとクーポンの日次集計は接続ごとのスロットに分けて加算するため (ダッシュボードはスロットを
+合計する)、同じテナントに同時に記録するトランザクションが 1 行のロックを奪い合わない。
+作り直した集計はスロット 0 に入る。
+
+テーブルとトリガーの定義は postgres/init.sql (新規環境) と database/migrations/versions/
+(既存環境) にある。このモジュールは集計の作り直しだけを受け持つ。
+
+既存データから集計を作り直すには:
+
+    python -m database.rollups [--tenant TENANT_ID]
+"""
+import argparse
+import logging
+from typing import Optional
+
+from database.database import DatabaseService
+
+logger = logging.getLogger(__name__)
+
+
+_BACKFILL_STATEMENTS = (
+    # トリガーによる加算と競合しないよう、作り直しの間は集計テーブルへの書き込みを待たせる
+    "LOCK TABLE tenant_daily_stats, tenant_daily_active_users, tenant_daily_coupon_stats IN EXCLUSIVE MODE",
+    "DELETE FROM tenant_daily_stats WHERE %(tenant_id)s IS NULL OR tenant_id = %(tenant_id)s",
+    "DELETE FROM tenant_daily_active_users WHERE %(tenant_id)s IS NULL OR tenant_id = %(tenant_id)s",
+    "DELETE FROM tenant_daily_coupon_stats WHERE %(tenant_id)s IS NULL OR tenant_id = %(tenant_id)s",
+    """
+    INSERT INTO tenant_daily_active_users (tenant_id, day, user_id)
+    SELECT DISTINCT tenant_id, stamped_at::date, user_id
+    FROM user_store_stamps
+    WHERE stamped_at IS NOT NULL
+      AND (%(tenant_id)s IS NULL OR tenant_id = %(tenant_id)s)
+    """,
+    """
+    INSERT INTO tenant_daily_stats (tenant_id, day, stamps, users)
+    SELECT tenant_id, stamped_at::date, COUNT(*), COUNT(DISTINCT user_id)
+    FROM user_store_stamps
+    WHERE stamped_at IS NOT NULL
+      AND (%(tenant_id)s IS NULL OR tenant_id = %(tenant_id)s)
+    GROUP BY tenant_id, stamped_at::date
+    """,
+    """
+    INSERT INTO tenant_daily_coupon_stats (tenant_id, day, coupon_id, title, description, acquired, used)
+    SELECT tenant_id, day, coupon_id, MAX(title), MAX(description), SUM(acquired), SUM(used)
+    FROM (
+        SELECT tenant_id, created_at::date AS day, coupon_id, title, description, 1 AS acquired, 0 AS used
+        FROM user_coupons
+        WHERE created_at IS NOT NULL
+          AND (%(tenant_id)s IS NULL OR tenant_id = %(tenant_id)s)
+        UNION ALL
+        SELECT tenant_id, used_at::date, coupon_id, title, description, 0, 1
+        FROM user_coupons
+        WHERE used = TRUE
+          AND used_at IS NOT NULL
+          AND (%(tenant_id)s IS NULL OR tenant_id = %(tenant_id)s)
+    ) AS events
+    GROUP BY tenant_id, day, coupon_id
+    """,
+)
+
+
+def rebuild_daily_stats(cursor, tenant_id: Optional[str] = None) -> None:
+    """呼び出し側のトランザクション内で日次ロールアップを作り直す"""
+    for statement in _BACKFILL_STATEMENTS:
+        cursor.execute(statement, {"tenant_id": tenant_id})
+
+
+def backfill_daily_stats(tenant_id: Optional[str] = None) -> None:
+    """元テーブルから日次ロールアップを作り直す (tenant_id 省略時は全テナント)"""
+    with DatabaseService() as db:
+        rebuild_daily_stats(db.cursor, tenant_id)
+    logger.info("Daily rollups rebuilt for %s", tenant_id or "all tenants")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="日次ロールアップを元テーブルから再集計する")
+    parser.add_argument("--tenant", help="対象テナント ID (省略時は全テナント)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    backfill_daily_stats(args.tenant)
+
+
+if __name__ == "__main__":
+    main()
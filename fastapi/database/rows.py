@@ -0,0 +1,81 @@
+"""execute_query の行表現。
+
+``row_format`` で選ぶ:
+
+- ``"dict"`` (既定): 行ごとに dict を作る
+- ``"row"``: タプルを継承した軽量な行。列の索引は結果セット (列の並び) ごとに 1 つだけ作られ、
+  ``row["name"]`` / ``row.name`` / ``row.get("name")`` / ``row[0]`` で読める
+- ``"tuple"``: ドライバが返したタプルをそのまま返す (列名が不要な内部処理向け)
+"""
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple, Type
+
+ROW_FORMATS = ("dict", "row", "tuple")
+
+
+class Row(tuple):
+    """列名でも読めるタプル。``row_class`` が列の並びごとにサブクラスを作る"""
+
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+    _index: Dict[str, int] = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        position = self._index.get(key)
+        if position is None:
+            return default
+        return tuple.__getitem__(self, position)
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._fields
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return list(zip(self._fields, self))
+
+    def _asdict(self) -> Dict[str, Any]:
+        return dict(zip(self._fields, self))
+
+    def __repr__(self) -> str:
+        return "Row(" + ", ".join(f"{name}={value!r}" for name, value in zip(self._fields, self)) + ")"
+
+
+@lru_cache(maxsize=512)
+def row_class(columns: Tuple[str, ...]) -> Type[Row]:
+    """列の並びに対応する Row のサブクラスを返す (同じ並びなら同じクラスを再利用する)"""
+    namespace: Dict[str, Any] = {
+        "__slots__": (),
+        "_fields": columns,
+        "_index": {name: position for position, name in enumerate(columns)},
+    }
+    for position, name in enumerate(columns):
+        if name.isidentifier() and not name.startswith("_") and not hasattr(Row, name):
+            namespace[name] = property(itemgetter(position))
+    return type("Row", (Row,), namespace)
+
+
+def row_maker(description: Sequence[Any], row_format: str = "dict") -> Callable[[Sequence[Any]], Any]:
+    """1 行ずつ変換する関数を返す (ストリーミング用)"""
+    if row_format == "tuple":
+        return tuple
+    columns = tuple(desc[0] for desc in description)
+    if row_format == "row":
+        return row_class(columns)
+    if row_format == "dict":
+        return lambda row: dict(zip(columns, row))
+    raise ValueError(f"Unknown row_format: {row_format!r} (expected one of {ROW_FORMATS})")
+
+
+def build_rows(description: Sequence[Any], rows: Iterable[Sequence[Any]], row_format: str = "dict") -> List[Any]:
+    """カーソルの description と取得行から、指定形式の行リストを作る"""
+    if row_format == "tuple":
+        return rows if isinstance(rows, list) else list(rows)
+    if row_format == "dict":
+        columns = tuple(desc[0] for desc in description)
+        return [dict(zip(columns, row)) for row in rows]
+    return list(map(row_maker(description, row_format), rows))
@@ -1,6 +1,16 @@
+import time
+
+_import_started = time.perf_counter()
+
+import asyncio
+import os
+import signal
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Any, Dict
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from config import settings
@@ -11,20 +21,106 @@ from routers import auth
 from routers import tenants
 from routers import users
 from routers import uploads
-from database.migrations import run_schema_migrations
+from routers import diagnostics
+from database.async_database import AsyncDatabaseService, DatabaseTimeoutError
+from database.database import DatabaseService
+from database.migrations import PendingMigrationsError, ensure_schema_current
+from services.security import password_hasher
+from services.stamp_buffer import stamp_buffer
 
 # ロギング設定
 logging.basicConfig(
     level=logging.DEBUG if settings.DEBUG else logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
+logger = logging.getLogger(__name__)
+
+# スキーマ確認を再試行する間隔 (秒)。DB の起動待ち中は倍にしていく
+SCHEMA_RETRY_INITIAL = 1.0
+SCHEMA_RETRY_MAX = 30.0
+
+
+def _check_schema() -> None:
+    """スキーマのバージョンを確認する (必要なら移行)。移行用の同期プールは使い終えたら閉じる"""
+    try:
+        ensure_schema_current()
+    finally:
+        DatabaseService.close_connection_pool()
+
+
+def _stop_process() -> None:
+    """サーバーに終了を要求する (起動時に移行が残っていたときの中止と同じ扱い)"""
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+async def _wait_for_schema(report: Dict[str, Any]) -> None:
+    """DB に接続できるまでスキーマ確認を再試行する
+
+    つながった時点で未適用の移行が残っていれば (``DB_MIGRATE_ON_STARTUP=false``)、
+    古いスキーマのまま処理を続けないようワーカーを止める。
+    """
+    delay = SCHEMA_RETRY_INITIAL
+    while True:
+        await asyncio.sleep(delay)
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(_check_schema)
+        except PendingMigrationsError as exc:
+            report["schema"] = "pending"
+            logger.error("%s; stopping the worker", exc)
+            _stop_process()
+            return
+        except Exception as exc:  # noqa: BLE001
+            report["schema_attempts"] += 1
+            delay = min(delay * 2, SCHEMA_RETRY_MAX)
+            logger.warning("Database not ready (%s); retrying in %.0fs", exc, delay)
+            continue
+        report["schema"] = "ready"
+        report["schema_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        logger.info("Database schema is current (after %d attempts)", report["schema_attempts"])
+        return
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動時はスキーマの確認だけを行う。DB にまだ繋がらなくても起動し、裏で再試行する"""
+    report: Dict[str, Any] = {
+        "import_ms": round((_import_ready - _import_started) * 1000, 1),
+        "schema": "checking",
+        "schema_attempts": 1,
+    }
+    app.state.startup_report = report
+    retry_task = None
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(_check_schema)
+    except PendingMigrationsError:
+        raise
+    except Exception as exc:  # noqa: BLE001
+        report["schema"] = "waiting"
+        logger.warning("Database not ready at startup (%s); serving without it and retrying", exc)
+        retry_task = asyncio.create_task(_wait_for_schema(report))
+    else:
+        report["schema"] = "ready"
+        report["schema_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    report["startup_ms"] = round((time.perf_counter() - _import_started) * 1000, 1)
+    logger.info("Startup report: %s", report)
+
+    yield
+
+    if retry_task is not None:
+        retry_task.cancel()
+    await stamp_buffer.close()
+    await AsyncDatabaseService.close_connection_pool()
+    DatabaseService.close_connection_pool()
+    password_hasher.shutdown()
 
-run_schema_migrations()
 
 app = FastAPI(
     title=settings.APP_NAME,
     description="FastAPI Application Template",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS設定
@@ -42,11 +138,24 @@ STATIC_DIR = Path(__file__).resolve().parent / "static"
 STATIC_DIR.mkdir(parents=True, exist_ok=True)
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
+# 時間予算 (statement_timeout / lock_timeout / 接続待ち) を超えたリクエストは 503 で打ち切る
+@app.exception_handler(DatabaseTimeoutError)
+async def database_timeout_handler(request: Request, exc: DatabaseTimeoutError):
+    logger.warning("%s %s: %s", request.method, request.url.path, exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service temporarily unavailable"},
+        headers={"Retry-After": "1"},
+    )
+
 # ルーター登録
 app.include_router(auth.router)
 app.include_router(tenants.router)
 app.include_router(users.router)
 app.include_router(uploads.router)
+app.include_router(diagnostics.router)
+
+_import_ready = time.perf_counter()
 
 @app.get("/")
 async def root():
@@ -57,8 +166,14 @@ async def root():
     }
 
 @app.get("/health")
-async def health_check():
-    return {"status": "healthy"}
+async def health_check(request: Request):
+    # DB に触れない (プロセスの生存確認用)。schema が ready でなければ DB 待ち。
+    # 未適用の移行が見つかったワーカーは終了するまで 503 を返す
+    report = getattr(request.app.state, "startup_report", {})
+    schema = report.get("schema", "unknown")
+    if schema == "pending":
+        return JSONResponse(status_code=503, content={"status": "unavailable", "schema": schema})
+    return {"status": "healthy", "schema": schema}
 
 if __name__ == "__main__":
     import uvicorn
@@ -7,8 +7,9 @@ from jose import JWTError, jwt
 from pydantic import BaseModel, EmailStr
 
 from config import settings
-from database.database import DatabaseService, get_db_service
-from services.security import create_access_token, verify_password
+from database.async_database import AsyncDatabaseService, DatabaseTimeoutError, get_async_db_service
+from services.security import create_access_token, password_hasher
+from services.user_cache import user_cache
 
 
 logger = logging.getLogger(__name__)
@@ -71,8 +72,8 @@ class OAuth2TenantRequestForm(OAuth2PasswordRequestForm):
         self.tenant_id = tenant_id
 
 
-def _fetch_user_by_identifier(
-    db: DatabaseService, identifier: str, tenant_id: Optional[str]
+async def _fetch_user_by_identifier(
+    db: AsyncDatabaseService, identifier: str, tenant_id: Optional[str]
 ) -> Optional[Dict[str, Any]]:
     """Fetch a user by username or email, optionally filtered by tenant."""
     conditions = ["(username = %s OR email = %s)"]
@@ -96,7 +97,7 @@ def _fetch_user_by_identifier(
         WHERE {' AND '.join(conditions)}
         LIMIT 1
     """
-    records = db.execute_query(query, tuple(params))
+    records = await db.execute_query(query, tuple(params))
     if not records:
         return None
     return records[0]
@@ -113,7 +114,7 @@ def _issue_access_token(user: Dict[str, Any]) -> str:
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: DatabaseService = Depends(get_db_service),
+    db: AsyncDatabaseService = Depends(get_async_db_service),
 ) -> Dict[str, Any]:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -130,9 +131,12 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    user = _fetch_user_by_identifier(db, token_data.username, token_data.tenant_id)
-    if not user:
-        raise credentials_exception
+    user = user_cache.get(token_data.tenant_id, token_data.username)
+    if user is None:
+        user = await _fetch_user_by_identifier(db, token_data.username, token_data.tenant_id)
+        if not user:
+            raise credentials_exception
+        user_cache.put(token_data.tenant_id, token_data.username, user)
 
     if not user.get("is_active", True):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Inactive user")
@@ -142,7 +146,7 @@ async def get_current_user(
 
 async def get_optional_current_user(
     token: Optional[str] = Depends(optional_oauth2_scheme),
-    db: DatabaseService = Depends(get_db_service),
+    db: AsyncDatabaseService = Depends(get_async_db_service),
 ) -> Optional[Dict[str, Any]]:
     """Like get_current_user but tolerates missing/invalid tokens."""
     if not token:
@@ -153,35 +157,40 @@ async def get_optional_current_user(
         return None
 
 
-def _authenticate_user(
-    db: DatabaseService,
+async def _authenticate_user(
+    db: AsyncDatabaseService,
     identifier: str,
     password: str,
     tenant_id: Optional[str] = None,
 ) -> Dict[str, Any]:
-    user = _fetch_user_by_identifier(db, identifier, tenant_id)
-    if not user or not verify_password(password, user.get("password_hash")):
+    user = await _fetch_user_by_identifier(db, identifier, tenant_id)
+    # 照合の間は接続を持たない (ログインが集中してもスタンプ側の接続を奪わない)
+    await db.release()
+    if not user or not await password_hasher.verify(password, user.get("password_hash")):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     if not user.get("is_active", True):
+        user_cache.evict_user(user["id"])
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Inactive user account",
         )
+    # ログイン直後のリクエストで再取得しないよう、最新のレコードで置き換えておく
+    user_cache.put(user.get("tenant_id"), user.get("username"), user)
     return user
 
 
 @router.post("/login", response_model=Token)
 async def login(
     form_data: OAuth2TenantRequestForm = Depends(),
-    db: DatabaseService = Depends(get_db_service),
+    db: AsyncDatabaseService = Depends(get_async_db_service),
 ):
     """Password-based login endpoint using form data."""
     try:
-        user = _authenticate_user(
+        user = await _authenticate_user(
             db=db,
             identifier=form_data.username,
             password=form_data.password,
@@ -189,7 +198,7 @@ async def login(
         )
         access_token = _issue_access_token(user)
         return {"access_token": access_token, "token_type": "bearer"}
-    except HTTPException:
+    except (HTTPException, DatabaseTimeoutError):
         raise
     except Exception as exc:
         logger.error("Login error: %s", exc)
@@ -199,11 +208,11 @@ async def login(
 @router.post("/login/json", response_model=Token)
 async def login_with_json(
     payload: LoginRequest,
-    db: DatabaseService = Depends(get_db_service),
+    db: AsyncDatabaseService = Depends(get_async_db_service),
 ):
     """JSON body based login endpoint for SPA clients."""
     try:
-        user = _authenticate_user(
+        user = await _authenticate_user(
             db=db,
             identifier=payload.identifier,
             password=payload.password,
@@ -211,7 +220,7 @@ async def login_with_json(
         )
         access_token = _issue_access_token(user)
         return {"access_token": access_token, "token_type": "bearer"}
-    except HTTPException:
+    except (HTTPException, DatabaseTimeoutError):
         raise
     except Exception as exc:
         logger.error("Login error: %s", exc)
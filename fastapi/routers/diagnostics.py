@@ -0,0 +1,67 @@
+from typing import Any, Dict
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+
+from config import settings
+from database.async_database import AsyncDatabaseService
+from database.database import DatabaseService
+from database.query_stats import query_stats
+from routers.auth import get_current_user
+from services.geofence import geofence_guard
+from services.idempotency import idempotency_store
+from services.security import password_hasher
+from services.stamp_buffer import stamp_buffer
+from services.tenant_cache import tenant_cache
+from services.user_cache import user_cache
+
+router = APIRouter(prefix="/api/diagnostics", tags=["diagnostics"])
+
+_QUERY_ORDERINGS = {"total_ms", "mean_ms", "max_ms", "calls", "rows", "slow_calls"}
+
+
+def require_admin(current_user: Dict[str, Any] = Depends(get_current_user)) -> Dict[str, Any]:
+    # users.role は登録時の入力に由来するため、サーバー側の設定で許可した利用者だけに見せる
+    allowed = {entry.strip() for entry in settings.DIAGNOSTICS_ADMINS.split(",") if entry.strip()}
+    if f"{current_user.get('tenant_id')}:{current_user.get('username')}" not in allowed:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized")
+    return current_user
+
+
+@router.get("")
+async def read_diagnostics(
+    request: Request,
+    limit: int = Query(50, ge=1, le=500),
+    order_by: str = Query("total_ms"),
+    admin: Dict[str, Any] = Depends(require_admin),
+) -> Dict[str, Any]:
+    """このワーカーのクエリ統計・プール・キャッシュの状態を返す"""
+    if order_by not in _QUERY_ORDERINGS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"order_by must be one of {sorted(_QUERY_ORDERINGS)}",
+        )
+    return {
+        "startup": getattr(request.app.state, "startup_report", {}),
+        "queries": {
+            "slow_query_ms": query_stats.slow_query_ms,
+            "explain_sample_rate": query_stats.explain_sample_rate,
+            "untracked_fingerprints": query_stats.dropped,
+            "statements": query_stats.snapshot(limit=limit, order_by=order_by),
+        },
+        "pools": {
+            "sync": DatabaseService.pool_stats(),
+            "async": AsyncDatabaseService.pool_stats(),
+            "replicas": AsyncDatabaseService.replica_stats(),
+        },
+        "tenant_cache": tenant_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "idempotency": idempotency_store.stats(),
+        "stamp_buffer": stamp_buffer.stats(),
+        "geofence": geofence_guard.stats(),
+        "password_hasher": password_hasher.stats(),
+    }
+
+
+@router.delete("/queries", status_code=status.HTTP_204_NO_CONTENT)
+async def reset_query_stats(admin: Dict[str, Any] = Depends(require_admin)) -> None:
+    query_stats.reset()
@@ -1,19 +1,26 @@
+import csv
+import hashlib
+import io
 import json
 import logging
 import re
 import secrets
 from datetime import date, datetime, timedelta
-from typing import Any, Dict, List, Optional
-from zoneinfo import ZoneInfo
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Security, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, Security, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import JWTError, jwt
 from pydantic import BaseModel, EmailStr, Field
 
 from config import settings
-from database.database import DatabaseService, get_db_service
-from services.security import create_access_token, get_password_hash, verify_password
+from database.async_database import AsyncDatabaseService, db_deadline, get_async_db_service
+from routers.auth import get_current_user, optional_oauth2_scheme
+from services.campaign_calendar import utc_offset, zone_info
+from services.security import create_access_token, password_hasher
+from services.store_locator import load_store_locator
+from services.tenant_cache import TenantSnapshot, tenant_cache
 
 
 logger = logging.getLogger(__name__)
@@ -57,6 +64,15 @@ class StoreModel(BaseModel):
     imageUrl: Optional[str] = None
     hasStamped: bool = False
     stampMark: Optional[str] = None
+    geofenceRadius: Optional[float] = None
+
+
+class NearbyStoreModel(StoreModel):
+    distance: float  # 検索地点からの距離 (メートル)
+
+
+class NearbyStoresResponse(BaseModel):
+    stores: List[NearbyStoreModel]
 
 
 class CouponSeed(BaseModel):
@@ -151,6 +167,7 @@ class StoreCreateRequest(BaseModel):
     description: Optional[str] = None
     image_url: Optional[str] = None
     stamp_mark: Optional[str] = None
+    geofence_radius: Optional[float] = Field(default=None, ge=0)  # メートル。None なら既定、0 なら確認しない
 
 
 class RewardRuleUpsertRequest(BaseModel):
@@ -178,7 +195,6 @@ bearer_scheme = HTTPBearer(auto_error=False)
 ALLOWED_THEME_COLORS = {"orange", "teal", "green", "pink"}
 ALLOWED_COUPON_USAGE_MODES = {"campaign", "custom"}
 ALLOWED_LANGUAGES = {"ja", "en", "zh"}
-_UTC_OFFSET_PATTERN = re.compile(r"^UTC([+-])(?:(\d{1,2})(?::([0-5]\d))?)$")
 _UTC_OFFSET_FALLBACK = "UTC+09:00"
 DEFAULT_LANGUAGE = "ja"
 
@@ -204,17 +220,12 @@ def _coerce_timezone_to_offset(value: Optional[str]) -> Optional[str]:
     text = value.strip()
     if not text:
         return None
-    match = _UTC_OFFSET_PATTERN.fullmatch(text)
-    if match:
-        sign, hours_text, minutes_text = match.groups()
-        hours = int(hours_text)
-        minutes = int(minutes_text or "00")
-        if hours > 14 or (hours == 14 and minutes != 0):
-            return None
-        return f"UTC{sign}{hours:02d}:{minutes:02d}"
-    try:
-        tz = ZoneInfo(text)
-    except Exception:
+    offset = utc_offset(text)
+    if offset is not None:
+        return _format_offset(offset)
+    # IANA 名はその時点のオフセットに直す (ZoneInfo は名前ごとにキャッシュ済み)
+    tz = zone_info(text)
+    if tz is None:
         return None
     offset = datetime.now(tz).utcoffset()
     if offset is None:
@@ -290,9 +301,9 @@ def generate_store_identifier(name: str, fallback: Optional[str] = None) -> str:
 @router.post("/login", response_model=TenantLoginResponse)
 async def tenant_login(
     payload: TenantLoginRequest,
-    db: DatabaseService = Depends(get_db_service),
+    db: AsyncDatabaseService = Depends(get_async_db_service),
 ) -> TenantLoginResponse:
-    tenant_rows = db.execute_query(
+    tenant_rows = await db.execute_query(
         """
         SELECT tenant_id, company_name, admin_password_hash, admin_password_must_change
         FROM tenants
@@ -305,8 +316,10 @@ async def tenant_login(
 
     tenant = tenant_rows[0]
     stored_hash = tenant.get("admin_password_hash")
+    # 照合の間は接続を持たない
+    await db.release()
 
-    if not stored_hash or not verify_password(payload.password, stored_hash):
+    if not stored_hash or not await password_hasher.verify(payload.password, stored_hash):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
     access_token = create_access_token(
@@ -326,9 +339,9 @@ async def tenant_login(
 @router.post("/reset-password", status_code=status.HTTP_204_NO_CONTENT)
 async def reset_tenant_password(
     payload: TenantPasswordResetRequest,
-    db: DatabaseService = Depends(get_db_service),
+    db: AsyncDatabaseService = Depends(get_async_db_service),
 ):
-    tenant_rows = db.execute_query(
+    tenant_rows = await db.execute_query(
         """
         SELECT admin_password_hash
         FROM tenants
@@ -340,51 +353,46 @@ async def reset_tenant_password(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tenant not found")
 
     stored_hash = tenant_rows[0].get("admin_password_hash")
-    if not stored_hash or not verify_password(payload.current_password, stored_hash):
+    # 照合とハッシュ計算の間は接続を持たない。更新は新しいトランザクションで行う
+    await db.release()
+    if not stored_hash or not await password_hasher.verify(payload.current_password, stored_hash):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
 
-    new_hash = get_password_hash(payload.new_password)
-    db.execute_query(
-        """
-        UPDATE tenants
-        SET
-            admin_password_hash = %s,
-            admin_password_must_change = FALSE,
-            updated_at = CURRENT_TIMESTAMP
-        WHERE tenant_id = %s
-        """,
-        (new_hash, payload.tenant_id),
-    )
+    new_hash = await password_hasher.hash(payload.new_password)
+    await db.reacquire()
+    async with db.transaction():
+        await db.execute_query(
+            """
+            UPDATE tenants
+            SET
+                admin_password_hash = %s,
+                admin_password_must_change = FALSE,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE tenant_id = %s
+            """,
+            (new_hash, payload.tenant_id),
+        )
 
 
-@router.get("/{tenant_id}", response_model=TenantSeedResponse)
-async def fetch_tenant_seed(
-    tenant_id: str,
-    db: DatabaseService = Depends(get_db_service),
-) -> TenantSeedResponse:
-    tenant_rows = db.execute_query(
-        """
-        SELECT tenant_id, company_name, config
-        FROM tenants
-        WHERE tenant_id = %s AND is_active = TRUE
-        """,
-        (tenant_id,),
-    )
-    if not tenant_rows:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tenant not found")
+def _store_fields(row: Any, tenant_id: str, has_stamped: bool = False) -> Dict[str, Any]:
+    return {
+        "id": row["store_id"],
+        "tenantId": tenant_id,
+        "name": row["name"],
+        "lat": float(row["lat"]),
+        "lng": float(row["lng"]),
+        "description": row.get("description"),
+        "imageUrl": row.get("image_url"),
+        "hasStamped": has_stamped,
+        "stampMark": row.get("stamp_mark"),
+        "geofenceRadius": row.get("geofence_radius_m"),
+    }
 
-    tenant = tenant_rows[0]
-    raw_config = tenant.get("config") or {}
-    if isinstance(raw_config, str):
-        try:
-            config = json.loads(raw_config)
-        except json.JSONDecodeError:
-            logger.warning("Invalid config JSON for tenant %s", tenant_id)
-            config = {}
-    else:
-        config = raw_config
 
-    tenant_name = config.get("tenantName") or tenant["company_name"]
+def _build_tenant_seed(snapshot: TenantSnapshot) -> TenantSeedResponse:
+    tenant_id = snapshot.tenant_id
+    config = snapshot.config
+    tenant_name = config.get("tenantName") or snapshot.company_name
     stamp_image_url = config.get("stampImageUrl")
     background_image_url = config.get("backgroundImageUrl")
     campaign_start = config.get("campaignStart")
@@ -410,47 +418,16 @@ async def fetch_tenant_seed(
     except (TypeError, ValueError):
         max_stamp_count = None
 
-    rules_rows = db.execute_query(
-        """
-        SELECT threshold, label, icon
-        FROM reward_rules
-        WHERE tenant_id = %s
-        ORDER BY threshold
-        """,
-        (tenant_id,),
-    )
     rules = [
         RewardRuleModel(
-            threshold=row["threshold"],
-            label=row["label"],
-            icon=row.get("icon"),
+            threshold=rule["threshold"],
+            label=rule["label"],
+            icon=rule.get("icon"),
         )
-        for row in rules_rows
+        for rule in snapshot.rules
     ]
 
-    store_rows = db.execute_query(
-        """
-        SELECT store_id, name, lat, lng, description, image_url, stamp_mark
-        FROM stores
-        WHERE tenant_id = %s
-        ORDER BY name
-        """,
-        (tenant_id,),
-    )
-    stores = [
-        StoreModel(
-            id=row["store_id"],
-            tenantId=tenant_id,
-            name=row["name"],
-            lat=float(row["lat"]),
-            lng=float(row["lng"]),
-            description=row.get("description"),
-            imageUrl=row.get("image_url"),
-            hasStamped=False,
-            stampMark=row.get("stamp_mark"),
-        )
-        for row in store_rows
-    ]
+    stores = [StoreModel(**_store_fields(row, tenant_id)) for row in snapshot.stores]
 
     coupons_config = config.get("initialCoupons") or config.get("initial_coupons") or []
     coupons = [
@@ -497,15 +474,97 @@ async def fetch_tenant_seed(
     )
 
 
+def _encode_tenant_seed(snapshot: TenantSnapshot) -> Tuple[bytes, str]:
+    """シード応答を JSON バイト列と強い ETag に変換する (スナップショットごとに 1 回)"""
+    body = _build_tenant_seed(snapshot).model_dump_json().encode("utf-8")
+    etag = '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+    return body, etag
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    if "*" in candidates:
+        return True
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+@router.get("/{tenant_id}", response_model=TenantSeedResponse)
+async def fetch_tenant_seed(
+    tenant_id: str,
+    if_none_match: Optional[str] = Header(default=None),
+) -> Response:
+    # キャッシュが有効な間は DB 接続もモデル生成も行わない
+    snapshot = await tenant_cache.get(None, tenant_id)
+    if snapshot is None or not snapshot.is_active:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tenant not found")
+
+    body, etag = snapshot.derive("seed", _encode_tenant_seed)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.TENANT_SEED_MAX_AGE}, must-revalidate",
+    }
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@router.get("/{tenant_id}/stores/nearby", response_model=NearbyStoresResponse)
+async def find_nearby_stores(
+    tenant_id: str,
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius: Optional[float] = Query(default=None, gt=0, description="検索半径 (メートル、省略時は無制限)"),
+    limit: int = Query(default=10, ge=1, le=100),
+    unstamped: bool = Query(default=False, description="ログイン中の利用者がまだスタンプを押していない店舗だけ"),
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+) -> NearbyStoresResponse:
+    """近い順に店舗を返す。店舗一覧はキャッシュ済みの KD 木から引く
+
+    ``unstamped=true`` のときだけ認証とスタンプ済み店舗の取得で DB を使う。
+    """
+    snapshot = await tenant_cache.get(None, tenant_id)
+    if snapshot is None or not snapshot.is_active:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tenant not found")
+
+    stamped: List[str] = []
+    if unstamped:
+        if not token:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Not authenticated",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        async with AsyncDatabaseService(read_only=True) as db:
+            user = await get_current_user(token=token, db=db)
+            rows = await db.execute_query(
+                "SELECT store_id FROM user_store_stamps WHERE user_id = %s AND tenant_id = %s",
+                (user["id"], tenant_id),
+                row_format="tuple",
+            )
+        stamped = [row[0] for row in rows]
+
+    locator = await load_store_locator(snapshot)
+    nearest = locator.nearest(lat, lng, limit, radius_meters=radius, exclude=stamped)
+    return NearbyStoresResponse(
+        stores=[
+            NearbyStoreModel(**_store_fields(row, tenant_id), distance=round(distance, 1))
+            for row, distance in nearest
+        ]
+    )
+
+
 @router.get(
     "/{tenant_id}/dashboard-stats",
     response_model=TenantDashboardStatsResponse,
+    dependencies=[Depends(db_deadline(settings.DB_REPORT_STATEMENT_TIMEOUT_MS))],
 )
 async def get_tenant_dashboard_stats(
     tenant_id: str,
     days: int = Query(14, ge=1, le=90),
     admin: dict = Depends(get_current_tenant_admin),
-    db: DatabaseService = Depends(get_db_service),
+    db: AsyncDatabaseService = Depends(get_async_db_service),
 ) -> TenantDashboardStatsResponse:
     if admin.get("tenant_id") != tenant_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized for this tenant")
@@ -513,39 +572,50 @@ async def get_tenant_dashboard_stats(
     range_end = date.today()
     total_days = max(1, min(days, 90))
     range_start = range_end - timedelta(days=total_days - 1)
-    end_exclusive = range_end + timedelta(days=1)
-
-    daily_rows = db.execute_query(
-        """
-        SELECT
-            DATE(stamped_at) AS day,
-            COUNT(DISTINCT user_id) AS user_count,
-            COUNT(*) AS stamp_count
-        FROM user_store_stamps
-        WHERE tenant_id = %s
-          AND stamped_at >= %s
-          AND stamped_at < %s
-        GROUP BY DATE(stamped_at)
-        ORDER BY DATE(stamped_at)
-        """,
-        (tenant_id, range_start, end_exclusive),
-    )
 
-    totals_rows = db.execute_query(
-        """
-        SELECT
-            COUNT(DISTINCT user_id) AS total_users,
-            COUNT(*) AS total_stamps
-        FROM user_store_stamps
-        WHERE tenant_id = %s
-          AND stamped_at >= %s
-          AND stamped_at < %s
-        """,
-        (tenant_id, range_start, end_exclusive),
+    # トリガーで更新される日次ロールアップを読むため、期間の日数分 (× スロット数) の行だけで済む。
+    # 3 つの集計は互いに独立しているので1 回の送信 (execute_batch) にまとめる。
+    period = (tenant_id, range_start, range_end)
+    daily_rows, totals_rows, coupon_rows = await db.execute_batch(
+        [
+            (
+                """
+                SELECT day, SUM(users) AS user_count, SUM(stamps) AS stamp_count
+                FROM tenant_daily_stats
+                WHERE tenant_id = %s
+                  AND day BETWEEN %s AND %s
+                GROUP BY day
+                ORDER BY day
+                """,
+                period,
+            ),
+            # 期間内のユニークユーザー数は日別の合計にならないため、ユーザー日次テーブルから数える
+            (
+                """
+                SELECT COUNT(DISTINCT user_id) AS total_users
+                FROM tenant_daily_active_users
+                WHERE tenant_id = %s
+                  AND day BETWEEN %s AND %s
+                """,
+                period,
+            ),
+            (
+                """
+                SELECT coupon_id, MAX(title) AS title, MAX(description) AS description, day,
+                       SUM(acquired) AS acquired, SUM(used) AS used
+                FROM tenant_daily_coupon_stats
+                WHERE tenant_id = %s
+                  AND day BETWEEN %s AND %s
+                GROUP BY coupon_id, day
+                ORDER BY coupon_id, day
+                """,
+                period,
+            ),
+        ],
+        row_format="row",
     )
-    totals = totals_rows[0] if totals_rows else {"total_users": 0, "total_stamps": 0}
-    total_users = int(totals.get("total_users", 0) or 0)
-    total_stamps = int(totals.get("total_stamps", 0) or 0)
+    total_users = int((totals_rows[0].get("total_users") if totals_rows else 0) or 0)
+    total_stamps = sum(int(row.get("stamp_count", 0) or 0) for row in daily_rows)
 
     date_sequence = [
         (range_start + timedelta(days=offset)).isoformat()
@@ -573,69 +643,7 @@ async def get_tenant_dashboard_stats(
 
     coupon_stats: Dict[str, Dict[str, Any]] = {}
 
-    coupon_acquired_rows = db.execute_query(
-        """
-        SELECT
-            coupon_id,
-            COALESCE(MAX(title), coupon_id) AS title,
-            MAX(description) AS description,
-            DATE(created_at) AS day,
-            COUNT(*) AS acquired_count
-        FROM user_coupons
-        WHERE tenant_id = %s
-          AND created_at >= %s
-          AND created_at < %s
-        GROUP BY coupon_id, DATE(created_at)
-        ORDER BY coupon_id, day
-        """,
-        (tenant_id, range_start, end_exclusive),
-    )
-
-    for row in coupon_acquired_rows:
-        coupon_id = row["coupon_id"]
-        title = row.get("title") or coupon_id
-        description = row.get("description")
-        day_value = row["day"]
-        day_iso = day_value.isoformat() if hasattr(day_value, "isoformat") else str(day_value)
-        stats = coupon_stats.setdefault(
-            coupon_id,
-            {
-                "couponId": coupon_id,
-                "title": title,
-                "description": description,
-                "acquired": {key: 0 for key in date_sequence},
-                "used": {key: 0 for key in date_sequence},
-            },
-        )
-        if not stats.get("title") and title:
-            stats["title"] = title
-        if not stats.get("description") and description:
-            stats["description"] = description
-        acquired_counts = stats.setdefault("acquired", {key: 0 for key in date_sequence})
-        if isinstance(acquired_counts, dict) and day_iso in acquired_counts:
-            acquired_counts[day_iso] = int(row.get("acquired_count", 0) or 0)
-
-    coupon_used_rows = db.execute_query(
-        """
-        SELECT
-            coupon_id,
-            COALESCE(MAX(title), coupon_id) AS title,
-            MAX(description) AS description,
-            DATE(updated_at) AS day,
-            COUNT(*) AS used_count
-        FROM user_coupons
-        WHERE tenant_id = %s
-          AND used = TRUE
-          AND updated_at IS NOT NULL
-          AND updated_at >= %s
-          AND updated_at < %s
-        GROUP BY coupon_id, DATE(updated_at)
-        ORDER BY coupon_id, day
-        """,
-        (tenant_id, range_start, end_exclusive),
-    )
-
-    for row in coupon_used_rows:
+    for row in coupon_rows:
         coupon_id = row["coupon_id"]
         title = row.get("title") or coupon_id
         description = row.get("description")
@@ -651,26 +659,17 @@ async def get_tenant_dashboard_stats(
                 "used": {key: 0 for key in date_sequence},
             },
         )
-        if not stats.get("title") and title:
-            stats["title"] = title
         if not stats.get("description") and description:
             stats["description"] = description
-        used_counts = stats.setdefault("used", {key: 0 for key in date_sequence})
-        if isinstance(used_counts, dict) and day_iso in used_counts:
-            used_counts[day_iso] = int(row.get("used_count", 0) or 0)
+        if day_iso in stats["acquired"]:
+            stats["acquired"][day_iso] = int(row.get("acquired", 0) or 0)
+            stats["used"][day_iso] = int(row.get("used", 0) or 0)
 
-    reward_rule_rows = db.execute_query(
-        """
-        SELECT threshold, label
-        FROM reward_rules
-        WHERE tenant_id = %s
-        """,
-        (tenant_id,),
-    )
+    snapshot = await tenant_cache.get(db, tenant_id)
     reward_rule_label_map = {
-        f"tenant-{tenant_id}-rule-{row['threshold']}": row["label"]
-        for row in reward_rule_rows
-        if row.get("threshold") is not None and row.get("label")
+        f"tenant-{tenant_id}-rule-{rule['threshold']}": rule["label"]
+        for rule in (snapshot.rules if snapshot else [])
+        if rule.get("label")
     }
 
     for coupon_id, stats in coupon_stats.items():
@@ -718,68 +717,120 @@ async def get_tenant_dashboard_stats(
     )
 
 
+_STAMP_EXPORT_COLUMNS = ["stamped_at", "user_id", "username", "store_id", "store_name"]
+_EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+async def _stream_stamp_history_csv(tenant_id: str) -> AsyncIterator[str]:
+    # レスポンス送信中も接続が必要なため、依存性注入ではなくここで接続を借りる
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(_STAMP_EXPORT_COLUMNS)
+    async with AsyncDatabaseService(
+        read_only=True, statement_timeout_ms=settings.DB_REPORT_STATEMENT_TIMEOUT_MS, replica=True
+    ) as db:
+        async for row in db.stream_query(
+            """
+            SELECT s.stamped_at, s.user_id, u.username, s.store_id, st.name AS store_name
+            FROM user_store_stamps s
+            JOIN users u ON u.id = s.user_id
+            LEFT JOIN stores st ON st.tenant_id = s.tenant_id AND st.store_id = s.store_id
+            WHERE s.tenant_id = %s
+            ORDER BY s.stamped_at, s.id
+            """,
+            (tenant_id,),
+            row_format="row",
+        ):
+            stamped_at = row["stamped_at"]
+            writer.writerow(
+                [
+                    stamped_at.isoformat() if stamped_at else "",
+                    row["user_id"],
+                    row["username"],
+                    row["store_id"],
+                    row["store_name"] or "",
+                ]
+            )
+            if buffer.tell() >= _EXPORT_CHUNK_BYTES:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue()
+
+
+@router.get("/{tenant_id}/exports/stamps.csv")
+async def export_stamp_history(
+    tenant_id: str,
+    admin: dict = Depends(get_current_tenant_admin),
+) -> StreamingResponse:
+    """スタンプ履歴を CSV で返す (サーバーサイドカーソルで逐次送信する)"""
+    if admin.get("tenant_id") != tenant_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized for this tenant")
+    return StreamingResponse(
+        _stream_stamp_history_csv(tenant_id),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{tenant_id}-stamps.csv"'},
+    )
+
+
 @router.post("/{tenant_id}/stores", response_model=StoreModel, status_code=status.HTTP_201_CREATED)
 async def create_or_update_store(
     tenant_id: str,
     payload: StoreCreateRequest,
     admin: dict = Depends(get_current_tenant_admin),
-    db: DatabaseService = Depends(get_db_service),
+    db: AsyncDatabaseService = Depends(get_async_db_service),
 ) -> StoreModel:
     if admin.get("tenant_id") != tenant_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized for this tenant")
 
     store_identifier = generate_store_identifier(payload.name, payload.store_id)
-    result = db.execute_query(
-        """
-        INSERT INTO stores (
-            tenant_id,
-            store_id,
-            name,
-            lat,
-            lng,
-            description,
-            image_url,
-            stamp_mark
+    async with db.transaction():
+        result = await db.execute_query(
+            """
+            INSERT INTO stores (
+                tenant_id,
+                store_id,
+                name,
+                lat,
+                lng,
+                description,
+                image_url,
+                stamp_mark,
+                geofence_radius_m
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (tenant_id, store_id)
+            DO UPDATE SET
+                name = EXCLUDED.name,
+                lat = EXCLUDED.lat,
+                lng = EXCLUDED.lng,
+                description = EXCLUDED.description,
+                image_url = EXCLUDED.image_url,
+                stamp_mark = EXCLUDED.stamp_mark,
+                geofence_radius_m = CASE WHEN %s THEN EXCLUDED.geofence_radius_m ELSE stores.geofence_radius_m END,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING store_id, name, lat, lng, description, image_url, stamp_mark, geofence_radius_m
+            """,
+            (
+                tenant_id,
+                store_identifier,
+                payload.name,
+                payload.lat,
+                payload.lng,
+                payload.description,
+                payload.image_url,
+                payload.stamp_mark,
+                payload.geofence_radius,
+                # 半径を送らない既存の編集画面からの更新では設定済みの半径を残す
+                "geofence_radius" in payload.model_fields_set,
+            ),
         )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (tenant_id, store_id)
-        DO UPDATE SET
-            name = EXCLUDED.name,
-            lat = EXCLUDED.lat,
-            lng = EXCLUDED.lng,
-            description = EXCLUDED.description,
-            image_url = EXCLUDED.image_url,
-            stamp_mark = EXCLUDED.stamp_mark,
-            updated_at = CURRENT_TIMESTAMP
-        RETURNING store_id, name, lat, lng, description, image_url, stamp_mark
-        """,
-        (
-            tenant_id,
-            store_identifier,
-            payload.name,
-            payload.lat,
-            payload.lng,
-            payload.description,
-            payload.image_url,
-            payload.stamp_mark,
-        ),
-    )
 
-    if not result:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to save store")
+        if not result:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to save store")
+        await tenant_cache.bump_version(db, tenant_id)
 
-    record = result[0]
-    return StoreModel(
-        id=record["store_id"],
-        tenantId=tenant_id,
-        name=record["name"],
-        lat=float(record["lat"]),
-        lng=float(record["lng"]),
-        description=record.get("description"),
-        imageUrl=record.get("image_url"),
-        stampMark=record.get("stamp_mark"),
-        hasStamped=False,
-    )
+    return StoreModel(**_store_fields(result[0], tenant_id))
 
 
 @router.delete("/{tenant_id}/stores/{store_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -787,22 +838,24 @@ async def delete_store(
     tenant_id: str,
     store_id: str,
     admin: dict = Depends(get_current_tenant_admin),
-    db: DatabaseService = Depends(get_db_service),
+    db: AsyncDatabaseService = Depends(get_async_db_service),
 ) -> None:
     if admin.get("tenant_id") != tenant_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized for this tenant")
 
-    deleted = db.execute_query(
-        """
-        DELETE FROM stores
-        WHERE tenant_id = %s AND store_id = %s
-        RETURNING store_id
-        """,
-        (tenant_id, store_id),
-    )
+    async with db.transaction():
+        deleted = await db.execute_query(
+            """
+            DELETE FROM stores
+            WHERE tenant_id = %s AND store_id = %s
+            RETURNING store_id
+            """,
+            (tenant_id, store_id),
+        )
 
-    if not deleted:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Store not found")
+        if not deleted:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Store not found")
+        await tenant_cache.bump_version(db, tenant_id)
 
 
 @router.post("/{tenant_id}/reward-rules", response_model=RewardRuleModel, status_code=status.HTTP_201_CREATED)
@@ -810,27 +863,29 @@ async def upsert_reward_rule(
     tenant_id: str,
     payload: RewardRuleUpsertRequest,
     admin: dict = Depends(get_current_tenant_admin),
-    db: DatabaseService = Depends(get_db_service),
+    db: AsyncDatabaseService = Depends(get_async_db_service),
 ) -> RewardRuleModel:
     if admin.get("tenant_id") != tenant_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized for this tenant")
 
-    result = db.execute_query(
-        """
-        INSERT INTO reward_rules (tenant_id, threshold, label, icon)
-        VALUES (%s, %s, %s, %s)
-        ON CONFLICT (tenant_id, threshold)
-        DO UPDATE SET
-            label = EXCLUDED.label,
-            icon = EXCLUDED.icon,
-            updated_at = CURRENT_TIMESTAMP
-        RETURNING threshold, label, icon
-        """,
-        (tenant_id, payload.threshold, payload.label, payload.icon),
-    )
+    async with db.transaction():
+        result = await db.execute_query(
+            """
+            INSERT INTO reward_rules (tenant_id, threshold, label, icon)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (tenant_id, threshold)
+            DO UPDATE SET
+                label = EXCLUDED.label,
+                icon = EXCLUDED.icon,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING threshold, label, icon
+            """,
+            (tenant_id, payload.threshold, payload.label, payload.icon),
+        )
 
-    if not result:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to save reward rule")
+        if not result:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to save reward rule")
+        await tenant_cache.bump_version(db, tenant_id)
 
     record = result[0]
     return RewardRuleModel(
@@ -845,22 +900,24 @@ async def delete_reward_rule(
     tenant_id: str,
     threshold: int,
     admin: dict = Depends(get_current_tenant_admin),
-    db: DatabaseService = Depends(get_db_service),
+    db: AsyncDatabaseService = Depends(get_async_db_service),
 ) -> None:
     if admin.get("tenant_id") != tenant_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized for this tenant")
 
-    deleted = db.execute_query(
-        """
-        DELETE FROM reward_rules
-        WHERE tenant_id = %s AND threshold = %s
-        RETURNING threshold
-        """,
-        (tenant_id, threshold),
-    )
+    async with db.transaction():
+        deleted = await db.execute_query(
+            """
+            DELETE FROM reward_rules
+            WHERE tenant_id = %s AND threshold = %s
+            RETURNING threshold
+            """,
+            (tenant_id, threshold),
+        )
 
-    if not deleted:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reward rule not found")
+        if not deleted:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Reward rule not found")
+        await tenant_cache.bump_version(db, tenant_id)
 
 
 @router.put("/{tenant_id}/campaign", response_model=TenantConfigModel)
@@ -868,12 +925,12 @@ async def update_campaign_details(
     tenant_id: str,
     payload: CampaignUpdateRequest,
     admin: dict = Depends(get_current_tenant_admin),
-    db: DatabaseService = Depends(get_db_service),
+    db: AsyncDatabaseService = Depends(get_async_db_service),
 ) -> TenantConfigModel:
     if admin.get("tenant_id") != tenant_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized for this tenant")
 
-    config_rows = db.execute_query(
+    config_rows = await db.execute_query(
         "SELECT company_name, config FROM tenants WHERE tenant_id = %s",
         (tenant_id,),
     )
@@ -953,32 +1010,26 @@ async def update_campaign_details(
     coupon_usage_start = config.get("couponUsageStart") if coupon_usage_mode == "custom" else None
     coupon_usage_end = config.get("couponUsageEnd") if coupon_usage_mode == "custom" else None
 
-    db.execute_query(
-        """
-        UPDATE tenants
-        SET config = %s::jsonb,
-            updated_at = CURRENT_TIMESTAMP
-        WHERE tenant_id = %s
-        """,
-        (json.dumps(config), tenant_id),
-    )
+    async with db.transaction():
+        await db.execute_query(
+            """
+            UPDATE tenants
+            SET config = %s::jsonb,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE tenant_id = %s
+            """,
+            (json.dumps(config), tenant_id),
+        )
+        await tenant_cache.bump_version(db, tenant_id)
 
-    rules_rows = db.execute_query(
-        """
-        SELECT threshold, label, icon
-        FROM reward_rules
-        WHERE tenant_id = %s
-        ORDER BY threshold
-        """,
-        (tenant_id,),
-    )
+    snapshot = await tenant_cache.get(db, tenant_id)
     rules = [
         RewardRuleModel(
-            threshold=row["threshold"],
-            label=row["label"],
-            icon=row.get("icon"),
+            threshold=rule["threshold"],
+            label=rule["label"],
+            icon=rule.get("icon"),
         )
-        for row in rules_rows
+        for rule in (snapshot.rules if snapshot else [])
     ]
     max_stamp_config = config.get("maxStampCount")
     try:
@@ -1009,13 +1060,13 @@ async def update_campaign_details(
 @router.post("/", response_model=TenantCreateResponse, status_code=status.HTTP_201_CREATED)
 async def create_tenant(
     payload: TenantCreateRequest,
-    db: DatabaseService = Depends(get_db_service),
+    db: AsyncDatabaseService = Depends(get_async_db_service),
 ) -> TenantCreateResponse:
     tenant_id = (payload.tenant_id or payload.company_name).strip().lower()
     if not tenant_id:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="tenant_id is required")
 
-    existing = db.execute_query(
+    existing = await db.execute_query(
         "SELECT tenant_id FROM tenants WHERE tenant_id = %s",
         (tenant_id,),
     )
@@ -1023,7 +1074,10 @@ async def create_tenant(
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Tenant already exists")
 
     initial_password = payload.initial_password or secrets.token_urlsafe(10)
-    password_hash = get_password_hash(initial_password)
+    # ハッシュ計算の間は接続を持たない。書き込みは新しいトランザクションで行う
+    await db.release()
+    password_hash = await password_hasher.hash(initial_password)
+    await db.reacquire()
 
     config_payload = {
         "tenantName": payload.company_name,
@@ -1042,34 +1096,35 @@ async def create_tenant(
         "language": DEFAULT_LANGUAGE,
     }
 
-    inserted = db.execute_query(
-        """
-        INSERT INTO tenants (
-            tenant_id,
-            company_name,
-            business_type,
-            admin_name,
-            admin_email,
-            admin_phone,
-            admin_password_hash,
-            admin_password_must_change,
-            config,
-            is_active
+    async with db.transaction():
+        inserted = await db.execute_query(
+            """
+            INSERT INTO tenants (
+                tenant_id,
+                company_name,
+                business_type,
+                admin_name,
+                admin_email,
+                admin_phone,
+                admin_password_hash,
+                admin_password_must_change,
+                config,
+                is_active
+            )
+            VALUES (%s, %s, %s, %s, %s, %s, %s, TRUE, %s::jsonb, TRUE)
+            RETURNING tenant_id, company_name, admin_email
+            """,
+            (
+                tenant_id,
+                payload.company_name,
+                payload.business_type,
+                payload.admin_name,
+                payload.admin_email,
+                payload.admin_phone,
+                password_hash,
+                json.dumps(config_payload),
+            ),
         )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, TRUE, %s::jsonb, TRUE)
-        RETURNING tenant_id, company_name, admin_email
-        """,
-        (
-            tenant_id,
-            payload.company_name,
-            payload.business_type,
-            payload.admin_name,
-            payload.admin_email,
-            payload.admin_phone,
-            password_hash,
-            json.dumps(config_payload),
-        ),
-    )
 
     if not inserted:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to create tenant")
@@ -1,22 +1,33 @@
 import secrets
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
 
 from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile, status
 from pydantic import BaseModel
-from PIL import Image, ImageOps
-import pillow_heif  # type: ignore
-from pillow_heif import read_heif  # type: ignore
 
 from .tenants import get_current_tenant_admin
 
+if TYPE_CHECKING:
+    from PIL import Image
+
 router = APIRouter(prefix="/api/uploads", tags=["uploads"])
 
-try:
-    pillow_heif.register_heif_opener()
-except Exception:
-    # HEIF サポートが初期化できない環境では、HEIC 画像を扱うタイミングでエラーを返す。
-    pass
+
+@lru_cache(maxsize=None)
+def _imaging() -> SimpleNamespace:
+    """Pillow / pillow_heif は変換が必要になった最初のアップロードで読み込む"""
+    from PIL import Image, ImageOps
+    import pillow_heif  # type: ignore
+
+    try:
+        pillow_heif.register_heif_opener()
+    except Exception:
+        # HEIF サポートが初期化できない環境では、HEIC 画像を扱うタイミングでエラーを返す。
+        pass
+    return SimpleNamespace(Image=Image, ImageOps=ImageOps, read_heif=pillow_heif.read_heif)
 
 STATIC_DIR = Path(__file__).resolve().parent.parent / "static"
 UPLOAD_DIR = STATIC_DIR / "uploads"
@@ -53,10 +64,12 @@ class UploadResponse(BaseModel):
     size: int
 
 
-def _load_image_from_bytes(data: bytes, content_type: str) -> Image.Image:
+def _load_image_from_bytes(data: bytes, content_type: str) -> "Image.Image":
     """
     Pillow が HEIC/HEIF を扱えない環境でも安全に Image を生成するユーティリティ。
     """
+    imaging = _imaging()
+    Image = imaging.Image
     normalized_type = content_type.lower()
     buffer = BytesIO(data)
     try:
@@ -69,7 +82,7 @@ def _load_image_from_bytes(data: bytes, content_type: str) -> Image.Image:
 
     try:
         buffer.seek(0)
-        heif_file = read_heif(buffer)
+        heif_file = imaging.read_heif(buffer)
     except Exception as exc:  # noqa: BLE001
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -81,8 +94,10 @@ def _load_image_from_bytes(data: bytes, content_type: str) -> Image.Image:
     return image
 
 
-def _convert_image_to_jpeg(image: Image.Image) -> bytes:
+def _convert_image_to_jpeg(image: "Image.Image") -> bytes:
     """JPEG に変換しながら 5MB を下回るようクオリティを調整する。"""
+    imaging = _imaging()
+    Image, ImageOps = imaging.Image, imaging.ImageOps
     if getattr(image, "is_animated", False):
         image.seek(0)
 
@@ -0,0 +1,226 @@
+"""テナントごとのキャンペーン期間 (コンパイル済み)。
+
+テナント設定の ``campaignStart`` / ``campaignEnd`` / ``campaignTimezone`` / ``couponUsage*`` /
+``language`` を、タイムゾーン解決済み・UTC に揃えた日時として 1 度だけ組み立てる。
+スナップショット (services/tenant_cache.py) ごとにメモ化されるため、設定が変わったときだけ
+作り直され、スタンプ記録などの判定は日時の比較 2 回で済む。
+"""
+import logging
+import re
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from functools import lru_cache
+from typing import Any, Dict, Optional
+from zoneinfo import ZoneInfo
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_UTC_OFFSET_PATTERN = re.compile(r"^UTC([+-])(?:(\d{1,2})(?::([0-5]\d))?)$")
+ALLOWED_LANGUAGES = {"ja", "en", "zh"}
+ALLOWED_COUPON_USAGE_MODES = {"campaign", "custom"}
+
+# phase() の戻り値
+BEFORE = "before"
+OPEN = "open"
+AFTER = "after"
+
+
+@lru_cache(maxsize=256)
+def utc_offset(value: Optional[str]) -> Optional[timedelta]:
+    """``UTC±HH:MM`` 形式を timedelta にする (形式外・範囲外は None)"""
+    if not value:
+        return None
+    match = _UTC_OFFSET_PATTERN.fullmatch(value.strip())
+    if not match:
+        return None
+    sign, hours_text, minutes_text = match.groups()
+    hours = int(hours_text)
+    minutes = int(minutes_text or "00")
+    if hours > 14 or (hours == 14 and minutes != 0):
+        return None
+    offset = timedelta(hours=hours, minutes=minutes)
+    return -offset if sign == "-" else offset
+
+
+@lru_cache(maxsize=256)
+def zone_info(name: str) -> Optional[ZoneInfo]:
+    """IANA 名の ZoneInfo (不正な名前は None)。失敗も含めてキャッシュする"""
+    try:
+        return ZoneInfo(name.strip())
+    except Exception:
+        return None
+
+
+def tzinfo_from_offset(value: Optional[str]) -> Optional[tzinfo]:
+    offset = utc_offset(value)
+    return None if offset is None else timezone(offset)
+
+
+def resolve_timezone(value: Optional[str]) -> Optional[tzinfo]:
+    """``UTC±HH:MM`` または IANA 名を tzinfo にする (解決できなければ None)"""
+    if not value or not value.strip():
+        return None
+    return tzinfo_from_offset(value) or zone_info(value)
+
+
+def _resolve_default_timezone() -> tzinfo:
+    tz_value = getattr(settings, "DEFAULT_TIMEZONE", None)
+    resolved = resolve_timezone(tz_value)
+    if resolved is not None:
+        return resolved
+    if tz_value:
+        logger.warning("Invalid DEFAULT_TIMEZONE '%s'. Falling back to system timezone.", tz_value)
+    try:
+        local_tz = datetime.now().astimezone().tzinfo
+        if local_tz:
+            return local_tz
+    except Exception:
+        pass
+    return timezone.utc
+
+
+DEFAULT_TZ = _resolve_default_timezone()
+
+
+def normalize_language(value: Optional[str]) -> str:
+    if not value:
+        return "ja"
+    code = value.strip().lower()
+    return code if code in ALLOWED_LANGUAGES else "ja"
+
+
+def _normalize_iso_datetime(value: str) -> str:
+    if value.endswith("Z"):
+        return value[:-1] + "+00:00"
+    return value
+
+
+def parse_boundary(value: Optional[str], *, end: bool, tz: tzinfo) -> Optional[datetime]:
+    """期間の端を aware な日時にする。日付だけなら開始は 0:00、終了は 23:59:59.999999"""
+    if not value:
+        return None
+    text = value.strip()
+    if not text:
+        return None
+    try:
+        normalized = _normalize_iso_datetime(text)
+        if "T" in normalized or "+" in normalized:
+            dt = datetime.fromisoformat(normalized)
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=tz)
+            else:
+                dt = dt.astimezone(tz)
+        else:
+            campaign_date = date.fromisoformat(normalized)
+            dt = datetime.combine(campaign_date, time.max if end else time.min, tzinfo=tz)
+        return dt
+    except ValueError:
+        return None
+
+
+def config_timezone(config_data: Dict[str, Any]) -> tzinfo:
+    """設定のキャンペーンタイムゾーン (未設定・不正なら既定)"""
+    tz_value = (
+        config_data.get("campaignTimezone")
+        or config_data.get("campaign_timezone")
+        or getattr(settings, "DEFAULT_TIMEZONE", None)
+    )
+    resolved = resolve_timezone(tz_value)
+    if resolved is not None:
+        return resolved
+    if tz_value:
+        logger.warning("Invalid campaign timezone '%s'. Falling back to default.", tz_value)
+    return DEFAULT_TZ
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    return None if value is None else value.astimezone(timezone.utc)
+
+
+class CampaignCalendar:
+    """解決済みのキャンペーン期間・クーポン利用期間・言語"""
+
+    __slots__ = ("tz", "start", "end", "coupon_usage_mode", "coupon_start", "coupon_end", "language")
+
+    def __init__(
+        self,
+        tz: tzinfo,
+        start: Optional[datetime],
+        end: Optional[datetime],
+        coupon_usage_mode: str,
+        coupon_start: Optional[datetime],
+        coupon_end: Optional[datetime],
+        language: str,
+    ):
+        self.tz = tz
+        # 比較を速くするため UTC に揃えて持つ (同じ tzinfo 同士の比較はオフセット計算が要らない)
+        self.start = _as_utc(start)
+        self.end = _as_utc(end)
+        self.coupon_usage_mode = coupon_usage_mode
+        self.coupon_start = _as_utc(coupon_start)
+        self.coupon_end = _as_utc(coupon_end)
+        self.language = language
+
+    def phase(self, now: Optional[datetime] = None) -> str:
+        """キャンペーン期間に対する現在位置 (BEFORE / OPEN / AFTER)"""
+        if self.start is None and self.end is None:
+            return OPEN
+        now = now or datetime.now(timezone.utc)
+        if self.start is not None and now < self.start:
+            return BEFORE
+        if self.end is not None and now > self.end:
+            return AFTER
+        return OPEN
+
+    def coupon_usage_open(self, now: Optional[datetime] = None) -> bool:
+        """クーポン利用期間内か"""
+        now = now or datetime.now(timezone.utc)
+        if self.coupon_start is not None and now < self.coupon_start:
+            return False
+        return self.coupon_end is None or now <= self.coupon_end
+
+
+def compile_calendar(config_data: Dict[str, Any]) -> CampaignCalendar:
+    """テナント設定から CampaignCalendar を組み立てる"""
+    tz = config_timezone(config_data)
+    start_value = config_data.get("campaignStart") or config_data.get("campaign_start")
+    end_value = config_data.get("campaignEnd") or config_data.get("campaign_end")
+    start = parse_boundary(start_value, end=False, tz=tz)
+    end = parse_boundary(end_value, end=True, tz=tz)
+
+    mode = (config_data.get("couponUsageMode") or "campaign").lower()
+    if mode not in ALLOWED_COUPON_USAGE_MODES:
+        mode = "campaign"
+    if mode == "custom":
+        coupon_start = parse_boundary(
+            config_data.get("couponUsageStart") or config_data.get("coupon_usage_start"), end=False, tz=tz
+        )
+        coupon_end = parse_boundary(
+            config_data.get("couponUsageEnd") or config_data.get("coupon_usage_end"), end=True, tz=tz
+        )
+    else:
+        coupon_start, coupon_end = start, end
+
+    return CampaignCalendar(
+        tz=tz,
+        start=start,
+        end=end,
+        coupon_usage_mode=mode,
+        coupon_start=coupon_start,
+        coupon_end=coupon_end,
+        language=normalize_language(config_data.get("language")),
+    )
+
+
+_DEFAULT_CALENDAR: Optional[CampaignCalendar] = None
+
+
+def campaign_calendar(snapshot) -> CampaignCalendar:
+    """スナップショットのカレンダー (設定が変わってスナップショットが作り直されるまで再利用する)"""
+    if snapshot is None:
+        global _DEFAULT_CALENDAR
+        if _DEFAULT_CALENDAR is None:
+            _DEFAULT_CALENDAR = compile_calendar({})
+        return _DEFAULT_CALENDAR
+    return snapshot.derive("campaign_calendar", lambda item: compile_calendar(item.config))
@@ -0,0 +1,126 @@
+"""スタンプ記録時の位置確認 (ジオフェンス)。
+
+StampRequest の ``lat`` / ``lng`` / ``accuracy`` を店舗ごとの半径 (``stores.geofence_radius_m``、
+未設定なら ``STAMP_GEOFENCE_RADIUS_METERS``) と比べる。店舗の座標はスナップショットの KD 木
+(services/store_locator.py) が単位ベクトルとして持っているので DB には問い合わせない。
+``accuracy`` (端末が申告する誤差半径) は ``STAMP_GEOFENCE_MAX_ACCURACY_METERS`` を上限に
+距離から差し引く。
+
+半径が 0 の店舗は確認しない。位置のないリクエストは ``STAMP_GEOFENCE_REQUIRE_LOCATION`` が
+有効なときだけ断る。断った件数は店舗・理由ごとにワーカー内で数え、診断 API で確認できる。
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from config import settings
+from services.store_locator import load_store_locator, store_locator
+
+# check_many の戻り値 (None は通過)
+OUTSIDE = "outside"
+MISSING_LOCATION = "missing_location"
+
+# (store_id, lat, lng, accuracy)
+LocationClaim = Tuple[str, Optional[float], Optional[float], Optional[float]]
+
+
+class GeofenceGuard:
+    """位置の判定と、断った件数の集計"""
+
+    def __init__(self, default_radius: float, max_accuracy: float, require_location: bool):
+        self.default_radius = default_radius
+        self.max_accuracy = max(0.0, max_accuracy)
+        self.require_location = require_location
+        self.checked = 0
+        # (tenant_id, store_id, 理由) -> 件数
+        self._rejections: Dict[Tuple[str, str, str], int] = {}
+
+    def radius_for(self, store: Any) -> float:
+        radius = store.get("geofence_radius_m")
+        return self.default_radius if radius is None else float(radius)
+
+    def check_many(self, snapshot, claims: Sequence[LocationClaim]) -> List[Optional[str]]:
+        """各申告を判定し、断る理由 (OUTSIDE / MISSING_LOCATION) か None を返す
+
+        存在しない店舗は判定しない (記録側で store-not-found になる)。
+        """
+        results: List[Optional[str]] = [None] * len(claims)
+        if snapshot is None:
+            return results
+        locator = store_locator(snapshot)
+        located: List[int] = []
+        for index, (store_id, lat, lng, _accuracy) in enumerate(claims):
+            store = locator.find(store_id)
+            if store is None or self.radius_for(store) <= 0:
+                continue
+            if lat is None or lng is None:
+                if self.require_location:
+                    results[index] = MISSING_LOCATION
+                continue
+            located.append(index)
+
+        distances = locator.distances(
+            [claims[index][0] for index in located],
+            [claims[index][1] for index in located],
+            [claims[index][2] for index in located],
+        )
+        for index, distance in zip(located, distances):
+            store_id, _lat, _lng, accuracy = claims[index]
+            allowance = min(accuracy or 0.0, self.max_accuracy)
+            if distance - allowance > self.radius_for(locator.find(store_id)):
+                results[index] = OUTSIDE
+
+        self.checked += len(claims)
+        for (store_id, _lat, _lng, _accuracy), reason in zip(claims, results):
+            if reason is not None:
+                key = (snapshot.tenant_id, store_id, reason)
+                self._rejections[key] = self._rejections.get(key, 0) + 1
+        return results
+
+    def enabled_for(self, snapshot) -> bool:
+        """既定の半径か、半径を設定した店舗があるか (スナップショットごとにメモ化)"""
+        if snapshot is None:
+            return False
+        if self.default_radius > 0:
+            return True
+        return snapshot.derive(
+            "geofenced", lambda item: any((row.get("geofence_radius_m") or 0) > 0 for row in item.stores)
+        )
+
+    async def check(
+        self,
+        snapshot,
+        store_id: str,
+        lat: Optional[float],
+        lng: Optional[float],
+        accuracy: Optional[float],
+    ) -> Optional[str]:
+        """1 件を判定する。位置確認を使わないテナントでは KD 木も組まない"""
+        if not self.enabled_for(snapshot):
+            return None
+        await load_store_locator(snapshot)
+        return self.check_many(snapshot, [(store_id, lat, lng, accuracy)])[0]
+
+    def clear(self) -> None:
+        self.checked = 0
+        self._rejections.clear()
+
+    def stats(self, limit: int = 50) -> Dict[str, Any]:
+        """断った件数の多い店舗から ``limit`` 件"""
+        ranked = sorted(self._rejections.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return {
+            "default_radius_m": self.default_radius,
+            "max_accuracy_m": self.max_accuracy,
+            "require_location": self.require_location,
+            "checked": self.checked,
+            "rejected": sum(self._rejections.values()),
+            "rejections": [
+                {"tenant_id": tenant_id, "store_id": store_id, "reason": reason, "count": count}
+                for (tenant_id, store_id, reason), count in ranked
+            ],
+        }
+
+
+geofence_guard = GeofenceGuard(
+    settings.STAMP_GEOFENCE_RADIUS_METERS,
+    settings.STAMP_GEOFENCE_MAX_ACCURACY_METERS,
+    settings.STAMP_GEOFENCE_REQUIRE_LOCATION,
+)
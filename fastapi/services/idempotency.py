@@ -0,0 +1,190 @@
+"""``Idempotency-Key`` ヘッダーによる再送の重複排除。
+
+同じ利用者が同じキーで送ったリクエストは 1 回だけ実行し、以降は保存した応答をそのまま返す
+(``Idempotent-Replayed: true`` を付ける)。キーは ``IDEMPOTENCY_TTL_SECONDS`` の間有効。
+
+- ワーカー内: 応答を件数上限付きの LRU に持ち、同じキーの同時リクエストは先行の完了を待って
+  その応答を返す (実行は 1 回)。
+- ワーカー間: ``idempotency_keys`` の行を処理と同じトランザクションで確保する。同時に届いた
+  重複は行ロックで先行のコミットを待ち、保存済みの応答を返す。失敗した処理はロールバックされ、
+  キーも残らないので再送で再実行される。
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from config import settings
+from database.async_database import AsyncDatabaseService
+
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+# キーを確保する。期限切れの行は作り直し、同じ利用者の他の期限切れキーもついでに消す。
+# 有効な行が既にあれば何も返さない (DO UPDATE の WHERE が偽でも行はロックされる)。
+CLAIM_SQL = """
+WITH expired AS (
+    DELETE FROM idempotency_keys
+    WHERE user_id = %(user_id)s
+      AND idempotency_key <> %(key)s
+      AND created_at < CURRENT_TIMESTAMP - make_interval(secs => %(ttl)s)
+)
+INSERT INTO idempotency_keys (user_id, idempotency_key, request_hash)
+VALUES (%(user_id)s, %(key)s, %(request_hash)s)
+ON CONFLICT (user_id, idempotency_key) DO UPDATE
+SET request_hash = EXCLUDED.request_hash,
+    status_code = NULL,
+    response = NULL,
+    created_at = CURRENT_TIMESTAMP
+WHERE idempotency_keys.created_at < CURRENT_TIMESTAMP - make_interval(secs => %(ttl)s)
+RETURNING 1
+"""
+
+SAVE_SQL = """
+UPDATE idempotency_keys
+SET status_code = %s, response = %s::jsonb
+WHERE user_id = %s AND idempotency_key = %s
+"""
+
+LOOKUP_SQL = """
+SELECT request_hash, status_code, response
+FROM idempotency_keys
+WHERE user_id = %s AND idempotency_key = %s
+"""
+
+# (request_hash, status_code, 応答本文)
+Stored = Tuple[str, int, Any]
+
+
+def request_fingerprint(operation: str, payload: Dict[str, Any]) -> str:
+    """同じキーが別の内容のリクエストに使われていないか確かめるためのハッシュ"""
+    text = json.dumps([operation, payload], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    """保存済み応答のワーカー内キャッシュと、実行中リクエストの待ち合わせ"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[float, Stored]]" = OrderedDict()
+        self._in_flight: Dict[Tuple[int, str], asyncio.Future] = {}
+        self.executed = 0
+        self.replayed = 0
+        self.replayed_from_db = 0
+        self.collapsed = 0
+
+    async def run(
+        self,
+        db: AsyncDatabaseService,
+        user_id: int,
+        key: str,
+        request_hash: str,
+        handler: Callable[[], Awaitable[Any]],
+        status_code: int = status.HTTP_200_OK,
+    ) -> Any:
+        """``handler`` をキーにつき 1 回だけ実行する (トランザクションはここで張る)
+
+        初回は handler の戻り値、重複には保存済みの応答 (JSONResponse) を返す。
+        handler が例外を送出した場合は何も保存しない。
+        """
+        cache_key = (user_id, key)
+        while True:
+            stored = self._get(cache_key)
+            if stored is not None:
+                self.replayed += 1
+                return self._replay(stored, request_hash)
+            pending = self._in_flight.get(cache_key)
+            if pending is None:
+                break
+            # 同じキーの実行中リクエストを待つ (失敗していれば次の周回で自分が実行する)
+            self.collapsed += 1
+            await asyncio.shield(pending)
+
+        pending = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = pending
+        try:
+            return await self._execute(db, cache_key, request_hash, handler, status_code)
+        finally:
+            del self._in_flight[cache_key]
+            pending.set_result(None)
+
+    async def _execute(
+        self,
+        db: AsyncDatabaseService,
+        cache_key: Tuple[int, str],
+        request_hash: str,
+        handler: Callable[[], Awaitable[Any]],
+        status_code: int,
+    ) -> Any:
+        user_id, key = cache_key
+        async with db.transaction():
+            claimed = await db.execute_query(
+                CLAIM_SQL,
+                {"user_id": user_id, "key": key, "request_hash": request_hash, "ttl": self.ttl},
+                row_format="tuple",
+            )
+            if claimed:
+                result = await handler()
+                body = jsonable_encoder(result)
+                await db.execute_query(SAVE_SQL, (status_code, json.dumps(body, ensure_ascii=False), user_id, key))
+            else:
+                rows = await db.execute_query(LOOKUP_SQL, (user_id, key), row_format="tuple")
+        if claimed:
+            self.executed += 1
+            self._put(cache_key, (request_hash, status_code, body))
+            return result
+        stored: Stored = tuple(rows[0])
+        self.replayed_from_db += 1
+        self._put(cache_key, stored)
+        return self._replay(stored, request_hash)
+
+    def _replay(self, stored: Stored, request_hash: str) -> JSONResponse:
+        stored_hash, status_code, body = stored
+        if stored_hash != request_hash:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key has already been used for a different request",
+            )
+        return JSONResponse(content=body, status_code=status_code, headers={REPLAYED_HEADER: "true"})
+
+    def _get(self, cache_key: Tuple[int, str]) -> Optional[Stored]:
+        entry = self._entries.get(cache_key)
+        if entry is None:
+            return None
+        stored_at, stored = entry
+        if time.monotonic() - stored_at >= self.ttl:
+            del self._entries[cache_key]
+            return None
+        self._entries.move_to_end(cache_key)
+        return stored
+
+    def _put(self, cache_key: Tuple[int, str], stored: Stored) -> None:
+        self._entries[cache_key] = (time.monotonic(), stored)
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "in_flight": len(self._in_flight),
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "replayed_from_db": self.replayed_from_db,
+            "collapsed": self.collapsed,
+            "ttl_seconds": self.ttl,
+        }
+
+
+idempotency_store = IdempotencyStore(settings.IDEMPOTENCY_TTL_SECONDS, settings.IDEMPOTENCY_CACHE_MAX_ENTRIES)
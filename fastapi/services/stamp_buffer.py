@@ -0,0 +1,426 @@
+"""スタンプ記録の書き込みバッファ (イベントのピーク向け、``STAMP_BUFFER_ENABLED``)。
+
+record_stamp はキャッシュ済みのテナント情報 (店舗・キャンペーン期間) で検証したあと、
+リクエストの接続をすぐプールに返してスタンプをワーカー内の待ち行列に積む。待ち行列は
+最初の 1 件から ``STAMP_BUFFER_FLUSH_INTERVAL_MS`` 経つか ``STAMP_BUFFER_BATCH_SIZE`` 件たまると
+1 トランザクション・1 文 (services/stamps.py の RECORD_STAMPS_BATCH_SQL) で書き込まれ、
+クーポンの付与もバッチ単位で計算される。
+
+応答の保証は ``STAMP_BUFFER_DURABILITY`` で選ぶ。
+
+- ``commit``: バッチのコミットを待ってから確定した結果を返す (応答は従来と同じ)。
+- ``accept``: 待ち行列に積んだ時点で仮の結果 (``provisional``) を返す。書き込み前に
+  ワーカーが止まると失われる (終了処理では残りを書き込む)。書き込みに失敗した分は
+  ``STAMP_BUFFER_MAX_RETRIES`` 回まで間隔を倍にしながら積み直し、それでも失敗したら
+  失われる (診断の ``lost``)。
+
+未書き込みが ``STAMP_BUFFER_MAX_PENDING`` 件に達したら 503 (Retry-After) で受け付けを断る。
+バッチが失敗したときは 1 件ずつ record_stamp_once で書き直し、失敗した件だけを失敗にする。
+"""
+import asyncio
+import itertools
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from fastapi import HTTPException, status
+
+from config import settings
+from database.async_database import AsyncDatabaseService, replica_set
+from services.stamps import COUPON_DESCRIPTION_TEMPLATES, record_stamp_once, record_stamps_batch
+from services.tenant_cache import TenantSnapshot
+
+logger = logging.getLogger(__name__)
+
+COMMIT = "commit"
+ACCEPT = "accept"
+
+# accept モードの仮の結果に使う現在の進捗 (1 往復)
+PROGRESS_SQL = """
+SELECT
+    COALESCE((SELECT stamps FROM user_progress WHERE user_id = %(user_id)s), 0) AS stamps,
+    ARRAY(
+        SELECT store_id
+        FROM user_store_stamps
+        WHERE user_id = %(user_id)s
+        ORDER BY id
+    ) AS stamped_store_ids,
+    ARRAY(SELECT coupon_id FROM user_coupons WHERE user_id = %(user_id)s) AS coupon_ids
+"""
+
+
+def store_index(snapshot: Optional[TenantSnapshot]) -> Dict[str, Any]:
+    """store_id -> 店舗行 (スナップショットごとにメモ化)"""
+    if snapshot is None:
+        return {}
+    return snapshot.derive("store_index", lambda item: {store["store_id"]: store for store in item.stores})
+
+
+class PendingStamp:
+    """待ち行列の 1 件"""
+
+    __slots__ = ("seq", "user_id", "tenant_id", "store_id", "language", "routing_key", "future", "attempts", "retrying")
+
+    def __init__(
+        self,
+        seq: int,
+        user_id: int,
+        tenant_id: str,
+        store_id: str,
+        language: str,
+        routing_key: Optional[str],
+        future: Optional[asyncio.Future],
+    ):
+        self.seq = seq
+        self.user_id = user_id
+        self.tenant_id = tenant_id
+        self.store_id = store_id
+        self.language = language
+        self.routing_key = routing_key
+        # commit モードで結果を待つ Future (accept モードでは None)
+        self.future = future
+        # accept モードで積み直した回数と、積み直しを待っている (または積み直した) か
+        self.attempts = 0
+        self.retrying = False
+
+    def as_batch_item(self):
+        return (self.seq, self.user_id, self.tenant_id, self.store_id, self.language)
+
+
+class StampBuffer:
+    """ワーカー内の待ち行列と、それをまとめて書き込むバックグラウンドタスク"""
+
+    def __init__(
+        self,
+        enabled: bool,
+        durability: str,
+        flush_interval: float,
+        batch_size: int,
+        max_pending: int,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+    ):
+        durability = (durability or COMMIT).strip().lower()
+        if durability not in (COMMIT, ACCEPT):
+            logger.warning("Unknown STAMP_BUFFER_DURABILITY '%s'. Falling back to '%s'.", durability, COMMIT)
+            durability = COMMIT
+        self.enabled = enabled
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.max_pending = max(1, max_pending)
+        self.max_retries = max(0, max_retries)
+        self.retry_backoff = retry_backoff
+        self._queue: List[PendingStamp] = []
+        # seq -> 積み直しを待っている accept モードの分
+        self._retrying: Dict[int, PendingStamp] = {}
+        # user_id -> まだコミットされていない店舗 (待ち行列・書き込み中・積み直し待ちの分)
+        self._unwritten: Dict[int, List[str]] = {}
+        self._writing = 0
+        self._seq = itertools.count(1)
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.batches = 0
+        self.fallbacks = 0
+        self.failed = 0
+        self.retried = 0
+        self.lost = 0
+        self.last_batch_ms: Optional[float] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._queue) + self._writing + len(self._retrying)
+
+    async def submit(
+        self,
+        db: AsyncDatabaseService,
+        user_id: int,
+        tenant_id: str,
+        store_id: str,
+        language: str,
+        snapshot: Optional[TenantSnapshot],
+    ) -> Dict[str, Any]:
+        """スタンプを待ち行列に積み、結果 (record_stamp_once と同じ形) を返す
+
+        キャンペーン期間の確認は呼び出し側で済ませておくこと。``db`` の接続はここで返す。
+        """
+        store = store_index(snapshot).get(store_id)
+        if store is None:
+            progress = await self._read_progress(db, user_id)
+            await db.release()
+            return {
+                "store_name": None,
+                "store_found": False,
+                "stamped": False,
+                "stamps": progress["stamps"],
+                "stamped_store_ids": [],
+                "new_coupons": [],
+            }
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many stamps are waiting to be recorded",
+                headers={"Retry-After": "1"},
+            )
+
+        routing_key = db.routing_key
+        if self.durability == ACCEPT:
+            progress = await self._read_progress(db, user_id)
+            await db.release()
+            result = self._provisional(progress, user_id, tenant_id, store, language, snapshot)
+            if result["stamped"]:
+                self._enqueue(PendingStamp(next(self._seq), user_id, tenant_id, store_id, language, routing_key, None))
+            return result
+
+        await db.release()
+        item = PendingStamp(
+            next(self._seq),
+            user_id,
+            tenant_id,
+            store_id,
+            language,
+            routing_key,
+            asyncio.get_running_loop().create_future(),
+        )
+        self._enqueue(item)
+        # 応答を待たずに切断されても、積んだ分は書き込む
+        return await asyncio.shield(item.future)
+
+    async def _read_progress(self, db: AsyncDatabaseService, user_id: int) -> Dict[str, Any]:
+        rows = await db.execute_query(PROGRESS_SQL, {"user_id": user_id})
+        return rows[0]
+
+    def _provisional(
+        self,
+        progress: Dict[str, Any],
+        user_id: int,
+        tenant_id: str,
+        store: Any,
+        language: str,
+        snapshot: Optional[TenantSnapshot],
+    ) -> Dict[str, Any]:
+        """DB の進捗に未書き込みの分を足した仮の結果"""
+        stamped_store_ids = list(progress["stamped_store_ids"])
+        stamps = progress["stamps"]
+        for unwritten in self._unwritten.get(user_id, ()):
+            if unwritten not in stamped_store_ids:
+                stamped_store_ids.append(unwritten)
+                stamps += 1
+        store_id = store["store_id"]
+        result = {
+            "store_name": store["name"],
+            "store_found": True,
+            "stamped": store_id not in stamped_store_ids,
+            "stamps": stamps,
+            "stamped_store_ids": stamped_store_ids,
+            "new_coupons": [],
+            "provisional": True,
+        }
+        if not result["stamped"]:
+            return result
+
+        result["stamps"] = stamps + 1
+        stamped_store_ids.append(store_id)
+        owned = set(progress["coupon_ids"])
+        template = COUPON_DESCRIPTION_TEMPLATES.get(language) or COUPON_DESCRIPTION_TEMPLATES["ja"]
+        for rule in snapshot.rules if snapshot else ():
+            coupon_id = f"tenant-{tenant_id}-rule-{rule['threshold']}"
+            if stamps < rule["threshold"] <= stamps + 1 and coupon_id not in owned:
+                result["new_coupons"].append(
+                    {
+                        "id": coupon_id,
+                        "tenantId": tenant_id,
+                        "title": rule["label"],
+                        "description": template.format(threshold=rule["threshold"]),
+                        "used": False,
+                        "icon": rule.get("icon"),
+                    }
+                )
+        return result
+
+    def _enqueue(self, item: PendingStamp) -> None:
+        self.accepted += 1
+        self._unwritten.setdefault(item.user_id, []).append(item.store_id)
+        self._push(item)
+
+    def _push(self, item: PendingStamp) -> None:
+        self._queue.append(item)
+        self._wakeup.set()
+        if len(self._queue) >= self.batch_size:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            if len(self._queue) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self.flush()
+
+    async def flush(self) -> None:
+        """待ち行列を空になるまで書き込む"""
+        async with self._flush_lock:
+            while self._queue:
+                batch = self._queue[: self.batch_size]
+                del self._queue[: len(batch)]
+                if len(self._queue) < self.batch_size:
+                    self._full.clear()
+                if not self._queue:
+                    self._wakeup.clear()
+                self._writing += len(batch)
+                for item in batch:
+                    item.retrying = False
+                try:
+                    await self._write(batch)
+                finally:
+                    self._writing -= len(batch)
+                    # 積み直す分は未書き込みのまま残す (仮の結果の計算に使う)
+                    self._forget([item for item in batch if not item.retrying])
+
+    async def _write(self, batch: List[PendingStamp]) -> None:
+        started = time.perf_counter()
+        try:
+            results = await self._write_batch(batch)
+        except Exception as exc:  # noqa: BLE001
+            self.fallbacks += 1
+            logger.warning("Stamp batch of %d failed (%s); writing one by one", len(batch), exc)
+            for item in batch:
+                await self._write_one(item)
+            return
+        self.batches += 1
+        self.written += len(batch)
+        self.last_batch_ms = round((time.perf_counter() - started) * 1000, 3)
+        for item in batch:
+            self._resolve(item, results[item.seq])
+
+    async def _write_batch(self, batch: Sequence[PendingStamp]) -> Dict[int, Dict[str, Any]]:
+        async with AsyncDatabaseService() as db:
+            return await record_stamps_batch(db, [item.as_batch_item() for item in batch])
+
+    async def _write_single(self, item: PendingStamp) -> Dict[str, Any]:
+        async with AsyncDatabaseService() as db:
+            return await record_stamp_once(db, item.user_id, item.tenant_id, item.store_id, item.language)
+
+    async def _write_one(self, item: PendingStamp) -> None:
+        try:
+            result = await self._write_single(item)
+        except Exception as exc:  # noqa: BLE001
+            if item.future is not None:
+                self.failed += 1
+                logger.error("Failed to record buffered stamp (user %s, store %s): %s", item.user_id, item.store_id, exc)
+                if not item.future.done():
+                    item.future.set_exception(exc)
+            elif item.attempts < self.max_retries:
+                self._retry_later(item, exc)
+            else:
+                # 利用者には仮の結果で記録済みと伝えてある
+                self.lost += 1
+                logger.error(
+                    "Dropped provisional stamp after %d retries (user %s, store %s): %s",
+                    item.attempts,
+                    item.user_id,
+                    item.store_id,
+                    exc,
+                )
+            return
+        self.written += 1
+        self._resolve(item, result)
+
+    def _retry_later(self, item: PendingStamp, exc: Exception) -> None:
+        """accept モードの失敗分を、間隔を倍にしながら待ち行列に積み直す"""
+        item.attempts += 1
+        item.retrying = True
+        self.retried += 1
+        delay = self.retry_backoff * 2 ** (item.attempts - 1)
+        logger.warning(
+            "Retrying provisional stamp in %.2fs (user %s, store %s, attempt %d): %s",
+            delay,
+            item.user_id,
+            item.store_id,
+            item.attempts,
+            exc,
+        )
+        self._retrying[item.seq] = item
+        asyncio.get_running_loop().call_later(delay, self._requeue, item.seq)
+
+    def _requeue(self, seq: int) -> None:
+        # close() が先に積み直していれば何もしない
+        item = self._retrying.pop(seq, None)
+        if item is not None:
+            self._push(item)
+
+    def _resolve(self, item: PendingStamp, result: Dict[str, Any]) -> None:
+        # 書き込みが確定したので、この利用者の読み取りをしばらくプライマリに向ける
+        replica_set.mark_write(item.routing_key)
+        if item.future is not None and not item.future.done():
+            item.future.set_result(result)
+
+    def _forget(self, batch: Sequence[PendingStamp]) -> None:
+        for item in batch:
+            unwritten = self._unwritten.get(item.user_id)
+            if unwritten is None:
+                continue
+            unwritten.remove(item.store_id)
+            if not unwritten:
+                del self._unwritten[item.user_id]
+
+    async def close(self) -> None:
+        """バックグラウンドタスクを止め、残りを書き込む (アプリケーション終了時)
+
+        積み直し待ちの分は間隔を待たずに書き直す (回数の上限までは繰り返す)。
+        """
+        while True:
+            if self._task is not None:
+                # 書き込み中のバッチを中断しないよう、flush の合間で止める
+                async with self._flush_lock:
+                    self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+                self._task = None
+            self._queue.extend(self._retrying.values())
+            self._retrying.clear()
+            if not self._queue:
+                return
+            await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "durability": self.durability,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "batch_size": self.batch_size,
+            "flush_interval_ms": round(self.flush_interval * 1000, 3),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "written": self.written,
+            "batches": self.batches,
+            "fallbacks": self.fallbacks,
+            "failed": self.failed,
+            "retried": self.retried,
+            "lost": self.lost,
+            "last_batch_ms": self.last_batch_ms,
+        }
+
+
+stamp_buffer = StampBuffer(
+    enabled=settings.STAMP_BUFFER_ENABLED,
+    durability=settings.STAMP_BUFFER_DURABILITY,
+    flush_interval=settings.STAMP_BUFFER_FLUSH_INTERVAL_MS / 1000,
+    batch_size=settings.STAMP_BUFFER_BATCH_SIZE,
+    max_pending=settings.STAMP_BUFFER_MAX_PENDING,
+    max_retries=settings.STAMP_BUFFER_MAX_RETRIES,
+    retry_backoff=settings.STAMP_BUFFER_RETRY_BACKOFF_MS / 1000,
+)
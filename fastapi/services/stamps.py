@@ -0,0 +1,294 @@
+import json
+from typing import Any, Dict, List, Sequence, Tuple
+
+from database.async_database import AsyncDatabaseService
+
+
+# クーポン説明文のテンプレート (言語 -> 文面)
+COUPON_DESCRIPTION_TEMPLATES: Dict[str, str] = {
+    "ja": "{threshold}個達成で獲得したクーポン",
+    "en": "Coupon unlocked at {threshold} stamps",
+    "zh": "集滿 {threshold} 個印章獲得的優惠券",
+}
+
+# スタンプ記録を 1 ステートメントで行う。
+# 店舗確認・スタンプ挿入 (重複は ON CONFLICT で判定)・進捗のインクリメント・
+# 閾値到達クーポンの発行・スタンプ済み店舗一覧の取得までを 1 往復で済ませる。
+# 同一ステートメント内の CTE は同じスナップショットを見るため、
+# 今回挿入したスタンプは inserted_stamp から補う。
+RECORD_STAMP_SQL = """
+WITH store AS (
+    SELECT store_id, name
+    FROM stores
+    WHERE tenant_id = %(tenant_id)s AND store_id = %(store_id)s
+),
+inserted_stamp AS (
+    INSERT INTO user_store_stamps (user_id, tenant_id, store_id)
+    SELECT %(user_id)s, %(tenant_id)s, store_id
+    FROM store
+    ON CONFLICT (user_id, store_id) DO NOTHING
+    RETURNING store_id
+),
+progress AS (
+    INSERT INTO user_progress (user_id, tenant_id, stamps)
+    SELECT %(user_id)s, %(tenant_id)s, 1
+    FROM inserted_stamp
+    ON CONFLICT (user_id) DO UPDATE
+        SET stamps = user_progress.stamps + 1,
+            updated_at = CURRENT_TIMESTAMP
+    RETURNING stamps
+),
+current_progress AS (
+    SELECT COALESCE(
+        (SELECT stamps FROM progress),
+        (SELECT stamps FROM user_progress WHERE user_id = %(user_id)s),
+        0
+    ) AS stamps
+),
+awarded AS (
+    INSERT INTO user_coupons (user_id, tenant_id, coupon_id, title, description, used)
+    SELECT
+        %(user_id)s,
+        %(tenant_id)s,
+        'tenant-' || %(tenant_id)s::text || '-rule-' || r.threshold,
+        r.label,
+        replace(%(description_template)s, '{threshold}', r.threshold::text),
+        FALSE
+    FROM reward_rules r
+    CROSS JOIN current_progress p
+    WHERE r.tenant_id = %(tenant_id)s
+      AND r.threshold <= p.stamps
+      AND EXISTS (SELECT 1 FROM inserted_stamp)
+    ON CONFLICT (user_id, coupon_id) DO NOTHING
+    RETURNING coupon_id, tenant_id, title, description, used
+)
+SELECT
+    (SELECT name FROM store) AS store_name,
+    EXISTS (SELECT 1 FROM store) AS store_found,
+    EXISTS (SELECT 1 FROM inserted_stamp) AS stamped,
+    (SELECT stamps FROM current_progress) AS stamps,
+    ARRAY(
+        SELECT store_id
+        FROM user_store_stamps
+        WHERE user_id = %(user_id)s
+        ORDER BY id
+    ) || ARRAY(SELECT store_id FROM inserted_stamp) AS stamped_store_ids,
+    COALESCE(
+        (
+            SELECT jsonb_agg(
+                jsonb_build_object(
+                    'id', a.coupon_id,
+                    'tenantId', a.tenant_id,
+                    'title', a.title,
+                    'description', a.description,
+                    'used', a.used,
+                    'icon', r.icon
+                )
+                ORDER BY r.threshold
+            )
+            FROM awarded a
+            JOIN reward_rules r
+              ON r.tenant_id = %(tenant_id)s
+             AND a.coupon_id = 'tenant-' || %(tenant_id)s::text || '-rule-' || r.threshold
+        ),
+        '[]'::jsonb
+    ) AS new_coupons
+"""
+
+
+async def record_stamp_once(
+    db: AsyncDatabaseService, user_id: int, tenant_id: str, store_id: str, language: str
+) -> Dict[str, Any]:
+    """スタンプを 1 往復で記録し、結果を辞書で返す。
+
+    キャンペーン期間の確認は呼び出し側で済ませておくこと。コミットは行わない。
+    """
+    template = COUPON_DESCRIPTION_TEMPLATES.get(language) or COUPON_DESCRIPTION_TEMPLATES["ja"]
+    rows = await db.execute_query(
+        RECORD_STAMP_SQL,
+        {
+            "user_id": user_id,
+            "tenant_id": tenant_id,
+            "store_id": store_id,
+            "description_template": template,
+        },
+    )
+    result = rows[0]
+    result["new_coupons"] = _json_list(result.get("new_coupons"))
+    result["stamped_store_ids"] = list(result.get("stamped_store_ids") or [])
+    return result
+
+
+# 複数のスタンプを 1 ステートメントで記録する (services/stamp_buffer.py のバッチ書き込み)。
+# 入力は unnest した配列で渡し、同じ利用者・店舗の重複は最初の 1 件 (seq 順) だけを挿入する。
+# 進捗は利用者ごとに増えた件数をまとめて加算し、クーポンはバッチ後の件数で付与する。
+# previous_store_ids は文の開始時点のスタンプ済み店舗 (今回の分は含まない)。
+RECORD_STAMPS_BATCH_SQL = """
+WITH input AS (
+    SELECT *
+    FROM unnest(
+        %(seqs)s::int[],
+        %(user_ids)s::int[],
+        %(tenant_ids)s::varchar[],
+        %(store_ids)s::varchar[],
+        %(description_templates)s::text[]
+    ) AS i(seq, user_id, tenant_id, store_id, description_template)
+),
+valid AS (
+    SELECT DISTINCT ON (i.user_id, i.store_id) i.seq, i.user_id, i.tenant_id, i.store_id
+    FROM input i
+    JOIN stores s ON s.tenant_id = i.tenant_id AND s.store_id = i.store_id
+    ORDER BY i.user_id, i.store_id, i.seq
+),
+inserted_stamps AS (
+    INSERT INTO user_store_stamps (user_id, tenant_id, store_id)
+    SELECT user_id, tenant_id, store_id
+    FROM valid
+    ORDER BY seq
+    ON CONFLICT (user_id, store_id) DO NOTHING
+    RETURNING user_id, store_id
+),
+inserted AS (
+    SELECT v.seq, v.user_id, v.tenant_id
+    FROM inserted_stamps n
+    JOIN valid v ON v.user_id = n.user_id AND v.store_id = n.store_id
+),
+progress AS (
+    INSERT INTO user_progress (user_id, tenant_id, stamps)
+    SELECT user_id, tenant_id, count(*)
+    FROM inserted
+    GROUP BY user_id, tenant_id
+    ON CONFLICT (user_id) DO UPDATE
+        SET stamps = user_progress.stamps + EXCLUDED.stamps,
+            updated_at = CURRENT_TIMESTAMP
+    RETURNING user_id, stamps
+),
+awarded AS (
+    INSERT INTO user_coupons (user_id, tenant_id, coupon_id, title, description, used)
+    SELECT
+        i.user_id,
+        i.tenant_id,
+        'tenant-' || i.tenant_id::text || '-rule-' || r.threshold,
+        r.label,
+        replace(i.description_template, '{threshold}', r.threshold::text),
+        FALSE
+    FROM progress p
+    JOIN LATERAL (
+        SELECT user_id, tenant_id, description_template
+        FROM input
+        WHERE user_id = p.user_id
+        ORDER BY seq
+        LIMIT 1
+    ) i ON TRUE
+    JOIN reward_rules r ON r.tenant_id = i.tenant_id AND r.threshold <= p.stamps
+    ON CONFLICT (user_id, coupon_id) DO NOTHING
+    RETURNING user_id, coupon_id, tenant_id, title, description, used
+)
+SELECT
+    i.seq,
+    s.name AS store_name,
+    s.store_id IS NOT NULL AS store_found,
+    EXISTS (SELECT 1 FROM inserted n WHERE n.seq = i.seq) AS stamped,
+    COALESCE(
+        (SELECT stamps FROM progress p WHERE p.user_id = i.user_id),
+        (SELECT stamps FROM user_progress WHERE user_id = i.user_id),
+        0
+    ) AS stamps,
+    ARRAY(
+        SELECT store_id
+        FROM user_store_stamps
+        WHERE user_id = i.user_id
+        ORDER BY id
+    ) AS previous_store_ids,
+    COALESCE(
+        (
+            SELECT jsonb_agg(
+                jsonb_build_object(
+                    'id', a.coupon_id,
+                    'tenantId', a.tenant_id,
+                    'title', a.title,
+                    'description', a.description,
+                    'used', a.used,
+                    'icon', r.icon,
+                    'threshold', r.threshold
+                )
+                ORDER BY r.threshold
+            )
+            FROM awarded a
+            JOIN reward_rules r
+              ON r.tenant_id = a.tenant_id
+             AND a.coupon_id = 'tenant-' || a.tenant_id::text || '-rule-' || r.threshold
+            WHERE a.user_id = i.user_id
+        ),
+        '[]'::jsonb
+    ) AS new_coupons
+FROM input i
+LEFT JOIN stores s ON s.tenant_id = i.tenant_id AND s.store_id = i.store_id
+"""
+
+# (seq, user_id, tenant_id, store_id, language)
+BatchItem = Tuple[int, int, str, str, str]
+
+
+def _json_list(value: Any) -> List[Any]:
+    if isinstance(value, str):
+        return json.loads(value)
+    return list(value or [])
+
+
+def split_batch_results(items: Sequence[BatchItem], rows: Sequence[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """バッチの結果を 1 件ずつの結果 (record_stamp_once と同じ形) に分ける
+
+    同じ利用者の複数件は seq 順に記録したものとして、件数・スタンプ済み店舗を積み上げ、
+    クーポンは件数が閾値に達した件に割り当てる。
+    """
+    by_seq = {row["seq"]: row for row in rows}
+    gained: Dict[int, int] = {}
+    for seq, user_id, _tenant_id, _store_id, _language in items:
+        if by_seq[seq]["stamped"]:
+            gained[user_id] = gained.get(user_id, 0) + 1
+
+    # user_id -> [件数, スタンプ済み店舗, まだ割り当てていないクーポン]
+    users: Dict[int, List[Any]] = {}
+    results: Dict[int, Dict[str, Any]] = {}
+    for seq, user_id, _tenant_id, store_id, _language in sorted(items):
+        row = by_seq[seq]
+        state = users.get(user_id)
+        if state is None:
+            state = users[user_id] = [
+                row["stamps"] - gained.get(user_id, 0),
+                list(row["previous_store_ids"] or []),
+                _json_list(row["new_coupons"]),
+            ]
+        new_coupons: List[Dict[str, Any]] = []
+        if row["stamped"]:
+            state[0] += 1
+            state[1].append(store_id)
+            new_coupons = [coupon for coupon in state[2] if coupon["threshold"] <= state[0]]
+            state[2] = [coupon for coupon in state[2] if coupon["threshold"] > state[0]]
+        results[seq] = {
+            "store_name": row["store_name"],
+            "store_found": row["store_found"],
+            "stamped": row["stamped"],
+            "stamps": state[0],
+            "stamped_store_ids": list(state[1]) if row["store_found"] else [],
+            "new_coupons": [
+                {key: value for key, value in coupon.items() if key != "threshold"} for coupon in new_coupons
+            ],
+        }
+    return results
+
+
+async def record_stamps_batch(db: AsyncDatabaseService, items: Sequence[BatchItem]) -> Dict[int, Dict[str, Any]]:
+    """複数のスタンプを 1 往復で記録し、seq ごとの結果を返す。コミットは行わない。"""
+    params = {
+        "seqs": [item[0] for item in items],
+        "user_ids": [item[1] for item in items],
+        "tenant_ids": [item[2] for item in items],
+        "store_ids": [item[3] for item in items],
+        "description_templates": [
+            COUPON_DESCRIPTION_TEMPLATES.get(item[4]) or COUPON_DESCRIPTION_TEMPLATES["ja"] for item in items
+        ],
+    }
+    rows = await db.execute_query(RECORD_STAMPS_BATCH_SQL, params)
+    return split_batch_results(items, rows)
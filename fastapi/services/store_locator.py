@@ -0,0 +1,216 @@
+"""テナントの店舗の近傍検索 (KD 木)。
+
+店舗の緯度経度を単位球上の 3 次元ベクトルにして KD 木を組む。2 点間の弦の長さは大円距離と
+単調に対応するため、順位付けは haversine と一致し、経度 ±180 度をまたぐ場合も特別扱いが要らない。
+木はスナップショット (services/tenant_cache.py) ごとに 1 度だけ組み、店舗が変わって
+スナップショットが作り直されるまで使い回す。
+"""
+import heapq
+import math
+from typing import Any, Collection, List, Optional, Sequence, Tuple
+
+EARTH_RADIUS_METERS = 6_371_000.0
+
+# 葉に入れる店舗数。葉の中は総当たりで比べる
+LEAF_SIZE = 16
+# 分割位置 (中央値) を決めるときに見る店舗数
+SAMPLE_SIZE = 128
+# これ以上の店舗数なら木をスレッドで組む (10 万件で 1 秒弱かかる)
+THREAD_BUILD_MIN_STORES = 5000
+
+
+def unit_vector(lat: float, lng: float) -> Tuple[float, float, float]:
+    phi = math.radians(lat)
+    lam = math.radians(lng)
+    cos_phi = math.cos(phi)
+    return (cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi))
+
+
+def chord_squared_to_meters(chord_squared: float) -> float:
+    return 2.0 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(chord_squared) / 2.0))
+
+
+def meters_to_chord_squared(meters: float) -> float:
+    if meters >= math.pi * EARTH_RADIUS_METERS:
+        return 4.0
+    chord = 2.0 * math.sin(meters / (2.0 * EARTH_RADIUS_METERS))
+    return chord * chord
+
+
+def haversine_meters(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    h = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    )
+    return 2.0 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(h)))
+
+
+class StoreLocator:
+    """店舗行 (lat / lng / store_id を持つ) の KD 木
+
+    ノードは配列で持つ。``_axis`` が -1 のノードは葉で、``_order[_lo:_hi]`` が店舗の添字。
+    """
+
+    __slots__ = ("stores", "_coords", "_order", "_axis", "_split", "_left", "_right", "_lo", "_hi", "_positions")
+
+    def __init__(self, stores: Sequence[Any]):
+        self.stores = list(stores)
+        vectors = [unit_vector(float(store["lat"]), float(store["lng"])) for store in self.stores]
+        self._coords = ([v[0] for v in vectors], [v[1] for v in vectors], [v[2] for v in vectors])
+        self._positions = {store["store_id"]: index for index, store in enumerate(self.stores)}
+        self._order = list(range(len(self.stores)))
+        self._axis: List[int] = []
+        self._split: List[float] = []
+        self._left: List[int] = []
+        self._right: List[int] = []
+        self._lo: List[int] = []
+        self._hi: List[int] = []
+        if self.stores:
+            self._build(0, len(self._order))
+
+    def __len__(self) -> int:
+        return len(self.stores)
+
+    def find(self, store_id: str) -> Optional[Any]:
+        position = self._positions.get(store_id)
+        return None if position is None else self.stores[position]
+
+    def distances(
+        self, store_ids: Sequence[str], lats: Sequence[float], lngs: Sequence[float]
+    ) -> List[Optional[float]]:
+        """各 (店舗, 地点) の距離 [m] を順に求める (店舗がなければ None)
+
+        1 件ずつの Python のループで、ベクトル化はしていない (numpy には依存しない)。
+        店舗側は組み立て時の単位ベクトルを使うので、三角関数は地点の分だけで済む。
+        """
+        xs, ys, zs = self._coords
+        positions = self._positions
+        result: List[Optional[float]] = []
+        for store_id, lat, lng in zip(store_ids, lats, lngs):
+            position = positions.get(store_id)
+            if position is None:
+                result.append(None)
+                continue
+            qx, qy, qz = unit_vector(lat, lng)
+            dx = xs[position] - qx
+            dy = ys[position] - qy
+            dz = zs[position] - qz
+            result.append(chord_squared_to_meters(dx * dx + dy * dy + dz * dz))
+        return result
+
+    def _build(self, lo: int, hi: int) -> int:
+        node = len(self._axis)
+        self._axis.append(-1)
+        self._split.append(0.0)
+        self._left.append(-1)
+        self._right.append(-1)
+        self._lo.append(lo)
+        self._hi.append(hi)
+        if hi - lo <= LEAF_SIZE:
+            return node
+
+        # 広がりが最大の軸で、標本の中央値を境に分ける (全件の並べ替えより速い)
+        segment = self._order[lo:hi]
+        sample = segment[:: max(1, len(segment) // SAMPLE_SIZE)]
+        spreads = []
+        for values in self._coords:
+            picked = [values[index] for index in sample]
+            spreads.append(max(picked) - min(picked))
+        axis = spreads.index(max(spreads))
+        values = self._coords[axis]
+        split = sorted(values[index] for index in sample)[len(sample) // 2]
+        left = [index for index in segment if values[index] < split]
+        right = [index for index in segment if values[index] >= split]
+        if not left or not right:
+            # 同じ座標が多いときは並べ替えて半分に分ける
+            segment.sort(key=values.__getitem__)
+            half = len(segment) // 2
+            left, right = segment[:half], segment[half:]
+            split = values[right[0]]
+        mid = lo + len(left)
+        self._order[lo:mid] = left
+        self._order[mid:hi] = right
+
+        self._axis[node] = axis
+        self._split[node] = split
+        self._left[node] = self._build(lo, mid)
+        self._right[node] = self._build(mid, hi)
+        return node
+
+    def nearest(
+        self,
+        lat: float,
+        lng: float,
+        limit: int,
+        radius_meters: Optional[float] = None,
+        exclude: Collection[str] = (),
+    ) -> List[Tuple[Any, float]]:
+        """近い順に最大 ``limit`` 件の (店舗行, 距離 [m]) を返す
+
+        ``radius_meters`` を超える店舗と、``exclude`` の store_id の店舗は含めない。
+        """
+        if not self.stores or limit <= 0:
+            return []
+        query = unit_vector(lat, lng)
+        qx, qy, qz = query
+        xs, ys, zs = self._coords
+        order = self._order
+        axes = self._axis
+        splits = self._split
+        excluded = {self._positions[store_id] for store_id in exclude if store_id in self._positions}
+
+        bound = meters_to_chord_squared(radius_meters) if radius_meters is not None else 4.0
+        worst = bound
+        # (-距離の 2 乗, 添字) の最大ヒープ
+        best: List[Tuple[float, int]] = []
+        # (ノード, ノードの領域までの距離の 2 乗の下限)
+        stack = [(0, 0.0)]
+        while stack:
+            node, lower = stack.pop()
+            if lower > worst:
+                continue
+            axis = axes[node]
+            if axis < 0:
+                for index in order[self._lo[node] : self._hi[node]]:
+                    dx = xs[index] - qx
+                    dy = ys[index] - qy
+                    dz = zs[index] - qz
+                    distance = dx * dx + dy * dy + dz * dz
+                    if distance > worst or index in excluded:
+                        continue
+                    if len(best) < limit:
+                        heapq.heappush(best, (-distance, index))
+                        if len(best) == limit:
+                            worst = min(bound, -best[0][0])
+                    elif distance < worst:
+                        heapq.heapreplace(best, (-distance, index))
+                        worst = -best[0][0]
+                continue
+            offset = query[axis] - splits[node]
+            if offset < 0:
+                near, far = self._left[node], self._right[node]
+            else:
+                near, far = self._right[node], self._left[node]
+            stack.append((far, max(lower, offset * offset)))
+            stack.append((near, lower))
+
+        best.sort(key=lambda item: (-item[0], item[1]))
+        return [(self.stores[index], chord_squared_to_meters(-negative)) for negative, index in best]
+
+
+def _build_locator(snapshot) -> StoreLocator:
+    return StoreLocator(snapshot.stores)
+
+
+def store_locator(snapshot) -> StoreLocator:
+    """スナップショットの店舗の KD 木 (スナップショットが作り直されるまで再利用する)"""
+    return snapshot.derive("store_locator", _build_locator)
+
+
+async def load_store_locator(snapshot) -> StoreLocator:
+    """store_locator と同じ。店舗が多いテナントの木はスレッドで組む"""
+    if len(snapshot.stores) < THREAD_BUILD_MIN_STORES:
+        return store_locator(snapshot)
+    return await snapshot.derive_in_thread("store_locator", _build_locator)
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from config import settings
+from database.async_database import AsyncDatabaseService
+from services.user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+
+class TenantSnapshot:
+    """テナント設定・報酬ルール・店舗一覧をパース済みの形で保持する"""
+
+    __slots__ = (
+        "tenant_id",
+        "company_name",
+        "is_active",
+        "config",
+        "rules",
+        "stores",
+        "version",
+        "checked_at",
+        "_derived",
+    )
+
+    def __init__(
+        self,
+        tenant_id: str,
+        company_name: str,
+        is_active: bool,
+        config: Dict[str, Any],
+        rules: List[Dict[str, Any]],
+        stores: List[Any],  # 店舗行 (database.rows.Row)
+        version: int,
+    ):
+        self.tenant_id = tenant_id
+        self.company_name = company_name
+        self.is_active = is_active
+        self.config = config
+        self.rules = rules
+        self.stores = stores
+        self.version = version
+        self.checked_at = time.monotonic()
+        self._derived: Dict[str, Any] = {}
+
+    def rule_for_threshold(self, threshold: int) -> Optional[Dict[str, Any]]:
+        for rule in self.rules:
+            if rule["threshold"] == threshold:
+                return rule
+        return None
+
+    def derive(self, key: str, factory: Callable[["TenantSnapshot"], Any]) -> Any:
+        """スナップショットから導出した値をメモ化する (スナップショット更新時に作り直される)"""
+        try:
+            return self._derived[key]
+        except KeyError:
+            value = factory(self)
+            self._derived[key] = value
+            return value
+
+    async def derive_in_thread(self, key: str, factory: Callable[["TenantSnapshot"], Any]) -> Any:
+        """derive と同じだが、重い導出をスレッドで行ってイベントループを止めない
+
+        同時に呼ばれると二重に作ることがあるが、先に保存された値を返す。
+        """
+        try:
+            return self._derived[key]
+        except KeyError:
+            value = await asyncio.to_thread(factory, self)
+            return self._derived.setdefault(key, value)
+
+
+def _parse_config(raw_config: Any, tenant_id: str) -> Dict[str, Any]:
+    if isinstance(raw_config, str):
+        try:
+            return json.loads(raw_config)
+        except json.JSONDecodeError:
+            logger.warning("Invalid config JSON for tenant %s", tenant_id)
+            return {}
+    return raw_config or {}
+
+
+class TenantCache:
+    """ワーカー内のテナントキャッシュ。
+
+    書き込み時は ``tenants.content_version`` をインクリメントし、各ワーカーは
+    ``ttl`` 秒ごとにバージョンだけを確認して変化があれば読み直す。
+    そのため他ワーカーでの変更も最大 ``ttl`` 秒で反映される。
+    レプリカから読んだ古いバージョンで、手元のより新しいスナップショットを置き換えることはない。
+    手元の破棄は書き込みのコミット後に行い、破棄と重なった読み込みの結果はキャッシュしない。
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[str, TenantSnapshot] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # tenant_id -> invalidate の回数 (読み込み中に破棄されたかの判定に使う)
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    async def get(self, db: Optional[AsyncDatabaseService], tenant_id: str) -> Optional[TenantSnapshot]:
+        """スナップショットを返す。テナントが存在しなければ None
+
+        ``db`` が None の場合、DB アクセスが必要になったときだけ接続を借りる。
+        """
+        snapshot = self._entries.get(tenant_id)
+        if snapshot is not None and time.monotonic() - snapshot.checked_at < self.ttl:
+            self.hits += 1
+            return snapshot
+        if db is None:
+            async with AsyncDatabaseService(read_only=True, replica=True) as own_db:
+                return await self._refresh(own_db, tenant_id)
+        return await self._refresh(db, tenant_id)
+
+    async def _refresh(self, db: AsyncDatabaseService, tenant_id: str) -> Optional[TenantSnapshot]:
+        lock = self._locks.setdefault(tenant_id, asyncio.Lock())
+        async with lock:
+            snapshot = self._entries.get(tenant_id)
+            now = time.monotonic()
+            if snapshot is not None and now - snapshot.checked_at < self.ttl:
+                self.hits += 1
+                return snapshot
+            if snapshot is not None:
+                rows = await db.execute_query(
+                    "SELECT content_version FROM tenants WHERE tenant_id = %s",
+                    (tenant_id,),
+                )
+                if rows and rows[0]["content_version"] <= snapshot.version:
+                    snapshot.checked_at = now
+                    self.hits += 1
+                    return snapshot
+                self.reloads += 1
+            else:
+                self.misses += 1
+            cached = snapshot
+            generation = self._generations.get(tenant_id, 0)
+            snapshot = await self._load(db, tenant_id)
+            if snapshot is None or not snapshot.is_active:
+                # 削除・無効化されたテナントのユーザー情報を TTL まで使い続けない
+                user_cache.evict_tenant(tenant_id)
+            if self._generations.get(tenant_id, 0) != generation:
+                # 読み込み中にコミットされた変更は、読んだ行に含まれていないかもしれない
+                return snapshot
+            if snapshot is None:
+                self._entries.pop(tenant_id, None)
+            elif cached is not None and snapshot.version < cached.version:
+                cached.checked_at = now
+                return cached
+            else:
+                self._entries[tenant_id] = snapshot
+            return snapshot
+
+    async def _load(self, db: AsyncDatabaseService, tenant_id: str) -> Optional[TenantSnapshot]:
+        # 3 つの SELECT は 1 往復で送る。バージョンを最初に読むので、途中で更新が入っても
+        # 次回確認で読み直される。
+        tenant_rows, rule_rows, store_rows = await db.execute_batch(
+            [
+                (
+                    """
+                    SELECT tenant_id, company_name, is_active, config, content_version
+                    FROM tenants
+                    WHERE tenant_id = %s
+                    """,
+                    (tenant_id,),
+                ),
+                (
+                    """
+                    SELECT threshold, label, icon
+                    FROM reward_rules
+                    WHERE tenant_id = %s
+                    ORDER BY threshold
+                    """,
+                    (tenant_id,),
+                ),
+                (
+                    """
+                    SELECT store_id, name, lat, lng, geofence_radius_m, description, image_url, stamp_mark
+                    FROM stores
+                    WHERE tenant_id = %s
+                    ORDER BY name
+                    """,
+                    (tenant_id,),
+                ),
+            ],
+            row_format="row",
+        )
+        if not tenant_rows:
+            return None
+        tenant = tenant_rows[0]
+        return TenantSnapshot(
+            tenant_id=tenant["tenant_id"],
+            company_name=tenant["company_name"],
+            is_active=bool(tenant.get("is_active", True)),
+            config=_parse_config(tenant.get("config"), tenant_id),
+            rules=[
+                {"threshold": int(row["threshold"]), "label": row["label"], "icon": row.get("icon")}
+                for row in rule_rows
+                if row.get("threshold") is not None
+            ],
+            stores=store_rows,
+            version=int(tenant.get("content_version") or 0),
+        )
+
+    def invalidate(self, tenant_id: str) -> None:
+        self._entries.pop(tenant_id, None)
+        self._generations[tenant_id] = self._generations.get(tenant_id, 0) + 1
+
+    async def bump_version(self, db: AsyncDatabaseService, tenant_id: str) -> None:
+        """テナントの内容が変わったことを全ワーカーに知らせる
+
+        手元のエントリは ``db`` のトランザクションがコミットされてから破棄する
+        (コミット前に破棄すると、並行する読み込みが古い行を再びキャッシュしうる)。
+        """
+        await db.execute_query(
+            """
+            UPDATE tenants
+            SET content_version = content_version + 1
+            WHERE tenant_id = %s
+            """,
+            (tenant_id,),
+        )
+        db.after_commit(lambda: self.invalidate(tenant_id))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "ttl_seconds": self.ttl,
+        }
+
+
+tenant_cache = TenantCache(settings.TENANT_CACHE_TTL_SECONDS)
@@ -0,0 +1,80 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config import settings
+
+
+class UserCache:
+    """get_current_user が解決したユーザーを (tenant_id, subject) 単位で保持する。
+
+    TTL と件数上限 (LRU) の両方で追い出す。ユーザー情報を更新する処理は
+    コミット後に ``evict_user`` / ``evict_subjects`` / ``evict_tenant`` を呼ぶこと。
+    現在 API から行う変更は、登録 (同じ名前の古いエントリを破棄)、無効ユーザーの
+    ログイン、テナントの無効化・削除の検出 (TenantCache の再読み込み時) で追い出す。
+    ユーザーの無効化・ロール変更・削除やテナントの無効化を行う API は無く、DB を直接
+    書き換えた場合は意図的に TTL 任せとし、最大 ``ttl`` 秒で反映される。
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Tuple[Optional[str], str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, tenant_id: Optional[str], subject: str) -> Optional[Dict[str, Any]]:
+        key = (tenant_id, subject)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_at, user = entry
+        if time.monotonic() - stored_at >= self.ttl:
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(user)
+
+    def put(self, tenant_id: Optional[str], subject: str, user: Dict[str, Any]) -> None:
+        if self.ttl <= 0:
+            return
+        # パスワードハッシュはリクエスト処理で使わないので保持しない
+        record = {key: value for key, value in user.items() if key != "password_hash"}
+        key = (tenant_id, subject)
+        self._entries[key] = (time.monotonic(), record)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def evict_user(self, user_id: int) -> None:
+        for key in [key for key, (_, user) in self._entries.items() if user.get("id") == user_id]:
+            del self._entries[key]
+
+    def evict_subjects(self, tenant_id: Optional[str], *subjects: str) -> None:
+        for subject in subjects:
+            self._entries.pop((tenant_id, subject), None)
+
+    def evict_tenant(self, tenant_id: str) -> None:
+        for key in [key for key in self._entries if key[0] == tenant_id]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "ttl_seconds": self.ttl,
+        }
+
+
+user_cache = UserCache(settings.USER_CACHE_TTL_SECONDS, settings.USER_CACHE_MAX_ENTRIES)
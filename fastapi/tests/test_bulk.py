@@ -0,0 +1,35 @@
+import datetime
+import unittest
+
+from database import bulk
+
+
+class BulkHelperTests(unittest.TestCase):
+    def test_batches_accept_dicts_and_tuples(self) -> None:
+        rows = [{"a": 1, "b": 2}, (3, 4), {"b": 6}]
+        batches = list(bulk.iter_batches(iter(rows), ["a", "b"], 2))
+        self.assertEqual(batches, [[(1, 2), (3, 4)], [(None, 6)]])
+        with self.assertRaises(ValueError):
+            list(bulk.iter_batches([(1,)], ["a", "b"], 10))
+
+    def test_upsert_suffix(self) -> None:
+        suffix = bulk.insert_suffix(["id", "name"], conflict_columns=["id"], returning=["id"])
+        self.assertEqual(suffix, ' ON CONFLICT ("id") DO UPDATE SET "name" = EXCLUDED."name" RETURNING "id"')
+        suffix = bulk.insert_suffix(["id"], conflict_columns=["id"], update_columns=[])
+        self.assertEqual(suffix, ' ON CONFLICT ("id") DO NOTHING')
+        self.assertEqual(bulk.insert_prefix("public.t", ["x"]), 'INSERT INTO "public"."t" ("x") VALUES ')
+
+    def test_copy_stream_escapes_values(self) -> None:
+        rows = [(1, "a\tb\\c", None, True, datetime.date(2024, 1, 2)), (2, "x\ny", {"k": "v"}, False, None)]
+        stream = bulk.CopyTextStream(rows, ["id", "name", "meta", "flag", "day"])
+        text = stream.read(5) + stream.read()
+        self.assertEqual(
+            text,
+            '1\ta\\tb\\\\c\t\\N\tt\t2024-01-02\n2\tx\\ny\t{"k": "v"}\tf\t\\N\n',
+        )
+        self.assertEqual(stream.row_count, 2)
+        self.assertEqual(stream.read(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException
+
+from routers import users as user_router
+from services.campaign_calendar import AFTER, BEFORE, OPEN, campaign_calendar, compile_calendar, utc_offset
+from services.tenant_cache import TenantSnapshot, tenant_cache
+
+JST = timezone(timedelta(hours=9))
+
+
+class CompileCalendarTests(unittest.TestCase):
+    def test_date_only_boundaries_cover_whole_days_in_campaign_timezone(self):
+        calendar = compile_calendar(
+            {"campaignStart": "2025-04-01", "campaignEnd": "2025-04-30", "campaignTimezone": "UTC+09:00"}
+        )
+        self.assertEqual(calendar.start, datetime(2025, 3, 31, 15, 0, tzinfo=timezone.utc))
+        self.assertEqual(calendar.phase(datetime(2025, 3, 31, 23, 59, tzinfo=JST)), BEFORE)
+        self.assertEqual(calendar.phase(datetime(2025, 4, 1, 0, 0, tzinfo=JST)), OPEN)
+        self.assertEqual(calendar.phase(datetime(2025, 4, 30, 23, 59, 59, tzinfo=JST)), OPEN)
+        self.assertEqual(calendar.phase(datetime(2025, 5, 1, 0, 0, tzinfo=JST)), AFTER)
+
+    def test_missing_or_invalid_boundaries_are_open(self):
+        self.assertEqual(compile_calendar({}).phase(), OPEN)
+        self.assertEqual(compile_calendar({"campaignStart": "not-a-date"}).phase(), OPEN)
+
+    def test_iana_timezone_and_language(self):
+        calendar = compile_calendar({"campaignTimezone": "Asia/Tokyo", "language": " EN "})
+        self.assertEqual(calendar.tz.utcoffset(datetime(2025, 1, 1)), timedelta(hours=9))
+        self.assertEqual(calendar.language, "en")
+        self.assertEqual(compile_calendar({"language": "fr"}).language, "ja")
+
+    def test_coupon_usage_window(self):
+        campaign = compile_calendar({"campaignStart": "2025-04-01", "campaignEnd": "2025-04-30"})
+        self.assertEqual(campaign.coupon_usage_mode, "campaign")
+        self.assertEqual((campaign.coupon_start, campaign.coupon_end), (campaign.start, campaign.end))
+
+        custom = compile_calendar(
+            {
+                "campaignTimezone": "UTC+09:00",
+                "couponUsageMode": "custom",
+                "couponUsageStart": "2025-05-01",
+                "couponUsageEnd": "2025-05-31",
+            }
+        )
+        self.assertFalse(custom.coupon_usage_open(datetime(2025, 4, 30, 12, 0, tzinfo=JST)))
+        self.assertTrue(custom.coupon_usage_open(datetime(2025, 5, 31, 23, 0, tzinfo=JST)))
+        self.assertFalse(custom.coupon_usage_open(datetime(2025, 6, 1, 0, 0, tzinfo=JST)))
+
+    def test_utc_offset_range(self):
+        self.assertEqual(utc_offset("UTC-05:30"), -timedelta(hours=5, minutes=30))
+        self.assertEqual(utc_offset("UTC+14"), timedelta(hours=14))
+        self.assertIsNone(utc_offset("UTC+14:30"))
+        self.assertIsNone(utc_offset("Asia/Tokyo"))
+
+
+class SnapshotCalendarTests(unittest.TestCase):
+    def test_calendar_is_built_once_per_snapshot(self):
+        snapshot = TenantSnapshot("t1", "Tenant", True, {"campaignEnd": "2000-01-01"}, [], [], 1)
+        calendar = campaign_calendar(snapshot)
+        self.assertIs(campaign_calendar(snapshot), calendar)
+        self.assertEqual(calendar.phase(), AFTER)
+
+        updated = TenantSnapshot("t1", "Tenant", True, {}, [], [], 2)
+        self.assertEqual(campaign_calendar(updated).phase(), OPEN)
+
+    def test_missing_snapshot_uses_defaults(self):
+        self.assertIs(campaign_calendar(None), campaign_calendar(None))
+        self.assertEqual(campaign_calendar(None).language, "ja")
+
+
+class _FakeDB:
+    cursor = object()
+
+    async def execute_query(self, query, params=None, row_format="dict"):
+        return [{"stamps": 4}]
+
+
+class RecordStampCampaignTests(unittest.TestCase):
+    def setUp(self) -> None:
+        stores = [{"store_id": "s1", "name": "Store 1", "lat": 39.7, "lng": 141.1}]
+        tenant_cache._entries["calendar-test"] = TenantSnapshot(
+            "calendar-test", "Calendar", True, {"campaignEnd": "2000-01-01"}, [], stores, 1
+        )
+
+    def tearDown(self) -> None:
+        tenant_cache.invalidate("calendar-test")
+
+    def _record(self, store_id):
+        user = {"id": 1, "tenant_id": "calendar-test"}
+        payload = user_router.StampRequest(store_id=store_id)
+        return asyncio.run(user_router.record_stamp(payload, current_user=user, db=_FakeDB(), idempotency_key=None))
+
+    def test_unknown_store_is_reported_before_campaign_window(self):
+        response = self._record("missing")
+        self.assertEqual((response.status, response.stamps), ("store-not-found", 4))
+
+    def test_known_store_outside_campaign_is_rejected(self):
+        with self.assertRaises(HTTPException) as raised:
+            self._record("s1")
+        self.assertEqual(raised.exception.status_code, 403)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+import threading
+import time
+import unittest
+
+from psycopg2 import extensions
+
+from database.pool import BoundedConnectionPool, PoolTimeout
+
+
+class _FakeConnection:
+    def __init__(self) -> None:
+        self.closed = 0
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def get_transaction_status(self) -> int:
+        return self.status
+
+    def rollback(self) -> None:
+        self.rollbacks += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self) -> None:
+        self.closed = 1
+
+
+def _make_pool(minconn: int = 0, maxconn: int = 2, **kwargs) -> BoundedConnectionPool:
+    return BoundedConnectionPool(minconn, maxconn, connection_factory=_FakeConnection, **kwargs)
+
+
+class BoundedConnectionPoolTests(unittest.TestCase):
+    def test_idle_connection_is_reused(self) -> None:
+        pool = _make_pool()
+        conn = pool.getconn()
+        pool.putconn(conn)
+        self.assertIs(pool.getconn(), conn)
+        self.assertEqual(pool.stats()["connections_created"], 1)
+
+    def test_exhausted_pool_times_out_instead_of_failing_fast(self) -> None:
+        pool = _make_pool(maxconn=1)
+        pool.getconn()
+        started = time.monotonic()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn(timeout=0.05)
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertEqual(pool.stats()["timeouts"], 1)
+
+    def test_waiters_are_served_in_fifo_order(self) -> None:
+        pool = _make_pool(maxconn=1)
+        held = pool.getconn()
+        order = []
+
+        def worker(name: str) -> None:
+            conn = pool.getconn(timeout=2)
+            order.append(name)
+            pool.putconn(conn)
+
+        threads = []
+        for name in ("first", "second", "third"):
+            thread = threading.Thread(target=worker, args=(name,))
+            thread.start()
+            threads.append(thread)
+            while pool.stats()["waiting"] < len(threads):
+                time.sleep(0.001)
+
+        pool.putconn(held)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ["first", "second", "third"])
+        self.assertEqual(pool.stats()["requests_waited"], 3)
+
+    def test_closed_connection_is_replaced_on_checkout(self) -> None:
+        pool = _make_pool()
+        conn = pool.getconn()
+        pool.putconn(conn)
+        conn.closed = 1
+        replacement = pool.getconn()
+        self.assertIsNot(replacement, conn)
+        self.assertEqual(pool.stats()["connections_discarded"], 1)
+
+    def test_expired_connection_is_recycled(self) -> None:
+        pool = _make_pool(max_lifetime=0.01)
+        conn = pool.getconn()
+        time.sleep(0.02)
+        pool.putconn(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.stats()["size"], 0)
+
+    def test_connection_returned_in_transaction_is_rolled_back(self) -> None:
+        pool = _make_pool()
+        conn = pool.getconn()
+        conn.status = extensions.TRANSACTION_STATUS_INTRANS
+        pool.putconn(conn)
+        self.assertEqual(conn.rollbacks, 1)
+        self.assertEqual(pool.stats()["idle"], 1)
+
+    def test_stats_report_usage(self) -> None:
+        pool = _make_pool(minconn=1, maxconn=3)
+        first = pool.getconn()
+        pool.getconn()
+        stats = pool.stats()
+        self.assertEqual(stats["in_use"], 2)
+        self.assertEqual(stats["idle"], 0)
+        self.assertEqual(stats["size"], 2)
+        pool.putconn(first)
+        self.assertEqual(pool.stats()["idle"], 1)
+
+
+class _GatedFactory:
+    """2 本目以降の接続作成を ``release`` まで止める (``fail`` なら作成に失敗する)"""
+
+    def __init__(self, fail: bool = False) -> None:
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.fail = fail
+
+    def __call__(self) -> _FakeConnection:
+        self.calls += 1
+        if self.calls > 1:
+            self.started.set()
+            self.release.wait(2)
+            if self.fail:
+                raise RuntimeError("connect failed")
+        return _FakeConnection()
+
+
+class WaiterTimeoutDuringReplacementTests(unittest.TestCase):
+    def _timeout_while_replacing(self, factory: _GatedFactory) -> BoundedConnectionPool:
+        pool = BoundedConnectionPool(0, 1, connection_factory=factory)
+        held = pool.getconn()
+        timed_out = []
+
+        def waiter() -> None:
+            try:
+                pool.getconn(timeout=0.05)
+            except PoolTimeout:
+                timed_out.append(True)
+
+        waiting = threading.Thread(target=waiter)
+        waiting.start()
+        while pool.stats()["waiting"] < 1:
+            time.sleep(0.001)
+        # 返却時に接続を閉じさせ、待機者のための新規接続を作らせる
+        returning = threading.Thread(target=pool.putconn, args=(held,), kwargs={"close": True})
+        returning.start()
+        self.assertTrue(factory.started.wait(1))
+        waiting.join()
+        self.assertEqual(timed_out, [True])
+        factory.release.set()
+        returning.join()
+        return pool
+
+    def test_replacement_for_timed_out_waiter_goes_back_to_idle(self) -> None:
+        pool = self._timeout_while_replacing(_GatedFactory())
+        stats = pool.stats()
+        self.assertEqual((stats["size"], stats["idle"], stats["waiting"]), (1, 1, 0))
+        pool.putconn(pool.getconn(timeout=0.05))
+
+    def test_failed_replacement_does_not_requeue_timed_out_waiter(self) -> None:
+        factory = _GatedFactory(fail=True)
+        pool = self._timeout_while_replacing(factory)
+        stats = pool.stats()
+        self.assertEqual((stats["size"], stats["waiting"]), (0, 0))
+        factory.fail = False
+        conn = pool.getconn(timeout=0.05)
+        pool.putconn(conn)
+        self.assertEqual(pool.stats()["idle"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
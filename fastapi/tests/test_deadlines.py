@@ -0,0 +1,54 @@
+import asyncio
+import unittest
+
+from psycopg import errors
+from psycopg_pool import PoolTimeout
+
+from config import settings
+from database.async_database import (
+    DatabaseTimeoutError,
+    _custom_timeouts,
+    _reset_session,
+    database_error,
+)
+from tests.test_unit_of_work import _service
+
+
+class DatabaseErrorTests(unittest.TestCase):
+    def test_timeouts_become_database_timeout_error(self):
+        for exc in (errors.QueryCanceled("canceling statement"), errors.LockNotAvailable("lock"), PoolTimeout("pool")):
+            self.assertIsInstance(database_error(exc), DatabaseTimeoutError)
+
+    def test_other_errors_stay_generic(self):
+        error = database_error(errors.UniqueViolation("duplicate key"))
+        self.assertNotIsInstance(error, DatabaseTimeoutError)
+        self.assertEqual(str(error), "Database error: duplicate key")
+
+
+class SetTimeoutsTests(unittest.TestCase):
+    def test_default_budget_needs_no_round_trip(self):
+        db, log = _service()
+        asyncio.run(db.set_timeouts())
+        self.assertEqual(log, [])
+
+    def test_custom_budget_is_applied_and_reset_on_return(self):
+        db, log = _service()
+        asyncio.run(db.set_timeouts(30000))
+        self.assertEqual(len(log), 1)
+        self.assertIn("set_config('statement_timeout'", log[0])
+        self.assertEqual(db.cursor.params, [("30000", str(settings.DB_LOCK_TIMEOUT_MS))])
+        self.assertIn(db.connection, _custom_timeouts)
+
+        log.clear()
+        asyncio.run(_reset_session(db.connection))
+        self.assertEqual(log, ["RESET statement_timeout; RESET lock_timeout", "COMMIT"])
+        self.assertNotIn(db.connection, _custom_timeouts)
+
+    def test_untouched_connection_is_not_reset(self):
+        db, log = _service()
+        asyncio.run(_reset_session(db.connection))
+        self.assertEqual(log, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+from unittest import mock
+
+from fastapi import HTTPException
+
+from routers import diagnostics
+from routers.users import UserCreate
+
+
+class RequireAdminTests(unittest.TestCase):
+    def test_role_alone_is_not_enough(self) -> None:
+        user = {"tenant_id": "demo", "username": "alice", "role": "admin"}
+        with mock.patch.object(diagnostics.settings, "DIAGNOSTICS_ADMINS", ""):
+            with self.assertRaises(HTTPException) as ctx:
+                diagnostics.require_admin(user)
+        self.assertEqual(ctx.exception.status_code, 403)
+
+    def test_allowlisted_user_is_admitted(self) -> None:
+        user = {"tenant_id": "demo", "username": "alice", "role": "user"}
+        with mock.patch.object(diagnostics.settings, "DIAGNOSTICS_ADMINS", "other:bob, demo:alice"):
+            self.assertIs(diagnostics.require_admin(user), user)
+            with self.assertRaises(HTTPException):
+                diagnostics.require_admin({"tenant_id": "other", "username": "alice"})
+
+    def test_registration_ignores_client_role(self) -> None:
+        payload = UserCreate(
+            tenant_id="demo",
+            username="alice",
+            email="alice@example.com",
+            password="secret",
+            gender="other",
+            age=30,
+            role="admin",
+        )
+        self.assertNotIn("role", payload.model_dump())
+
+
+if __name__ == "__main__":
+    unittest.main()
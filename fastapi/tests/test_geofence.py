@@ -0,0 +1,93 @@
+import asyncio
+import unittest
+
+from services.geofence import MISSING_LOCATION, OUTSIDE, GeofenceGuard
+from services.store_locator import haversine_meters, store_locator
+from services.tenant_cache import TenantSnapshot
+
+# 盛岡駅付近。緯度 0.001 度 ≒ 111 m
+STORE_LAT, STORE_LNG = 39.7016, 141.1365
+
+
+def _snapshot(*radii):
+    stores = [
+        {"store_id": f"s{index}", "lat": STORE_LAT, "lng": STORE_LNG + index * 0.1, "geofence_radius_m": radius}
+        for index, radius in enumerate(radii)
+    ]
+    return TenantSnapshot("geo-test", "Geo", True, {}, [], stores, 1)
+
+
+def _guard(default_radius=0.0, max_accuracy=100.0, require_location=False):
+    return GeofenceGuard(default_radius, max_accuracy, require_location)
+
+
+def _check(guard, snapshot, store_id, lat, lng, accuracy=None):
+    return asyncio.run(guard.check(snapshot, store_id, lat, lng, accuracy))
+
+
+class GeofenceGuardTests(unittest.TestCase):
+    def test_inside_and_outside_store_radius(self):
+        guard = _guard()
+        snapshot = _snapshot(150.0)
+        self.assertIsNone(_check(guard, snapshot, "s0", STORE_LAT + 0.001, STORE_LNG))
+        self.assertEqual(_check(guard, snapshot, "s0", STORE_LAT + 0.002, STORE_LNG), OUTSIDE)
+
+    def test_accuracy_allowance_is_capped(self):
+        snapshot = _snapshot(100.0)
+        far = (STORE_LAT + 0.0015, STORE_LNG)  # 約 167 m
+        self.assertIsNone(_check(_guard(), snapshot, "s0", *far, accuracy=80.0))
+        self.assertEqual(_check(_guard(max_accuracy=50.0), snapshot, "s0", *far, accuracy=80.0), OUTSIDE)
+        self.assertEqual(_check(_guard(max_accuracy=0.0), snapshot, "s0", *far, accuracy=80.0), OUTSIDE)
+
+    def test_store_radius_overrides_default_and_zero_disables(self):
+        guard = _guard(default_radius=50.0)
+        snapshot = _snapshot(None, 500.0, 0.0)
+        point = (STORE_LAT + 0.002, STORE_LNG)
+        self.assertEqual(_check(guard, snapshot, "s0", *point), OUTSIDE)
+        self.assertIsNone(_check(guard, snapshot, "s1", point[0], STORE_LNG + 0.1))
+        self.assertIsNone(_check(guard, snapshot, "s2", 0.0, 0.0))
+
+    def test_missing_location_only_rejected_when_required(self):
+        snapshot = _snapshot(100.0)
+        self.assertIsNone(_check(_guard(), snapshot, "s0", None, None))
+        self.assertEqual(_check(_guard(require_location=True), snapshot, "s0", None, STORE_LNG), MISSING_LOCATION)
+
+    def test_unknown_store_is_left_to_the_recorder(self):
+        self.assertIsNone(_check(_guard(require_location=True), _snapshot(100.0), "missing", 0.0, 0.0))
+
+    def test_tenant_without_geofence_skips_locator(self):
+        guard = _guard()
+        snapshot = _snapshot(None, 0.0)
+        self.assertIsNone(_check(guard, snapshot, "s0", 0.0, 0.0))
+        self.assertNotIn("store_locator", snapshot._derived)
+        self.assertEqual(guard.checked, 0)
+
+    def test_check_many_matches_haversine_and_counts_rejections(self):
+        guard = _guard()
+        snapshot = _snapshot(200.0, 200.0)
+        claims = [
+            ("s0", STORE_LAT + 0.001, STORE_LNG, None),
+            ("s0", STORE_LAT + 0.003, STORE_LNG, None),
+            ("s1", STORE_LAT, STORE_LNG + 0.1, 10.0),
+            ("s1", STORE_LAT + 0.01, STORE_LNG + 0.1, 10.0),
+        ]
+        self.assertEqual(guard.check_many(snapshot, claims), [None, OUTSIDE, None, OUTSIDE])
+        store_ids, lats, lngs, _ = zip(*claims)
+        expected = [
+            haversine_meters(lat, lng, STORE_LAT, STORE_LNG + (0.1 if store_id == "s1" else 0.0))
+            for store_id, lat, lng in zip(store_ids, lats, lngs)
+        ]
+        for actual, wanted in zip(store_locator(snapshot).distances(store_ids, lats, lngs), expected):
+            self.assertAlmostEqual(actual, wanted, delta=0.01)
+
+        stats = guard.stats()
+        self.assertEqual(stats["checked"], 4)
+        self.assertEqual(stats["rejected"], 2)
+        self.assertEqual(
+            {(item["store_id"], item["reason"], item["count"]) for item in stats["rejections"]},
+            {("s0", OUTSIDE, 1), ("s1", OUTSIDE, 1)},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import unittest
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from services.idempotency import CLAIM_SQL, LOOKUP_SQL, SAVE_SQL, IdempotencyStore, request_fingerprint
+
+
+class _FakeTable:
+    """idempotency_keys の代わり (コミットされた行だけを持つ)"""
+
+    def __init__(self):
+        self.rows = {}
+
+
+class _FakeDB:
+    def __init__(self, table):
+        self.table = table
+        self.pending = {}
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.pending = {}
+        try:
+            yield self
+        except BaseException:
+            self.pending = {}
+            raise
+        self.table.rows.update(self.pending)
+
+    async def execute_query(self, query, params=None, row_format="dict"):
+        if query is CLAIM_SQL:
+            key = (params["user_id"], params["key"])
+            if key in self.table.rows:
+                return []
+            self.pending[key] = [params["request_hash"], None, None]
+            return [(1,)]
+        if query is SAVE_SQL:
+            status_code, body, user_id, key = params
+            self.pending[(user_id, key)][1:] = [status_code, json.loads(body)]
+            return []
+        if query is LOOKUP_SQL:
+            return [tuple(self.table.rows[params])]
+        raise AssertionError(query)
+
+
+def _handler(calls, result=None, delay=0.0, error=None):
+    async def handler():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return result or {"status": "stamped", "stamps": len(calls)}
+
+    return handler
+
+
+class IdempotencyStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.table = _FakeTable()
+        self.hash = request_fingerprint("POST /stamps", {"store_id": "s1"})
+
+    def test_duplicate_is_replayed_from_memory(self):
+        store = IdempotencyStore(ttl=60, max_entries=10)
+        calls = []
+
+        async def run():
+            first = await store.run(_FakeDB(self.table), 1, "k1", self.hash, _handler(calls))
+            second = await store.run(_FakeDB(self.table), 1, "k1", self.hash, _handler(calls))
+            return first, second
+
+        first, second = asyncio.run(run())
+        self.assertEqual(first, {"status": "stamped", "stamps": 1})
+        self.assertEqual(json.loads(second.body), first)
+        self.assertEqual(second.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(len(calls), 1)
+
+    def test_duplicate_from_another_worker_is_replayed_from_db(self):
+        calls = []
+
+        async def run():
+            await IdempotencyStore(60, 10).run(_FakeDB(self.table), 1, "k1", self.hash, _handler(calls))
+            return await IdempotencyStore(60, 10).run(_FakeDB(self.table), 1, "k1", self.hash, _handler(calls))
+
+        replay = asyncio.run(run())
+        self.assertEqual(json.loads(replay.body), {"status": "stamped", "stamps": 1})
+        self.assertEqual(len(calls), 1)
+
+    def test_concurrent_duplicates_run_once(self):
+        store = IdempotencyStore(ttl=60, max_entries=10)
+        calls = []
+
+        async def run():
+            return await asyncio.gather(
+                *[store.run(_FakeDB(self.table), 1, "k1", self.hash, _handler(calls, delay=0.01)) for _ in range(5)]
+            )
+
+        results = asyncio.run(run())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(store.collapsed, 4)
+        self.assertTrue(all(json.loads(result.body) == results[0] for result in results[1:]))
+
+    def test_key_reused_for_different_request_is_rejected(self):
+        store = IdempotencyStore(ttl=60, max_entries=10)
+        other = request_fingerprint("POST /stamps", {"store_id": "s2"})
+
+        async def run():
+            await store.run(_FakeDB(self.table), 1, "k1", self.hash, _handler([]))
+            await store.run(_FakeDB(self.table), 1, "k1", other, _handler([]))
+
+        with self.assertRaises(HTTPException) as raised:
+            asyncio.run(run())
+        self.assertEqual(raised.exception.status_code, 422)
+
+    def test_failed_request_is_not_stored(self):
+        store = IdempotencyStore(ttl=60, max_entries=10)
+        calls = []
+
+        async def run():
+            with self.assertRaises(HTTPException):
+                await store.run(
+                    _FakeDB(self.table), 1, "k1", self.hash, _handler(calls, error=HTTPException(404))
+                )
+            return await store.run(_FakeDB(self.table), 1, "k1", self.hash, _handler(calls))
+
+        self.assertEqual(asyncio.run(run()), {"status": "stamped", "stamps": 2})
+        self.assertEqual(self.table.rows[(1, "k1")][1], 200)
+
+    def test_memory_is_bounded(self):
+        store = IdempotencyStore(ttl=60, max_entries=2)
+
+        async def run():
+            for index in range(3):
+                await store.run(_FakeDB(self.table), 1, f"k{index}", self.hash, _handler([]))
+
+        asyncio.run(run())
+        self.assertEqual(store.stats()["entries"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from database.migrations import discover_migrations, pending_migrations
+
+
+class _FakeCursor:
+    def __init__(self, applied):
+        self.applied = applied
+        self._result = None
+
+    def execute(self, query, params=None):
+        if "to_regclass" in query:
+            self._result = [(self.applied is not None,)]
+        else:
+            self._result = list((self.applied or {}).items())
+
+    def fetchone(self):
+        return self._result[0]
+
+    def fetchall(self):
+        return self._result
+
+
+class MigrationDiscoveryTests(unittest.TestCase):
+    def test_versions_are_numbered_and_unique(self):
+        migrations = discover_migrations()
+        versions = [migration.version for migration in migrations]
+        self.assertEqual(versions, sorted(set(versions)))
+        self.assertEqual(versions[0], 1)
+
+    def test_python_migrations_do_not_import_current_definitions(self):
+        # 適用済みの移行が後の定義変更で別の SQL を流さないよう、各ファイルに固定しておく
+        for migration in discover_migrations():
+            if migration.path.suffix == ".py":
+                self.assertNotIn("import", migration.path.read_text(encoding="utf-8"), migration)
+
+    def test_non_migration_files_are_ignored_and_order_is_numeric(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory)
+            (path / "10_later.sql").write_text("SELECT 1")
+            (path / "2_earlier.py").write_text("def upgrade(cursor):\n    pass\n")
+            (path / "README.md").write_text("")
+            (path / "__init__.py").write_text("")
+            self.assertEqual([m.name for m in discover_migrations(path)], ["earlier", "later"])
+
+    def test_duplicate_versions_are_rejected(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory)
+            (path / "0001_a.sql").write_text("SELECT 1")
+            (path / "1_b.sql").write_text("SELECT 1")
+            with self.assertRaises(ValueError):
+                discover_migrations(path)
+
+
+class PendingMigrationTests(unittest.TestCase):
+    def setUp(self):
+        self.migrations = discover_migrations()
+
+    def test_everything_is_pending_without_ledger(self):
+        self.assertEqual(pending_migrations(_FakeCursor(None), self.migrations), self.migrations)
+
+    def test_applied_versions_are_skipped(self):
+        first = self.migrations[0]
+        cursor = _FakeCursor({first.version: first.checksum})
+        self.assertEqual(pending_migrations(cursor, self.migrations), self.migrations[1:])
+
+    def test_modified_migration_is_reported(self):
+        first = self.migrations[0]
+        cursor = _FakeCursor({first.version: "0" * 64})
+        with self.assertLogs("database.migrations", level="WARNING"):
+            pending = pending_migrations(cursor, self.migrations)
+        self.assertNotIn(first, pending)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from database.async_database import AsyncDatabaseService
+from routers import auth, tenants
+from services.security import PasswordHasher, get_password_hash
+
+
+class PasswordHasherTests(unittest.TestCase):
+    def test_thread_mode_hashes_and_verifies(self) -> None:
+        hasher = PasswordHasher(workers=0, max_concurrency=2)
+        try:
+            hashed = asyncio.run(hasher.hash("secret"))
+            self.assertTrue(asyncio.run(hasher.verify("secret", hashed)))
+            self.assertFalse(asyncio.run(hasher.verify("wrong", hashed)))
+            self.assertEqual(hasher.stats()["completed"], 3)
+        finally:
+            hasher.shutdown()
+
+    def test_process_pool_verifies_existing_hash(self) -> None:
+        hashed = get_password_hash("secret")
+        hasher = PasswordHasher(workers=1, max_concurrency=1)
+        try:
+            self.assertTrue(asyncio.run(hasher.verify("secret", hashed)))
+        finally:
+            hasher.shutdown()
+
+    def test_concurrency_cap_queues_excess_calls(self) -> None:
+        hasher = PasswordHasher(workers=0, max_concurrency=1)
+        hashed = get_password_hash("secret")
+
+        async def burst():
+            return await asyncio.gather(*(hasher.verify("secret", hashed) for _ in range(3)))
+
+        try:
+            self.assertEqual(asyncio.run(burst()), [True, True, True])
+            stats = hasher.stats()
+            self.assertEqual(stats["max_waiting"], 2)
+            self.assertEqual(stats["in_flight"], 0)
+            self.assertEqual(stats["waiting"], 0)
+        finally:
+            hasher.shutdown()
+
+
+class _FakeCursor:
+    async def close(self):
+        pass
+
+
+class _FakeConnection:
+    read_only = None
+
+    def cursor(self):
+        return _FakeCursor()
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class _FakePool:
+    def __init__(self):
+        self.held = 0
+
+    async def getconn(self):
+        self.held += 1
+        return _FakeConnection()
+
+    async def putconn(self, connection):
+        self.held -= 1
+
+
+class _Service(AsyncDatabaseService):
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = rows
+        self.queries = []
+
+    async def execute_query(self, query, params=None, **kwargs):
+        assert self.connection is not None
+        self.queries.append(query)
+        return self.rows
+
+
+class _CheckingHasher:
+    """ハッシュ計算の間に接続を借りていないことを確かめる"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.calls = 0
+
+    async def verify(self, plain_password, hashed_password):
+        self.calls += 1
+        assert self.pool.held == 0, "connection held while verifying"
+        return plain_password == hashed_password
+
+    async def hash(self, password):
+        self.calls += 1
+        assert self.pool.held == 0, "connection held while hashing"
+        return password
+
+
+class ConnectionReleaseTests(unittest.TestCase):
+    def setUp(self):
+        self.pool = _FakePool()
+        self.hasher = _CheckingHasher(self.pool)
+        pool_patch = mock.patch.object(AsyncDatabaseService, "_connection_pool", self.pool)
+        pool_patch.start()
+        self.addCleanup(pool_patch.stop)
+
+    def test_login_verifies_without_a_connection(self):
+        db = _Service([{"id": 1, "tenant_id": "t1", "username": "u", "password_hash": "secret"}])
+
+        async def run():
+            async with db:
+                return await auth._authenticate_user(db, "u", "secret", "t1")
+
+        with mock.patch.object(auth, "password_hasher", self.hasher):
+            user = asyncio.run(run())
+        self.assertEqual(user["id"], 1)
+        self.assertEqual(self.hasher.calls, 1)
+        self.assertEqual(self.pool.held, 0)
+
+    def test_password_reset_writes_in_a_new_transaction(self):
+        db = _Service([{"admin_password_hash": "old"}])
+        payload = tenants.TenantPasswordResetRequest(tenant_id="t1", current_password="old", new_password="new")
+
+        async def run():
+            async with db:
+                await tenants.reset_tenant_password(payload, db)
+
+        with mock.patch.object(tenants, "password_hasher", self.hasher):
+            asyncio.run(run())
+        self.assertEqual(self.hasher.calls, 2)
+        self.assertIn("UPDATE tenants", db.queries[-1])
+        self.assertEqual(self.pool.held, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
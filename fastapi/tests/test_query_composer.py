@@ -0,0 +1,62 @@
+import unittest
+
+from database.DataModel import Sessions, Users
+from database.QueryComposer import QueryComposer, _compile
+from database.database import _to_server_placeholders
+
+
+class QueryComposerTests(unittest.TestCase):
+    def test_select_uses_placeholders_and_tenant_filter(self) -> None:
+        composer = QueryComposer(tenant_id="demo")
+        sql, params = composer.generate_query(
+            datamodel=Users(),
+            sqltype="select",
+            conditions={"username": "admin' OR '1'='1", "age": None, "is_active": True},
+        )
+        self.assertIn("WHERE username = %s AND age IS NULL AND is_active = %s AND users.tenant_id = %s", sql)
+        self.assertNotIn("admin", sql)
+        self.assertEqual(params, ("admin' OR '1'='1", True, "demo"))
+
+    def test_same_shape_reuses_compiled_template(self) -> None:
+        composer = QueryComposer(tenant_id="demo")
+        _compile.cache_clear()
+        first, _ = composer.generate_query(datamodel=Users(), sqltype="select", conditions={"username": "a"})
+        second, params = composer.generate_query(datamodel=Users(), sqltype="select", conditions={"username": "b"})
+        self.assertIs(first, second)
+        self.assertEqual(params, ("b", "demo"))
+        self.assertEqual(_compile.cache_info().hits, 1)
+
+    def test_model_classes_and_instances_compile_the_same_select(self) -> None:
+        composer = QueryComposer()
+        from_classes, _ = composer.generate_query(
+            datamodel=Users, related_models=[Sessions], sqltype="select", conditions={"id": 1}
+        )
+        from_instances, _ = composer.generate_query(
+            datamodel=Users(), related_models=[Sessions()], sqltype="select", conditions={"id": 1}
+        )
+        self.assertIs(from_classes, from_instances)
+        self.assertIn(", ".join(Sessions.model_fields.keys()), from_classes)
+        self.assertIn("FROM users WHERE", from_classes)
+
+    def test_insert_update_delete(self) -> None:
+        composer = QueryComposer(tenant_id="demo")
+        sql, params = composer.generate_query(datamodel=Users(username="u", age=30), sqltype="insert")
+        self.assertEqual(sql, "INSERT INTO users (username, age, tenant_id) VALUES (%s, %s, %s) RETURNING *;")
+        self.assertEqual(params, ("u", 30, "demo"))
+
+        sql, params = composer.generate_query(datamodel=Users(email=None), sqltype="update", conditions={"id": 5})
+        self.assertEqual(sql, "UPDATE users SET email = %s  WHERE id = %s AND tenant_id = %s RETURNING *;")
+        self.assertEqual(params, (None, 5, "demo"))
+
+        with self.assertRaises(ValueError):
+            composer.generate_query(datamodel=Users(), sqltype="delete")
+
+    def test_server_placeholders(self) -> None:
+        self.assertEqual(
+            _to_server_placeholders("SELECT * FROM t WHERE a = %s AND b LIKE 'x%%' AND c = %s"),
+            ("SELECT * FROM t WHERE a = $1 AND b LIKE 'x%' AND c = $2", 2),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
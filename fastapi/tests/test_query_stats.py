@@ -0,0 +1,79 @@
+import unittest
+from unittest import mock
+
+from database.query_stats import QueryStats, fingerprint, is_explainable
+
+
+class FingerprintTests(unittest.TestCase):
+    def test_literals_and_whitespace_are_normalized(self):
+        self.assertEqual(
+            fingerprint("SELECT *  FROM users\n WHERE id = 42 AND name = 'o''brien';"),
+            "SELECT * FROM users WHERE id = ? AND name = ?",
+        )
+
+    def test_placeholders_are_kept(self):
+        self.assertEqual(fingerprint("SELECT 1 FROM t WHERE a = %s"), "SELECT ? FROM t WHERE a = %s")
+
+    def test_only_select_is_explainable(self):
+        self.assertTrue(is_explainable("  select 1"))
+        self.assertFalse(is_explainable("UPDATE users SET name = 'x'"))
+
+
+class QueryStatsTests(unittest.TestCase):
+    def test_calls_are_grouped_by_fingerprint(self):
+        stats = QueryStats(slow_query_ms=1000)
+        stats.record("SELECT * FROM users WHERE id = 1", 3.0, 1)
+        stats.record("SELECT * FROM users WHERE id = 2", 7.0, 1)
+        (entry,) = stats.snapshot()
+        self.assertEqual(entry["calls"], 2)
+        self.assertEqual(entry["rows"], 2)
+        self.assertEqual(entry["total_ms"], 10.0)
+        self.assertEqual(entry["max_ms"], 7.0)
+        self.assertEqual(entry["histogram"]["le_5ms"], 1)
+        self.assertEqual(entry["histogram"]["le_10ms"], 1)
+
+    def test_percentiles_come_from_histogram(self):
+        stats = QueryStats(slow_query_ms=10000)
+        for _ in range(98):
+            stats.record("SELECT 1", 0.5)
+        stats.record("SELECT 1", 80.0)
+        stats.record("SELECT 1", 6000.0)
+        (entry,) = stats.snapshot()
+        self.assertEqual(entry["p50_ms"], 1.0)
+        self.assertEqual(entry["p99_ms"], 100.0)
+        self.assertEqual(entry["histogram"]["gt_5000ms"], 1)
+
+    def test_slow_queries_are_counted(self):
+        stats = QueryStats(slow_query_ms=50)
+        with self.assertLogs("database.query_stats", level="WARNING"):
+            stats.record("SELECT 1", 75.0)
+        stats.record("SELECT 1", 10.0)
+        self.assertEqual(stats.snapshot()[0]["slow_calls"], 1)
+
+    def test_explain_is_sampled_and_rate_limited(self):
+        stats = QueryStats(slow_query_ms=0, explain_sample_rate=1.0, explain_min_interval=60)
+        with self.assertLogs("database.query_stats", level="WARNING"):
+            self.assertTrue(stats.record("SELECT 1", 5.0))
+            stats.store_plan("SELECT 1", "Result")
+            self.assertFalse(stats.record("SELECT 1", 5.0))
+            self.assertFalse(stats.record("DELETE FROM users", 5.0))
+        self.assertEqual(stats.snapshot()[0]["explain"], "Result")
+
+    def test_explain_disabled_by_default(self):
+        stats = QueryStats(slow_query_ms=0)
+        with mock.patch("database.query_stats.random.random", return_value=0.0), \
+                self.assertLogs("database.query_stats", level="WARNING"):
+            self.assertFalse(stats.record("SELECT 1", 5.0))
+
+    def test_fingerprint_limit(self):
+        stats = QueryStats(slow_query_ms=1000, max_fingerprints=1)
+        stats.record("SELECT a FROM t", 1.0)
+        stats.record("SELECT b FROM t", 1.0)
+        self.assertEqual(len(stats.snapshot()), 1)
+        self.assertEqual(stats.dropped, 1)
+        stats.reset()
+        self.assertEqual(stats.snapshot(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
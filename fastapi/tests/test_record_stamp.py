@@ -0,0 +1,164 @@
+"""1 ステートメント版の record_stamp (RECORD_STAMP_SQL) が、旧実装 (逐次クエリ) と同じ応答を返すことを確かめる。
+
+.env (DB_*) の PostgreSQL に接続する。つながらなければスキップする。
+"""
+import asyncio
+import unittest
+from typing import List
+
+import psycopg
+
+from database.async_database import AsyncDatabaseService, build_conninfo
+from routers.users import CouponModel, StampResponse, StoreSummary, _coupon_description_for_threshold, _stamp_response
+from services.stamps import record_stamp_once
+
+TENANT = "stamp-test"
+LANGUAGE = "en"
+
+
+async def _legacy_record_stamp(db: AsyncDatabaseService, user_id: int, tenant_id: str, store_id: str) -> StampResponse:
+    """旧 record_stamp と同じ順序のクエリで同じ応答を組み立てる (キャンペーン判定は省略)"""
+    cursor = db.cursor
+    await cursor.execute("SELECT store_id, name FROM stores WHERE tenant_id = %s AND store_id = %s", (tenant_id, store_id))
+    store_row = await cursor.fetchone()
+    if store_row is None:
+        await cursor.execute("SELECT stamps FROM user_progress WHERE user_id = %s", (user_id,))
+        stamps_row = await cursor.fetchone()
+        return StampResponse(
+            status="store-not-found",
+            store=None,
+            stamps=stamps_row[0] if stamps_row else 0,
+            new_coupons=[],
+            stampedStoreIds=[],
+        )
+    store = StoreSummary(id=store_row[0], tenantId=tenant_id, name=store_row[1], hasStamped=True)
+
+    await cursor.execute(
+        "INSERT INTO user_progress (user_id, tenant_id, stamps) VALUES (%s, %s, 0) ON CONFLICT (user_id) DO NOTHING",
+        (user_id, tenant_id),
+    )
+    await cursor.execute("SELECT 1 FROM user_store_stamps WHERE user_id = %s AND store_id = %s", (user_id, store_id))
+    if await cursor.fetchone():
+        await cursor.execute("SELECT stamps FROM user_progress WHERE user_id = %s", (user_id,))
+        stamps = (await cursor.fetchone())[0]
+        await cursor.execute("SELECT store_id FROM user_store_stamps WHERE user_id = %s", (user_id,))
+        stamped_ids = [row[0] for row in await cursor.fetchall()]
+        return StampResponse(
+            status="already_stamped", store=store, stamps=stamps, new_coupons=[], stampedStoreIds=stamped_ids
+        )
+
+    await cursor.execute(
+        "INSERT INTO user_store_stamps (user_id, tenant_id, store_id) VALUES (%s, %s, %s)",
+        (user_id, tenant_id, store_id),
+    )
+    await cursor.execute(
+        "UPDATE user_progress SET stamps = stamps + 1, updated_at = CURRENT_TIMESTAMP WHERE user_id = %s RETURNING stamps",
+        (user_id,),
+    )
+    stamps = (await cursor.fetchone())[0]
+    await cursor.execute("SELECT coupon_id FROM user_coupons WHERE user_id = %s", (user_id,))
+    existing = {row[0] for row in await cursor.fetchall()}
+    await cursor.execute(
+        "SELECT threshold, label, icon FROM reward_rules WHERE tenant_id = %s ORDER BY threshold", (tenant_id,)
+    )
+    new_coupons: List[CouponModel] = []
+    for threshold, label, icon in await cursor.fetchall():
+        coupon_id = f"tenant-{tenant_id}-rule-{threshold}"
+        if threshold > stamps or coupon_id in existing:
+            continue
+        description = _coupon_description_for_threshold(threshold, LANGUAGE)
+        await cursor.execute(
+            """
+            INSERT INTO user_coupons (user_id, tenant_id, coupon_id, title, description, used)
+            VALUES (%s, %s, %s, %s, %s, FALSE)
+            RETURNING coupon_id, tenant_id, title, used
+            """,
+            (user_id, tenant_id, coupon_id, label, description),
+        )
+        row = await cursor.fetchone()
+        new_coupons.append(
+            CouponModel(id=row[0], tenantId=row[1], title=row[2], description=description, used=row[3], icon=icon)
+        )
+    await cursor.execute("SELECT store_id FROM user_store_stamps WHERE user_id = %s", (user_id,))
+    stamped_ids = [row[0] for row in await cursor.fetchall()]
+    return StampResponse(status="stamped", store=store, stamps=stamps, new_coupons=new_coupons, stampedStoreIds=stamped_ids)
+
+
+async def _single_statement(db: AsyncDatabaseService, user_id: int, tenant_id: str, store_id: str) -> StampResponse:
+    result = await record_stamp_once(db, user_id, tenant_id, store_id, LANGUAGE)
+    return _stamp_response(result, store_id, tenant_id)
+
+
+async def _setup(db: AsyncDatabaseService) -> List[int]:
+    await db.execute_query("DELETE FROM tenants WHERE tenant_id = %s", (TENANT,))
+    await db.execute_query(
+        "INSERT INTO tenants (tenant_id, company_name, config) VALUES (%s, %s, '{}'::jsonb)",
+        (TENANT, "Stamp test"),
+    )
+    await db.bulk_insert(
+        "stores",
+        ["tenant_id", "store_id", "name", "lat", "lng"],
+        [(TENANT, f"stamp-s{index}", f"Store {index}", 0, 0) for index in range(4)],
+    )
+    await db.bulk_insert(
+        "reward_rules",
+        ["tenant_id", "threshold", "label", "icon"],
+        [(TENANT, 2, "Two", "star"), (TENANT, 3, "Three", None)],
+    )
+    created = await db.bulk_insert(
+        "users",
+        ["tenant_id", "username", "email", "password_hash"],
+        [(TENANT, f"stamp-{name}", f"stamp-{name}@example.invalid", "x") for name in ("legacy", "single")],
+        returning=["id"],
+    )
+    return [row["id"] for row in created]
+
+
+class RecordStampTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        try:
+            psycopg.connect(build_conninfo(), connect_timeout=2).close()
+        except psycopg.OperationalError as exc:
+            raise unittest.SkipTest(f"PostgreSQL is not available: {exc}")
+
+    def test_single_statement_matches_legacy_path(self):
+        scans = ["stamp-s1", "stamp-s0", "stamp-s1", "stamp-missing", "stamp-s3", "stamp-s2"]
+
+        async def run():
+            try:
+                async with AsyncDatabaseService() as db:
+                    legacy_user, single_user = await _setup(db)
+                    try:
+                        legacy = [await _legacy_record_stamp(db, legacy_user, TENANT, store_id) for store_id in scans]
+                        single = [await _single_statement(db, single_user, TENANT, store_id) for store_id in scans]
+                    finally:
+                        await db.execute_query("DELETE FROM tenants WHERE tenant_id = %s", (TENANT,))
+                    return legacy, single
+            finally:
+                await AsyncDatabaseService.close_connection_pool()
+
+        legacy, single = asyncio.run(run())
+        for store_id, old, new in zip(scans, legacy, single):
+            self.assertEqual(new.model_dump(), old.model_dump(), store_id)
+
+        self.assertEqual(
+            [response.status for response in single],
+            ["stamped", "stamped", "already_stamped", "store-not-found", "stamped", "stamped"],
+        )
+        self.assertEqual([response.stamps for response in single], [1, 2, 2, 2, 3, 4])
+        # 2 個目で threshold 2 (アイコン付き)、3 個目で threshold 3。重複スキャンでは配らない
+        awarded = [[coupon.id for coupon in response.new_coupons] for response in single]
+        self.assertEqual(awarded[:3], [[], [f"tenant-{TENANT}-rule-2"], []])
+        self.assertEqual(single[1].new_coupons[0].icon, "star")
+        self.assertEqual(single[1].new_coupons[0].description, _coupon_description_for_threshold(2, LANGUAGE))
+        self.assertEqual([coupon.id for coupon in single[4].new_coupons], [f"tenant-{TENANT}-rule-3"])
+        self.assertEqual(single[5].new_coupons, [])
+        # スタンプ済み店舗は押した順
+        self.assertEqual(single[2].stampedStoreIds, ["stamp-s1", "stamp-s0"])
+        self.assertEqual(single[5].stampedStoreIds, ["stamp-s1", "stamp-s0", "stamp-s3", "stamp-s2"])
+        self.assertEqual(single[3].stampedStoreIds, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
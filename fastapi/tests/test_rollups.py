@@ -0,0 +1,209 @@
+"""日次ロールアップと実テーブル (スタンプ・クーポン) の集計が、店舗・ユーザーの削除後も一致することを確かめる。
+
+.env (DB_*) の PostgreSQL に接続する。つながらなければスキップする。
+"""
+import asyncio
+import unittest
+from datetime import date, datetime, time, timedelta
+
+import psycopg
+
+from database.async_database import AsyncDatabaseService, build_conninfo
+from routers import tenants as tenant_router
+from routers import users as user_router
+
+TENANT = "rollup-test"
+ADMIN = {"tenant_id": TENANT}
+
+LIVE_AGGREGATE_SQL = """
+SELECT stamped_at::date AS day, COUNT(*) AS stamps, COUNT(DISTINCT user_id) AS users
+FROM user_store_stamps
+WHERE tenant_id = %s AND stamped_at::date BETWEEN %s AND %s
+GROUP BY stamped_at::date
+"""
+
+LIVE_COUPONS_SQL = """
+SELECT
+    coupon_id,
+    COUNT(*) FILTER (WHERE created_at::date BETWEEN %(start)s AND %(end)s) AS acquired,
+    COUNT(*) FILTER (WHERE used AND used_at::date BETWEEN %(start)s AND %(end)s) AS used
+FROM user_coupons
+WHERE tenant_id = %(tenant_id)s
+GROUP BY coupon_id
+"""
+
+
+async def _setup(db: AsyncDatabaseService) -> list:
+    await db.execute_query("DELETE FROM tenants WHERE tenant_id = %s", (TENANT,))
+    await db.execute_query(
+        "INSERT INTO tenants (tenant_id, company_name, config) VALUES (%s, %s, '{}'::jsonb)",
+        (TENANT, "Rollup test"),
+    )
+    await db.bulk_insert(
+        "stores",
+        ["tenant_id", "store_id", "name", "lat", "lng"],
+        [(TENANT, f"rollup-s{index}", f"Store {index}", 0, 0) for index in range(3)],
+    )
+    created = await db.bulk_insert(
+        "users",
+        ["tenant_id", "username", "email", "password_hash"],
+        [(TENANT, f"rollup-{index}", f"rollup-{index}@example.invalid", "x") for index in range(3)],
+        returning=["id"],
+    )
+    user_ids = [row["id"] for row in created]
+    today = datetime.combine(date.today(), time(12))
+    yesterday = today - timedelta(days=1)
+    stamps = [
+        (user_ids[0], "rollup-s0", today),
+        (user_ids[0], "rollup-s1", today),
+        (user_ids[1], "rollup-s0", today),
+        (user_ids[1], "rollup-s1", yesterday),
+        (user_ids[2], "rollup-s0", yesterday),
+        (user_ids[2], "rollup-s2", yesterday),
+    ]
+    await db.bulk_insert(
+        "user_store_stamps",
+        ["user_id", "tenant_id", "store_id", "stamped_at"],
+        [(user_id, TENANT, store_id, stamped_at) for user_id, store_id, stamped_at in stamps],
+    )
+    coupons = [
+        (user_ids[0], "rollup-a", True, yesterday, today),
+        (user_ids[2], "rollup-a", False, yesterday, yesterday),
+        (user_ids[2], "rollup-b", True, yesterday, today),
+    ]
+    await db.bulk_insert(
+        "user_coupons",
+        ["user_id", "tenant_id", "coupon_id", "title", "used", "created_at", "updated_at", "used_at"],
+        [
+            (user_id, TENANT, coupon_id, coupon_id, used, created, updated, updated if used else None)
+            for user_id, coupon_id, used, created, updated in coupons
+        ],
+    )
+    return user_ids
+
+
+class DailyRollupDeletionTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        try:
+            psycopg.connect(build_conninfo(), connect_timeout=2).close()
+        except psycopg.OperationalError as exc:
+            raise unittest.SkipTest(f"PostgreSQL is not available: {exc}")
+
+    def _run(self, scenario):
+        async def run():
+            try:
+                async with AsyncDatabaseService() as db:
+                    user_ids = await _setup(db)
+                    try:
+                        await scenario(db, user_ids)
+                    finally:
+                        await db.execute_query("DELETE FROM tenants WHERE tenant_id = %s", (TENANT,))
+            finally:
+                await AsyncDatabaseService.close_connection_pool()
+
+        asyncio.run(run())
+
+    async def assertDashboardMatchesLive(self, db):
+        stats = await tenant_router.get_tenant_dashboard_stats(TENANT, days=7, admin=ADMIN, db=db)
+        live = await db.execute_query(LIVE_AGGREGATE_SQL, (TENANT, stats.rangeStart, stats.rangeEnd))
+        live_stamps = {row["day"].isoformat(): row["stamps"] for row in live}
+        live_users = {row["day"].isoformat(): row["users"] for row in live}
+        totals = await db.execute_query(
+            "SELECT COUNT(*) AS stamps, COUNT(DISTINCT user_id) AS users FROM user_store_stamps WHERE tenant_id = %s",
+            (TENANT,),
+        )
+        self.assertEqual(stats.totalStamps, totals[0]["stamps"])
+        self.assertEqual(stats.totalUsers, totals[0]["users"])
+        self.assertEqual({item.date: item.count for item in stats.dailyStamps if item.count}, live_stamps)
+        self.assertEqual({item.date: item.count for item in stats.dailyUsers if item.count}, live_users)
+        coupons = await db.execute_query(
+            LIVE_COUPONS_SQL, {"tenant_id": TENANT, "start": stats.rangeStart, "end": stats.rangeEnd}
+        )
+        self.assertEqual(
+            {coupon.couponId: (coupon.totalAcquired, coupon.totalUsed) for coupon in stats.coupons},
+            {row["coupon_id"]: (row["acquired"], row["used"]) for row in coupons},
+        )
+        return stats
+
+    def test_store_deletion_is_subtracted(self):
+        async def scenario(db, user_ids):
+            before = await self.assertDashboardMatchesLive(db)
+            self.assertEqual((before.totalStamps, before.totalUsers), (6, 3))
+            await tenant_router.delete_store(TENANT, "rollup-s0", admin=ADMIN, db=db)
+            after = await self.assertDashboardMatchesLive(db)
+            # user 2 は昨日 rollup-s2 のスタンプが残る。user 1 は今日の分がなくなる
+            self.assertEqual((after.totalStamps, after.totalUsers), (3, 3))
+
+        self._run(scenario)
+
+    def test_user_deletion_is_subtracted(self):
+        async def scenario(db, user_ids):
+            await db.execute_query("DELETE FROM users WHERE id = %s", (user_ids[2],))
+            stats = await self.assertDashboardMatchesLive(db)
+            self.assertEqual((stats.totalStamps, stats.totalUsers), (4, 2))
+            remaining = await db.execute_query(
+                "SELECT COUNT(*) AS count FROM tenant_daily_active_users WHERE user_id = %s", (user_ids[2],)
+            )
+            self.assertEqual(remaining[0]["count"], 0)
+            # user 2 だけが持っていた rollup-b は一覧から消える
+            self.assertEqual([coupon.couponId for coupon in stats.coupons], ["rollup-a"])
+
+        self._run(scenario)
+
+    def test_using_a_used_coupon_again_keeps_its_day(self):
+        async def scenario(db, user_ids):
+            yesterday = datetime.combine(date.today() - timedelta(days=1), time(12))
+            await db.bulk_insert(
+                "user_coupons",
+                ["user_id", "tenant_id", "coupon_id", "title", "used", "created_at", "updated_at", "used_at"],
+                [(user_ids[1], TENANT, "rollup-c", "rollup-c", True, yesterday, yesterday, yesterday)],
+            )
+            # 使用済みのクーポンをもう一度使っても、使った日は昨日のまま
+            await user_router._use_coupon(db, user_ids[1], "rollup-c")
+            rows = await db.execute_query(
+                "SELECT used_at FROM user_coupons WHERE user_id = %s AND coupon_id = 'rollup-c'", (user_ids[1],)
+            )
+            self.assertEqual(rows[0]["used_at"], yesterday)
+            await self.assertDashboardMatchesLive(db)
+            await db.execute_query("DELETE FROM users WHERE id = %s", (user_ids[1],))
+            stats = await self.assertDashboardMatchesLive(db)
+            self.assertNotIn("rollup-c", [coupon.couponId for coupon in stats.coupons])
+
+        self._run(scenario)
+
+    def test_concurrent_stamps_do_not_wait_on_each_other(self):
+        insert = (
+            "INSERT INTO user_store_stamps (user_id, tenant_id, store_id, stamped_at) "
+            "VALUES (%s, %s, 'rollup-s2', CURRENT_TIMESTAMP)"
+        )
+
+        async def scenario(db, user_ids):
+            # 別の接続から見えるよう、用意したデータを確定しておく
+            await db.connection.commit()
+            first = await psycopg.AsyncConnection.connect(build_conninfo())
+            opened = [first]
+            try:
+                # スロットは pg_backend_pid() % 16 なので、違うスロットに入る接続を選ぶ
+                second = await psycopg.AsyncConnection.connect(build_conninfo())
+                opened.append(second)
+                while second.info.backend_pid % 16 == first.info.backend_pid % 16:
+                    second = await psycopg.AsyncConnection.connect(build_conninfo())
+                    opened.append(second)
+                await first.execute(insert, (user_ids[0], TENANT))
+                # first のトランザクションが開いたままでも、集計行のロックを待たずに記録できる
+                await second.execute("SET lock_timeout = '500ms'")
+                await second.execute(insert, (user_ids[1], TENANT))
+                await second.commit()
+                await first.commit()
+            finally:
+                for connection in opened:
+                    await connection.close()
+            stats = await self.assertDashboardMatchesLive(db)
+            self.assertEqual(stats.totalStamps, 8)
+
+        self._run(scenario)
+
+
+if __name__ == "__main__":
+    unittest.main()
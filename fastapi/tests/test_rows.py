@@ -0,0 +1,37 @@
+import unittest
+
+from database.rows import build_rows, row_class
+
+DESCRIPTION = [("store_id",), ("name",), ("?column?",), ("count",)]
+
+
+class RowFormatTests(unittest.TestCase):
+    def test_row_supports_key_attribute_and_index_access(self) -> None:
+        rows = build_rows(DESCRIPTION, [("s1", "Store", 1, 5)], "row")
+        row = rows[0]
+        self.assertEqual(row["store_id"], "s1")
+        self.assertEqual(row.name, "Store")
+        self.assertEqual(row["?column?"], 1)
+        self.assertEqual(row[0], "s1")
+        self.assertEqual(row.get("missing", "x"), "x")
+        self.assertEqual(dict(row), {"store_id": "s1", "name": "Store", "?column?": 1, "count": 5})
+        # tuple のメソッドは列名で上書きしない
+        self.assertEqual(row.count("s1"), 1)
+        self.assertEqual(row["count"], 5)
+
+    def test_rows_share_one_class_per_column_shape(self) -> None:
+        first = build_rows(DESCRIPTION, [("a", "b", 1, 2)], "row")[0]
+        second = build_rows(DESCRIPTION, [("c", "d", 3, 4)], "row")[0]
+        self.assertIs(type(first), type(second))
+        self.assertIs(type(first), row_class(("store_id", "name", "?column?", "count")))
+
+    def test_dict_and_tuple_formats(self) -> None:
+        raw = [("s1", "Store", 1, 5)]
+        self.assertEqual(build_rows(DESCRIPTION, raw, "dict")[0]["name"], "Store")
+        self.assertIs(build_rows(DESCRIPTION, raw, "tuple"), raw)
+        with self.assertRaises(ValueError):
+            build_rows(DESCRIPTION, raw, "namedtuple")
+
+
+if __name__ == "__main__":
+    unittest.main()
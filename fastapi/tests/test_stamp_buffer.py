@@ -0,0 +1,207 @@
+import asyncio
+import unittest
+
+from fastapi import HTTPException
+
+from services.stamp_buffer import ACCEPT, COMMIT, StampBuffer
+from services.stamps import split_batch_results
+from services.tenant_cache import TenantSnapshot
+
+SNAPSHOT = TenantSnapshot(
+    "t1",
+    "Tenant",
+    True,
+    {},
+    [{"threshold": 2, "label": "Two", "icon": "gift"}],
+    [{"store_id": f"s{index}", "name": f"Store {index}"} for index in range(1, 4)],
+    1,
+)
+
+
+class _FakeDB:
+    def __init__(self, stamps=0, stamped_store_ids=(), coupon_ids=()):
+        self.routing_key = None
+        self.released = False
+        self.progress = {
+            "stamps": stamps,
+            "stamped_store_ids": list(stamped_store_ids),
+            "coupon_ids": list(coupon_ids),
+        }
+
+    async def execute_query(self, query, params=None, row_format="dict"):
+        return [dict(self.progress)]
+
+    async def release(self):
+        self.released = True
+
+
+class _RecordingBuffer(StampBuffer):
+    """書き込む代わりにバッチを記録する"""
+
+    def __init__(
+        self, durability=COMMIT, flush_interval=0.01, batch_size=100, max_pending=100, fail=False, single_failures=None
+    ):
+        super().__init__(True, durability, flush_interval, batch_size, max_pending, max_retries=2, retry_backoff=0.001)
+        self.written_batches = []
+        self.fail = fail
+        # 1 件ずつの書き込みを失敗させる回数 (None なら常に失敗)
+        self.single_failures = single_failures
+        self.single_attempts = 0
+
+    async def _write_batch(self, batch):
+        self.written_batches.append([item.store_id for item in batch])
+        if self.fail:
+            raise Exception("Database error: boom")
+        return {item.seq: {"store_found": True, "stamped": True, "seq": item.seq} for item in batch}
+
+    async def _write_single(self, item):
+        self.single_attempts += 1
+        if self.single_failures is None or self.single_attempts <= self.single_failures:
+            raise Exception("Database error: boom")
+        return {"store_found": True, "stamped": True, "seq": item.seq}
+
+
+class SplitBatchResultsTests(unittest.TestCase):
+    def test_results_accumulate_per_user_in_sequence_order(self):
+        items = [
+            (1, 10, "t1", "s1", "ja"),
+            (2, 10, "t1", "s1", "ja"),
+            (3, 10, "t1", "s2", "ja"),
+            (4, 20, "t1", "s1", "ja"),
+        ]
+        coupon = {"id": "tenant-t1-rule-2", "tenantId": "t1", "title": "Two", "used": False, "threshold": 2}
+        rows = [
+            {"seq": 1, "store_name": "A", "store_found": True, "stamped": True, "stamps": 2,
+             "previous_store_ids": [], "new_coupons": [coupon]},
+            {"seq": 2, "store_name": "A", "store_found": True, "stamped": False, "stamps": 2,
+             "previous_store_ids": [], "new_coupons": [coupon]},
+            {"seq": 3, "store_name": "B", "store_found": True, "stamped": True, "stamps": 2,
+             "previous_store_ids": [], "new_coupons": [coupon]},
+            {"seq": 4, "store_name": "A", "store_found": True, "stamped": False, "stamps": 5,
+             "previous_store_ids": ["s1", "s3"], "new_coupons": "[]"},
+        ]
+        results = split_batch_results(items, rows)
+        self.assertEqual([results[seq]["stamps"] for seq in (1, 2, 3)], [1, 1, 2])
+        self.assertEqual(results[3]["stamped_store_ids"], ["s1", "s2"])
+        self.assertEqual(results[1]["new_coupons"], [])
+        self.assertEqual(results[3]["new_coupons"], [{key: coupon[key] for key in coupon if key != "threshold"}])
+        self.assertEqual(results[4]["stamps"], 5)
+        self.assertEqual(results[4]["stamped_store_ids"], ["s1", "s3"])
+
+
+class StampBufferTests(unittest.TestCase):
+    def test_concurrent_stamps_are_written_in_one_batch(self):
+        buffer = _RecordingBuffer()
+
+        async def run():
+            return await asyncio.gather(
+                *[buffer.submit(_FakeDB(), index, "t1", "s1", "ja", SNAPSHOT) for index in range(5)]
+            )
+
+        results = asyncio.run(run())
+        self.assertEqual(buffer.written_batches, [["s1"] * 5])
+        self.assertEqual(len({result["seq"] for result in results}), 5)
+        self.assertEqual(buffer.stats()["pending"], 0)
+
+    def test_batches_are_split_by_size(self):
+        buffer = _RecordingBuffer(flush_interval=60, batch_size=2)
+
+        async def run():
+            await asyncio.gather(*[buffer.submit(_FakeDB(), index, "t1", "s1", "ja", SNAPSHOT) for index in range(4)])
+
+        asyncio.run(run())
+        self.assertEqual(buffer.written_batches, [["s1", "s1"], ["s1", "s1"]])
+
+    def test_unknown_store_is_answered_without_queueing(self):
+        buffer = _RecordingBuffer()
+        db = _FakeDB(stamps=3)
+        result = asyncio.run(buffer.submit(db, 1, "t1", "missing", "ja", SNAPSHOT))
+        self.assertFalse(result["store_found"])
+        self.assertEqual(result["stamps"], 3)
+        self.assertTrue(db.released)
+        self.assertEqual(buffer.stats()["accepted"], 0)
+
+    def test_full_buffer_rejects_with_retry_after(self):
+        buffer = _RecordingBuffer(durability=ACCEPT, flush_interval=60, max_pending=1)
+
+        async def run():
+            await buffer.submit(_FakeDB(), 1, "t1", "s1", "ja", SNAPSHOT)
+            await buffer.submit(_FakeDB(), 2, "t1", "s1", "ja", SNAPSHOT)
+
+        with self.assertRaises(HTTPException) as raised:
+            asyncio.run(run())
+        self.assertEqual(raised.exception.status_code, 503)
+        self.assertEqual(raised.exception.headers["Retry-After"], "1")
+        self.assertEqual(buffer.rejected, 1)
+
+    def test_accept_mode_returns_provisional_result_including_unwritten_stamps(self):
+        buffer = _RecordingBuffer(durability=ACCEPT, flush_interval=60)
+
+        async def run():
+            first = await buffer.submit(_FakeDB(stamps=0), 1, "t1", "s1", "ja", SNAPSHOT)
+            second = await buffer.submit(_FakeDB(stamps=0), 1, "t1", "s2", "ja", SNAPSHOT)
+            again = await buffer.submit(_FakeDB(stamps=0), 1, "t1", "s1", "ja", SNAPSHOT)
+            await buffer.close()
+            return first, second, again
+
+        first, second, again = asyncio.run(run())
+        self.assertTrue(first["provisional"])
+        self.assertEqual((first["stamps"], first["new_coupons"]), (1, []))
+        self.assertEqual(second["stamps"], 2)
+        self.assertEqual([coupon["id"] for coupon in second["new_coupons"]], ["tenant-t1-rule-2"])
+        self.assertEqual(second["stamped_store_ids"], ["s1", "s2"])
+        self.assertFalse(again["stamped"])
+        # close() で残りが書き込まれる。既にスタンプ済みの分は積まない
+        self.assertEqual(buffer.written_batches, [["s1", "s2"]])
+
+    def test_failed_batch_is_retried_one_by_one(self):
+        buffer = _RecordingBuffer(fail=True)
+
+        async def run():
+            return await asyncio.gather(
+                *[buffer.submit(_FakeDB(), index, "t1", "s1", "ja", SNAPSHOT) for index in range(2)],
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(run())
+        self.assertEqual(buffer.fallbacks, 1)
+        self.assertEqual(buffer.failed, 2)
+        self.assertTrue(all(isinstance(result, Exception) for result in results))
+
+    def test_accept_mode_failures_are_requeued_and_stay_unwritten(self):
+        buffer = _RecordingBuffer(durability=ACCEPT, fail=True, single_failures=2)
+
+        async def run():
+            await buffer.submit(_FakeDB(), 1, "t1", "s1", "ja", SNAPSHOT)
+            while buffer.retried < 1:
+                await asyncio.sleep(0.001)
+            # 積み直し待ちの間も、同じ利用者の仮の結果には含まれる
+            again = await buffer.submit(_FakeDB(), 1, "t1", "s1", "ja", SNAPSHOT)
+            while buffer.pending:
+                await asyncio.sleep(0.001)
+            return again
+
+        again = asyncio.run(run())
+        self.assertFalse(again["stamped"])
+        self.assertEqual(again["stamped_store_ids"], ["s1"])
+        self.assertEqual((buffer.retried, buffer.written, buffer.lost), (2, 1, 0))
+        self.assertEqual(buffer._unwritten, {})
+
+    def test_accept_mode_stamp_is_counted_as_lost_after_retries(self):
+        buffer = _RecordingBuffer(durability=ACCEPT, flush_interval=60, fail=True)
+
+        async def run():
+            result = await buffer.submit(_FakeDB(), 1, "t1", "s1", "ja", SNAPSHOT)
+            await buffer.close()
+            return result
+
+        result = asyncio.run(run())
+        self.assertTrue(result["stamped"])
+        stats = buffer.stats()
+        self.assertEqual((stats["retried"], stats["lost"], stats["failed"], stats["pending"]), (2, 1, 0, 0))
+        self.assertEqual(buffer.single_attempts, 3)
+        self.assertEqual(buffer._unwritten, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import main
+from database.migrations import PendingMigrationsError
+
+
+class SchemaRetryTests(unittest.TestCase):
+    def _wait(self, check):
+        report = {"schema": "waiting", "schema_attempts": 1}
+        with mock.patch.object(main, "SCHEMA_RETRY_INITIAL", 0), mock.patch.object(
+            main, "_check_schema", side_effect=check
+        ), mock.patch.object(main, "_stop_process") as stop:
+            asyncio.run(main._wait_for_schema(report))
+        return report, stop
+
+    def test_pending_migrations_found_on_retry_stop_the_worker(self):
+        report, stop = self._wait([ConnectionError("down"), PendingMigrationsError("Pending migrations")])
+        self.assertEqual(report["schema"], "pending")
+        self.assertEqual(report["schema_attempts"], 2)
+        stop.assert_called_once_with()
+
+    def test_current_schema_keeps_serving(self):
+        report, stop = self._wait([ConnectionError("down"), None])
+        self.assertEqual(report["schema"], "ready")
+        stop.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import asyncio
+import random
+import unittest
+from unittest import mock
+
+from fastapi import HTTPException
+
+from routers import tenants as tenant_router
+from services import store_locator as locator_module
+from services.store_locator import StoreLocator, haversine_meters, load_store_locator, store_locator
+from services.tenant_cache import TenantSnapshot, tenant_cache
+
+
+def _stores(count: int, seed: int = 1, lat=(39.5, 40.0), lng=(140.8, 141.4)):
+    rng = random.Random(seed)
+    return [
+        {"store_id": f"s{index}", "name": f"Store {index}", "lat": rng.uniform(*lat), "lng": rng.uniform(*lng)}
+        for index in range(count)
+    ]
+
+
+def _brute_force(stores, lat, lng, limit, radius=None, exclude=()):
+    ranked = sorted(
+        (haversine_meters(lat, lng, store["lat"], store["lng"]), store["store_id"])
+        for store in stores
+        if store["store_id"] not in exclude
+    )
+    if radius is not None:
+        ranked = [item for item in ranked if item[0] <= radius]
+    return ranked[:limit]
+
+
+class StoreLocatorTests(unittest.TestCase):
+    def assertMatchesBruteForce(self, locator, stores, *args, **kwargs):
+        expected = _brute_force(stores, *args, **kwargs)
+        actual = locator.nearest(*args[:3], radius_meters=kwargs.get("radius"), exclude=kwargs.get("exclude", ()))
+        self.assertEqual([row["store_id"] for row, _ in actual], [store_id for _, store_id in expected])
+        for (_, distance), (expected_distance, _) in zip(actual, expected):
+            self.assertAlmostEqual(distance, expected_distance, delta=0.01)
+
+    def test_nearest_matches_brute_force(self):
+        stores = _stores(2000)
+        locator = StoreLocator(stores)
+        rng = random.Random(2)
+        for _ in range(50):
+            lat, lng = rng.uniform(39.4, 40.1), rng.uniform(140.7, 141.5)
+            self.assertMatchesBruteForce(locator, stores, lat, lng, 10)
+            self.assertMatchesBruteForce(locator, stores, lat, lng, 50, radius=3000)
+
+    def test_exclude_and_limit_larger_than_store_count(self):
+        stores = _stores(30)
+        locator = StoreLocator(stores)
+        exclude = {f"s{index}" for index in range(0, 30, 2)}
+        self.assertMatchesBruteForce(locator, stores, 39.7, 141.1, 100, exclude=exclude)
+        self.assertEqual(len(locator.nearest(39.7, 141.1, 100, exclude=exclude)), 15)
+
+    def test_query_far_from_every_store_and_across_the_antimeridian(self):
+        stores = _stores(500, lat=(-10.0, 10.0), lng=(175.0, 180.0)) + _stores(500, seed=3, lat=(-10.0, 10.0), lng=(-180.0, -175.0))
+        for index, store in enumerate(stores):
+            store["store_id"] = f"s{index}"
+        locator = StoreLocator(stores)
+        self.assertMatchesBruteForce(locator, stores, 0.0, -179.9, 20)
+        self.assertMatchesBruteForce(locator, stores, 60.0, 10.0, 5)
+
+    def test_empty_and_radius_without_matches(self):
+        self.assertEqual(StoreLocator([]).nearest(39.7, 141.1, 10), [])
+        self.assertEqual(StoreLocator(_stores(10)).nearest(0.0, 0.0, 10, radius_meters=1000), [])
+
+
+class SnapshotLocatorTests(unittest.TestCase):
+    def test_large_tenant_tree_is_built_in_a_thread_and_reused(self):
+        snapshot = TenantSnapshot("t1", "Tenant", True, {}, [], _stores(50), 1)
+        with mock.patch.object(locator_module, "THREAD_BUILD_MIN_STORES", 10):
+            locator = asyncio.run(load_store_locator(snapshot))
+        self.assertEqual(len(locator), 50)
+        self.assertIs(store_locator(snapshot), locator)
+
+
+class NearbyStoresEndpointTests(unittest.TestCase):
+    def setUp(self) -> None:
+        stores = [dict(store, description=None, image_url=None, stamp_mark=None) for store in _stores(100)]
+        tenant_cache._entries["nearby-test"] = TenantSnapshot("nearby-test", "Nearby", True, {}, [], stores, 1)
+
+    def tearDown(self) -> None:
+        tenant_cache.invalidate("nearby-test")
+
+    def _call(self, **kwargs):
+        params = {"lat": 39.7, "lng": 141.1, "radius": None, "limit": 5, "unstamped": False, "token": None}
+        params.update(kwargs)
+        return asyncio.run(tenant_router.find_nearby_stores("nearby-test", **params))
+
+    def test_returns_nearest_stores_with_distance(self):
+        response = self._call()
+        distances = [store.distance for store in response.stores]
+        self.assertEqual(len(distances), 5)
+        self.assertEqual(distances, sorted(distances))
+        self.assertEqual(response.stores[0].tenantId, "nearby-test")
+
+    def test_unstamped_requires_login(self):
+        with self.assertRaises(HTTPException) as raised:
+            self._call(unstamped=True)
+        self.assertEqual(raised.exception.status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
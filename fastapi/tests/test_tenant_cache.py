@@ -0,0 +1,108 @@
+import asyncio
+import unittest
+
+from services.tenant_cache import TenantCache
+
+
+class _FakeDatabase:
+    def __init__(self) -> None:
+        self.version = 1
+        self.language = "ja"
+        self.queries = []
+        self.on_commit = []
+        # _load の途中で呼ぶ関数 (読み込みと並行する書き込みの再現)
+        self.during_load = None
+
+    async def execute_query(self, query, params=None, tenant_id=None, row_format="dict"):
+        self.queries.append(" ".join(query.split()))
+        if "SELECT content_version FROM tenants" in query:
+            return [{"content_version": self.version}]
+        if "FROM tenants" in query:
+            return [
+                {
+                    "tenant_id": params[0],
+                    "company_name": "Demo",
+                    "is_active": True,
+                    "config": {"language": self.language},
+                    "content_version": self.version,
+                }
+            ]
+        if "FROM reward_rules" in query:
+            if self.during_load is not None:
+                self.during_load()
+            return [{"threshold": 3, "label": "Drink", "icon": "ticket"}]
+        if "FROM stores" in query:
+            return [{"store_id": "s1", "name": "Store", "lat": 1.0, "lng": 2.0}]
+        if query.strip().startswith("UPDATE tenants"):
+            self.version += 1
+            return []
+        raise AssertionError(f"unexpected query: {query}")
+
+    async def execute_batch(self, statements, row_format="dict"):
+        return [await self.execute_query(query, params, row_format=row_format) for query, params in statements]
+
+    def after_commit(self, callback):
+        self.on_commit.append(callback)
+
+    def commit(self):
+        callbacks, self.on_commit = self.on_commit, []
+        for callback in callbacks:
+            callback()
+
+
+class TenantCacheTests(unittest.TestCase):
+    def test_hit_within_ttl_does_not_query(self) -> None:
+        db = _FakeDatabase()
+        cache = TenantCache(ttl=60)
+        first = asyncio.run(cache.get(db, "demo"))
+        query_count = len(db.queries)
+        second = asyncio.run(cache.get(db, "demo"))
+        self.assertIs(first, second)
+        self.assertEqual(len(db.queries), query_count)
+        self.assertEqual(first.rule_for_threshold(3)["icon"], "ticket")
+
+    def test_unchanged_version_only_checks_version(self) -> None:
+        db = _FakeDatabase()
+        cache = TenantCache(ttl=0)
+        first = asyncio.run(cache.get(db, "demo"))
+        db.queries.clear()
+        second = asyncio.run(cache.get(db, "demo"))
+        self.assertIs(first, second)
+        self.assertEqual(db.queries, ["SELECT content_version FROM tenants WHERE tenant_id = %s"])
+
+    def test_version_bump_from_another_worker_reloads(self) -> None:
+        db = _FakeDatabase()
+        cache = TenantCache(ttl=0)
+        asyncio.run(cache.get(db, "demo"))
+        db.version += 1
+        db.language = "en"
+        snapshot = asyncio.run(cache.get(db, "demo"))
+        self.assertEqual(snapshot.config["language"], "en")
+        self.assertEqual(cache.stats()["reloads"], 1)
+
+    def test_bump_version_invalidates_local_entry(self) -> None:
+        db = _FakeDatabase()
+        cache = TenantCache(ttl=60)
+        asyncio.run(cache.get(db, "demo"))
+        db.language = "zh"
+        asyncio.run(cache.bump_version(db, "demo"))
+        # コミットまでは手元のエントリを残す
+        self.assertEqual(asyncio.run(cache.get(db, "demo")).config["language"], "ja")
+        db.commit()
+        snapshot = asyncio.run(cache.get(db, "demo"))
+        self.assertEqual(snapshot.config["language"], "zh")
+        self.assertEqual(snapshot.version, 2)
+
+    def test_load_overlapping_invalidation_is_not_cached(self) -> None:
+        db = _FakeDatabase()
+        cache = TenantCache(ttl=60)
+        db.during_load = lambda: cache.invalidate("demo")
+        asyncio.run(cache.get(db, "demo"))
+        db.during_load = None
+        db.queries.clear()
+        asyncio.run(cache.get(db, "demo"))
+        self.assertIn("FROM reward_rules", " ".join(db.queries))
+
+
+if __name__ == "__main__":
+    unittest.main()
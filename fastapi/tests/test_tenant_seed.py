@@ -0,0 +1,65 @@
+import asyncio
+import json
+import unittest
+
+from routers import tenants as tenant_router
+from services.tenant_cache import TenantSnapshot, tenant_cache
+
+
+def _snapshot() -> TenantSnapshot:
+    return TenantSnapshot(
+        tenant_id="seed-test",
+        company_name="Seed Test",
+        is_active=True,
+        config={"tenantName": "SEED", "language": "en", "initialStamps": 1},
+        rules=[{"threshold": 3, "label": "Drink", "icon": "ticket"}],
+        stores=[
+            {
+                "store_id": "s1",
+                "name": "Store",
+                "lat": 39.7,
+                "lng": 141.1,
+                "description": None,
+                "image_url": None,
+                "stamp_mark": None,
+            }
+        ],
+        version=1,
+    )
+
+
+class TenantSeedTests(unittest.TestCase):
+    def setUp(self) -> None:
+        self.snapshot = _snapshot()
+        tenant_cache._entries["seed-test"] = self.snapshot
+
+    def tearDown(self) -> None:
+        tenant_cache.invalidate("seed-test")
+
+    def test_seed_is_served_from_pre_encoded_body(self) -> None:
+        response = asyncio.run(tenant_router.fetch_tenant_seed("seed-test", if_none_match=None))
+        self.assertEqual(response.status_code, 200)
+        payload = json.loads(response.body)
+        self.assertEqual(payload["tenant"]["tenantName"], "SEED")
+        self.assertEqual(payload["stores"][0]["id"], "s1")
+        self.assertTrue(response.headers["etag"].startswith('"'))
+        self.assertIn("must-revalidate", response.headers["cache-control"])
+
+        again = asyncio.run(tenant_router.fetch_tenant_seed("seed-test", if_none_match=None))
+        self.assertIs(again.body, response.body)
+
+    def test_matching_etag_returns_not_modified(self) -> None:
+        first = asyncio.run(tenant_router.fetch_tenant_seed("seed-test", if_none_match=None))
+        etag = first.headers["etag"]
+        for header in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+            response = asyncio.run(tenant_router.fetch_tenant_seed("seed-test", if_none_match=header))
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.body, b"")
+
+    def test_stale_etag_returns_full_body(self) -> None:
+        response = asyncio.run(tenant_router.fetch_tenant_seed("seed-test", if_none_match='"stale"'))
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import asyncio
+import unittest
+
+from database.async_database import AsyncDatabaseService
+
+
+class _FakeCursor:
+    """実行した文を log に、パラメータを params に記録する (結果行は返さない)"""
+
+    def __init__(self, log):
+        self.log = log
+        self.params = []
+        self.description = None
+        self.rowcount = -1
+
+    async def execute(self, query, params=None):
+        self.log.append(query)
+        self.params.append(params)
+
+
+class _FakeConnection:
+    read_only = None
+
+    def __init__(self, log):
+        self.log = log
+
+    async def execute(self, query):
+        self.log.append(query)
+
+    async def commit(self):
+        self.log.append("COMMIT")
+
+    async def rollback(self):
+        self.log.append("ROLLBACK")
+
+
+def _service():
+    log = []
+    db = AsyncDatabaseService()
+    db.connection = _FakeConnection(log)
+    db.cursor = _FakeCursor(log)
+    return db, log
+
+
+class UnitOfWorkTests(unittest.TestCase):
+    def test_outermost_scope_commits_once(self):
+        db, log = _service()
+
+        async def run():
+            async with db.transaction():
+                await db.cursor.execute("INSERT 1")
+                async with db.transaction():
+                    await db.cursor.execute("INSERT 2")
+
+        asyncio.run(run())
+        self.assertEqual(
+            log,
+            ["INSERT 1", "SAVEPOINT uow_1", "INSERT 2", "RELEASE SAVEPOINT uow_1", "COMMIT"],
+        )
+
+    def test_nested_failure_rolls_back_to_savepoint_only(self):
+        db, log = _service()
+
+        async def run():
+            async with db.transaction():
+                try:
+                    async with db.transaction():
+                        await db.cursor.execute("INSERT 2")
+                        raise ValueError("boom")
+                except ValueError:
+                    pass
+                await db.cursor.execute("INSERT 3")
+
+        asyncio.run(run())
+        self.assertEqual(
+            log,
+            ["SAVEPOINT uow_1", "INSERT 2", "ROLLBACK TO SAVEPOINT uow_1", "INSERT 3", "COMMIT"],
+        )
+
+    def test_outer_failure_rolls_back(self):
+        db, log = _service()
+
+        async def run():
+            async with db.transaction():
+                await db.cursor.execute("INSERT 1")
+                raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            asyncio.run(run())
+        self.assertEqual(log, ["INSERT 1", "ROLLBACK"])
+        self.assertEqual(db._depth, 0)
+
+    def test_after_commit_callbacks_run_only_after_commit(self):
+        db, log = _service()
+
+        async def run(fail):
+            async with db.transaction():
+                db.after_commit(lambda: log.append("CALLBACK"))
+                if fail:
+                    raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            asyncio.run(run(True))
+        asyncio.run(run(False))
+        self.assertEqual(log, ["ROLLBACK", "COMMIT", "CALLBACK"])
+
+    def test_failed_statement_inside_scope_leaves_rollback_to_scope(self):
+        db, log = _service()
+
+        async def run():
+            async with db.transaction():
+                await db._abort()
+            await db._abort()
+
+        asyncio.run(run())
+        self.assertEqual(log, ["COMMIT", "ROLLBACK"])
+
+
+if __name__ == "__main__":
+    unittest.main()
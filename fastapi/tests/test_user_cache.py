@@ -0,0 +1,91 @@
+import asyncio
+import time
+import unittest
+
+from routers import auth
+from services.security import create_access_token
+from services.tenant_cache import TenantCache
+from services.user_cache import UserCache, user_cache
+
+
+class _FakeDatabase:
+    def __init__(self) -> None:
+        self.lookups = 0
+
+    async def execute_query(self, query, params=None, tenant_id=None):
+        self.lookups += 1
+        return [
+            {
+                "id": 7,
+                "tenant_id": "demo",
+                "username": params[0],
+                "email": "demo@example.com",
+                "password_hash": "x",
+                "role": "user",
+                "is_active": True,
+            }
+        ]
+
+
+class _DeletedTenantDatabase:
+    async def execute_batch(self, statements, row_format="dict"):
+        return [[] for _ in statements]
+
+
+class UserCacheTests(unittest.TestCase):
+    def test_lru_and_ttl_eviction(self) -> None:
+        cache = UserCache(ttl=60, max_entries=2)
+        cache.put("t", "a", {"id": 1})
+        cache.put("t", "b", {"id": 2})
+        self.assertEqual(cache.get("t", "a"), {"id": 1})
+        cache.put("t", "c", {"id": 3})
+        self.assertIsNone(cache.get("t", "b"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        cache._entries[("t", "a")] = (time.monotonic() - 61, {"id": 1})
+        self.assertIsNone(cache.get("t", "a"))
+
+    def test_evict_user_and_tenant(self) -> None:
+        cache = UserCache(ttl=60, max_entries=10)
+        cache.put("t1", "a", {"id": 1, "password_hash": "secret"})
+        cache.put("t1", "b", {"id": 2})
+        cache.put("t2", "c", {"id": 3})
+        self.assertNotIn("password_hash", cache.get("t1", "a"))
+        cache.evict_user(1)
+        self.assertIsNone(cache.get("t1", "a"))
+        cache.evict_tenant("t1")
+        self.assertIsNone(cache.get("t1", "b"))
+        self.assertIsNotNone(cache.get("t2", "c"))
+
+    def test_evict_subjects(self) -> None:
+        cache = UserCache(ttl=60, max_entries=10)
+        cache.put("t1", "a", {"id": 1})
+        cache.put("t1", "a@example.com", {"id": 1})
+        cache.put("t2", "a", {"id": 2})
+        cache.evict_subjects("t1", "a", "a@example.com")
+        self.assertIsNone(cache.get("t1", "a"))
+        self.assertIsNone(cache.get("t1", "a@example.com"))
+        self.assertIsNotNone(cache.get("t2", "a"))
+
+    def test_missing_tenant_evicts_its_users(self) -> None:
+        user_cache.clear()
+        user_cache.put("gone", "a", {"id": 1})
+        user_cache.put("demo", "b", {"id": 2})
+        self.assertIsNone(asyncio.run(TenantCache(ttl=60).get(_DeletedTenantDatabase(), "gone")))
+        self.assertIsNone(user_cache.get("gone", "a"))
+        self.assertIsNotNone(user_cache.get("demo", "b"))
+        user_cache.clear()
+
+    def test_get_current_user_skips_lookup_on_hit(self) -> None:
+        user_cache.clear()
+        db = _FakeDatabase()
+        token = create_access_token({"sub": "demo-user", "tenant_id": "demo", "role": "user"})
+        first = asyncio.run(auth.get_current_user(token=token, db=db))
+        second = asyncio.run(auth.get_current_user(token=token, db=db))
+        self.assertEqual(db.lookups, 1)
+        self.assertEqual(first["id"], second["id"])
+        user_cache.clear()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+"""/me/progress の 1 クエリ版 (USER_PROGRESS_SQL) が、旧実装 (クエリを分けて組み立て) と同じ応答を返すことを確かめる。
+
+.env (DB_*) の PostgreSQL に接続する。つながらなければスキップする。
+"""
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+from typing import List
+
+import psycopg
+
+from database.async_database import AsyncDatabaseService, build_conninfo
+from routers.users import (
+    CouponModel,
+    ProgressResponse,
+    _coupon_description_for_threshold,
+    _extract_threshold_from_coupon_id,
+    _load_user_progress,
+)
+from services.campaign_calendar import normalize_language
+
+# 規則クーポンの id (tenant-<テナント>-rule-<N>) がパターンに合うよう、ハイフンを含めない
+TENANT = "progresstest"
+RULE_2 = f"tenant-{TENANT}-rule-2"
+RULE_5 = f"tenant-{TENANT}-rule-5"
+
+
+async def _legacy_load_user_progress(db: AsyncDatabaseService, user_id: int, tenant_id: str) -> ProgressResponse:
+    """旧 _load_user_progress と同じクエリで同じ応答を組み立てる (テナント設定はキャッシュを通さず読む)"""
+    progress = await db.execute_query("SELECT tenant_id, stamps FROM user_progress WHERE user_id = %s", (user_id,))
+    if progress:
+        stamps, tenant = progress[0]["stamps"], progress[0]["tenant_id"]
+    else:
+        stamps, tenant = 0, tenant_id
+    config = await db.execute_query("SELECT config->>'language' AS language FROM tenants WHERE tenant_id = %s", (tenant,))
+    language = normalize_language(config[0]["language"] if config else None)
+    rules = await db.execute_query("SELECT threshold, icon FROM reward_rules WHERE tenant_id = %s", (tenant,))
+    icon_map = {rule["threshold"]: rule["icon"] for rule in rules}
+
+    coupon_rows = await db.execute_query(
+        """
+        SELECT coupon_id, tenant_id, title, description, used
+        FROM user_coupons
+        WHERE user_id = %s
+        ORDER BY created_at, id
+        """,
+        (user_id,),
+    )
+    coupons: List[CouponModel] = []
+    for row in coupon_rows:
+        threshold = _extract_threshold_from_coupon_id(row["coupon_id"])
+        description = row["description"]
+        icon = None
+        if threshold is not None:
+            description = _coupon_description_for_threshold(threshold, language)
+            icon = icon_map.get(threshold)
+        coupons.append(
+            CouponModel(
+                id=row["coupon_id"],
+                tenantId=row["tenant_id"],
+                title=row["title"],
+                description=description,
+                used=row["used"],
+                icon=icon,
+            )
+        )
+    stamp_rows = await db.execute_query("SELECT store_id FROM user_store_stamps WHERE user_id = %s", (user_id,))
+    return ProgressResponse(
+        tenantId=tenant,
+        stamps=stamps,
+        coupons=coupons,
+        stampedStoreIds=[row["store_id"] for row in stamp_rows],
+    )
+
+
+async def _setup(db: AsyncDatabaseService) -> List[int]:
+    await db.execute_query("DELETE FROM tenants WHERE tenant_id = %s", (TENANT,))
+    await db.execute_query(
+        """INSERT INTO tenants (tenant_id, company_name, config) VALUES (%s, %s, '{"language": "en"}'::jsonb)""",
+        (TENANT, "Progress test"),
+    )
+    await db.bulk_insert(
+        "stores",
+        ["tenant_id", "store_id", "name", "lat", "lng"],
+        [(TENANT, f"progress-s{index}", f"Store {index}", 0, 0) for index in range(3)],
+    )
+    await db.bulk_insert(
+        "reward_rules",
+        ["tenant_id", "threshold", "label", "icon"],
+        [(TENANT, 2, "Two", "star"), (TENANT, 5, "Five", None)],
+    )
+    created = await db.bulk_insert(
+        "users",
+        ["tenant_id", "username", "email", "password_hash"],
+        [(TENANT, f"progress-{name}", f"progress-{name}@example.invalid", "x") for name in ("new", "active")],
+        returning=["id"],
+    )
+    new_user, active_user = [row["id"] for row in created]
+    # new_user には進捗行を作らない (登録前のデータなど)
+    await db.execute_query(
+        "INSERT INTO user_progress (user_id, tenant_id, stamps) VALUES (%s, %s, 3)", (active_user, TENANT)
+    )
+    await db.bulk_insert(
+        "user_store_stamps",
+        ["user_id", "tenant_id", "store_id"],
+        [(active_user, TENANT, store_id) for store_id in ("progress-s2", "progress-s0", "progress-s1")],
+    )
+    base = datetime(2024, 1, 1, 12)
+    # 挿入順 (id) と created_at の順を変え、同じ created_at は id 順になることも確かめる
+    await db.bulk_insert(
+        "user_coupons",
+        ["user_id", "tenant_id", "coupon_id", "title", "description", "used", "created_at"],
+        [
+            (active_user, TENANT, RULE_5, "Five", "stored five", False, base + timedelta(days=2)),
+            (active_user, TENANT, "welcome", "Welcome", "Initial reward coupon", True, base),
+            (active_user, TENANT, RULE_2, "Two", "stored two", False, base + timedelta(days=1)),
+            (active_user, TENANT, "bonus", "Bonus", None, False, base + timedelta(days=1)),
+            (new_user, TENANT, "welcome", "Welcome", "Initial reward coupon", False, base),
+        ],
+    )
+    return [new_user, active_user]
+
+
+class UserProgressTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        try:
+            psycopg.connect(build_conninfo(), connect_timeout=2).close()
+        except psycopg.OperationalError as exc:
+            raise unittest.SkipTest(f"PostgreSQL is not available: {exc}")
+
+    def test_single_query_matches_legacy_path(self):
+        async def run():
+            try:
+                async with AsyncDatabaseService() as db:
+                    user_ids = await _setup(db)
+                    try:
+                        return [
+                            (
+                                await _legacy_load_user_progress(db, user_id, TENANT),
+                                await _load_user_progress(db, user_id, TENANT),
+                            )
+                            for user_id in user_ids
+                        ]
+                    finally:
+                        await db.execute_query("DELETE FROM tenants WHERE tenant_id = %s", (TENANT,))
+            finally:
+                await AsyncDatabaseService.close_connection_pool()
+
+        (new_legacy, new_user), (active_legacy, active_user) = asyncio.run(run())
+        self.assertEqual(new_user.model_dump(), new_legacy.model_dump())
+        self.assertEqual(active_user.model_dump(), active_legacy.model_dump())
+
+        # 進捗行がなければ渡したテナントの 0 件
+        self.assertEqual((new_user.tenantId, new_user.stamps, new_user.stampedStoreIds), (TENANT, 0, []))
+        self.assertEqual([coupon.id for coupon in new_user.coupons], ["welcome"])
+
+        self.assertEqual(active_user.stamps, 3)
+        self.assertEqual(active_user.stampedStoreIds, ["progress-s2", "progress-s0", "progress-s1"])
+        # created_at 順、同じ created_at は id 順
+        self.assertEqual([coupon.id for coupon in active_user.coupons], ["welcome", RULE_2, "bonus", RULE_5])
+        coupons = {coupon.id: coupon for coupon in active_user.coupons}
+        # 規則のクーポンはテナントの言語の説明文とアイコン。規則のアイコンがなければ None
+        self.assertEqual((coupons[RULE_2].description, coupons[RULE_2].icon), (_coupon_description_for_threshold(2, "en"), "star"))
+        self.assertEqual((coupons[RULE_5].description, coupons[RULE_5].icon), (_coupon_description_for_threshold(5, "en"), None))
+        # パターンに合わないクーポンは保存された説明文のままで、アイコンなし
+        self.assertEqual((coupons["welcome"].description, coupons["welcome"].icon), ("Initial reward coupon", None))
+        self.assertTrue(coupons["welcome"].used)
+        self.assertEqual((coupons["bonus"].description, coupons["bonus"].icon), (None, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
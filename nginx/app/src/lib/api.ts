@@ -181,7 +181,6 @@ export const registerUser = (payload: {
   password: string
   gender: string
   age: number
-  role?: string
 }): Promise<AuthResponse> =>
   apiRequest<AuthResponse>("/users/register", {
     method: "POST",
@@ -192,7 +191,6 @@ export const registerUser = (payload: {
       password: payload.password,
       gender: payload.gender,
       age: payload.age,
-      role: payload.role,
     },
   })
 
@@ -216,11 +214,15 @@ export const fetchCurrentUser = (token: string): Promise<UserProfile> =>
 export const fetchUserProgress = (token: string): Promise<UserProgress> =>
   apiRequest<UserProgress>("/users/me/progress", { token })
 
-export const recordStamp = (token: string, storeId: string): Promise<StampResult> =>
+export const recordStamp = (
+  token: string,
+  storeId: string,
+  location?: { lat: number; lng: number; accuracy?: number },
+): Promise<StampResult> =>
   apiRequest<StampResult>("/users/me/stamps", {
     method: "POST",
     token,
-    body: { store_id: storeId },
+    body: { store_id: storeId, ...location },
   })
 
 export const markCouponUsed = (token: string, couponId: string): Promise<Coupon> =>
@@ -240,6 +242,7 @@ export const addTenantStore = (
     description?: string
     imageUrl?: string
     stampMark?: string
+    geofenceRadius?: number | null
   },
 ): Promise<Store> =>
   apiRequest<Store>(`/tenants/${tenantId}/stores`, {
@@ -253,6 +256,7 @@ export const addTenantStore = (
       description: payload.description,
       image_url: payload.imageUrl,
       stamp_mark: payload.stampMark,
+      geofence_radius: payload.geofenceRadius,
     },
   })
 
@@ -36,6 +36,31 @@ export function storesWithDistance(current: { lat: number; lng: number }, stores
   }))
 }
 
+export type DeviceLocation = {
+  lat: number
+  lng: number
+  accuracy: number
+}
+
+// Resolves to undefined when the browser has no geolocation, the user declines, or the fix times out.
+export function currentLocation(timeoutMs = 5000): Promise<DeviceLocation | undefined> {
+  if (typeof navigator === "undefined" || !navigator.geolocation) {
+    return Promise.resolve(undefined)
+  }
+  return new Promise((resolve) => {
+    navigator.geolocation.getCurrentPosition(
+      (result) =>
+        resolve({
+          lat: result.coords.latitude,
+          lng: result.coords.longitude,
+          accuracy: result.coords.accuracy,
+        }),
+      () => resolve(undefined),
+      { enableHighAccuracy: true, timeout: timeoutMs, maximumAge: 30_000 },
+    )
+  })
+}
+
 export type GeocodeCandidate = {
   lat: number
   lng: number
@@ -6,6 +6,7 @@ import StampSuccessModal from "../components/StampSuccessModal"
 import CouponIcon from "../components/CouponIcon"
 import { XMarkIcon } from "@heroicons/react/24/solid"
 import { recordStamp } from "../lib/api"
+import { currentLocation } from "../lib/geo"
 import { useAuthStore } from "../lib/authStore"
 import { useAppStore, useTenantId } from "../lib/store"
 import { STAMP_PREFIX } from "../lib/stamps"
@@ -147,7 +148,9 @@ export default function Scan() {
     }
 
     try {
-      const result = await recordStamp(token, storeId)
+      // The server checks the position against the store's geofence; without a fix it decides whether to accept
+      const location = await currentLocation()
+      const result = await recordStamp(token, storeId, location)
 
       if (result.status === "store-not-found") {
         showStatus("error", `${STRINGS.spotNotFoundPrefix}${storeId}`)
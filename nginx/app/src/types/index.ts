@@ -14,6 +14,7 @@ export type Store = {
   imageUrl?: string
   hasStamped?: boolean
   stampMark?: string
+  geofenceRadius?: number | null
 }
 
 export type RewardRule = {
@@ -136,4 +137,5 @@ export type StampResult = {
   stamps: number
   new_coupons: Coupon[]
   stampedStoreIds: string[]
+  provisional?: boolean
 }
@@ -15,6 +15,7 @@ CREATE TABLE IF NOT EXISTS tenants (
     admin_password_hash VARCHAR(255),
     admin_password_must_change BOOLEAN DEFAULT FALSE,
     config JSONB DEFAULT '{}'::jsonb,
+    content_version INTEGER NOT NULL DEFAULT 0,
     is_active BOOLEAN DEFAULT TRUE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -55,6 +56,7 @@ CREATE TABLE IF NOT EXISTS stores (
     name VARCHAR(255) NOT NULL,
     lat DOUBLE PRECISION NOT NULL,
     lng DOUBLE PRECISION NOT NULL,
+    geofence_radius_m DOUBLE PRECISION CHECK (geofence_radius_m >= 0),
     description TEXT,
     image_url TEXT,
     stamp_mark VARCHAR(32),
@@ -94,6 +96,8 @@ CREATE TABLE IF NOT EXISTS user_coupons (
     title VARCHAR(255) NOT NULL,
     description TEXT,
     used BOOLEAN DEFAULT FALSE,
+    -- Set only when the coupon turns used (daily rollups count usage on this day)
+    used_at TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE (user_id, coupon_id)
@@ -109,6 +113,48 @@ CREATE TABLE IF NOT EXISTS user_store_stamps (
     FOREIGN KEY (tenant_id, store_id) REFERENCES stores (tenant_id, store_id) ON DELETE CASCADE
 );
 
+-- Idempotency-Key 付きリクエストの応答 (再送時に同じ応答を返す)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    idempotency_key VARCHAR(255) NOT NULL,
+    request_hash CHAR(64) NOT NULL,
+    status_code INTEGER,
+    response JSONB,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, idempotency_key)
+);
+
+-- Daily rollups for the tenant dashboard (maintained by triggers below)
+CREATE TABLE IF NOT EXISTS tenant_daily_stats (
+    tenant_id VARCHAR(32) NOT NULL REFERENCES tenants(tenant_id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    stamps INTEGER NOT NULL DEFAULT 0,
+    users INTEGER NOT NULL DEFAULT 0,
+    -- Per-connection shard so concurrent stamp writers don't queue on one row (readers sum by day)
+    slot SMALLINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (tenant_id, day, slot)
+);
+
+CREATE TABLE IF NOT EXISTS tenant_daily_active_users (
+    tenant_id VARCHAR(32) NOT NULL REFERENCES tenants(tenant_id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    PRIMARY KEY (tenant_id, day, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS tenant_daily_coupon_stats (
+    tenant_id VARCHAR(32) NOT NULL REFERENCES tenants(tenant_id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    coupon_id VARCHAR(128) NOT NULL,
+    title VARCHAR(255),
+    description TEXT,
+    acquired INTEGER NOT NULL DEFAULT 0,
+    used INTEGER NOT NULL DEFAULT 0,
+    -- Per-connection shard, as in tenant_daily_stats (readers sum by coupon and day)
+    slot SMALLINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (tenant_id, day, coupon_id, slot)
+);
+
 -- #############################
 -- # Indexes
 -- #############################
@@ -122,6 +168,7 @@ CREATE INDEX IF NOT EXISTS idx_stores_tenant ON stores(tenant_id);
 CREATE INDEX IF NOT EXISTS idx_reward_rules_tenant ON reward_rules(tenant_id);
 CREATE INDEX IF NOT EXISTS idx_user_coupons_user_id ON user_coupons(user_id);
 CREATE INDEX IF NOT EXISTS idx_user_store_stamps_user ON user_store_stamps(user_id);
+CREATE INDEX IF NOT EXISTS idx_user_store_stamps_tenant_stamped ON user_store_stamps(tenant_id, stamped_at);
 
 -- #############################
 -- # Trigger helpers
@@ -135,46 +182,223 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE TRIGGER update_tenants_updated_at BEFORE UPDATE ON tenants
+CREATE OR REPLACE TRIGGER update_tenants_updated_at BEFORE UPDATE ON tenants
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
-CREATE TRIGGER update_users_updated_at BEFORE UPDATE ON users
+CREATE OR REPLACE TRIGGER update_users_updated_at BEFORE UPDATE ON users
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
-CREATE TRIGGER update_stores_updated_at BEFORE UPDATE ON stores
+CREATE OR REPLACE TRIGGER update_stores_updated_at BEFORE UPDATE ON stores
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
-CREATE TRIGGER update_reward_rules_updated_at BEFORE UPDATE ON reward_rules
+CREATE OR REPLACE TRIGGER update_reward_rules_updated_at BEFORE UPDATE ON reward_rules
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
-CREATE TRIGGER update_user_coupons_updated_at BEFORE UPDATE ON user_coupons
+CREATE OR REPLACE TRIGGER update_user_coupons_updated_at BEFORE UPDATE ON user_coupons
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
-CREATE TRIGGER update_user_progress_updated_at BEFORE UPDATE ON user_progress
+CREATE OR REPLACE TRIGGER update_user_progress_updated_at BEFORE UPDATE ON user_progress
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+CREATE OR REPLACE FUNCTION rollup_inserted_user_store_stamps()
+RETURNS TRIGGER AS $$
+BEGIN
+    WITH added AS (
+        SELECT tenant_id, COALESCE(stamped_at, CURRENT_TIMESTAMP)::date AS day, user_id
+        FROM inserted_user_store_stamps
+    ),
+    new_users AS (
+        INSERT INTO tenant_daily_active_users (tenant_id, day, user_id)
+        SELECT DISTINCT tenant_id, day, user_id
+        FROM added
+        ON CONFLICT DO NOTHING
+        RETURNING tenant_id, day
+    )
+    INSERT INTO tenant_daily_stats (tenant_id, day, slot, stamps, users)
+    SELECT stamped.tenant_id, stamped.day, (pg_backend_pid() % 16)::smallint, stamped.stamp_count, COALESCE(joined.user_count, 0)
+    FROM (
+        SELECT tenant_id, day, COUNT(*) AS stamp_count
+        FROM added
+        GROUP BY tenant_id, day
+    ) AS stamped
+    LEFT JOIN (
+        SELECT tenant_id, day, COUNT(*) AS user_count
+        FROM new_users
+        GROUP BY tenant_id, day
+    ) AS joined USING (tenant_id, day)
+    ON CONFLICT (tenant_id, day, slot) DO UPDATE
+        SET stamps = tenant_daily_stats.stamps + EXCLUDED.stamps,
+            users = tenant_daily_stats.users + EXCLUDED.users;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Deletions are rare, so subtract from one existing slot of the day (no-op while the tenant is being deleted)
+CREATE OR REPLACE FUNCTION rollup_deleted_user_store_stamps()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE tenant_daily_stats AS stats
+    SET stamps = stats.stamps - removed.stamp_count
+    FROM (
+        SELECT tenant_id, stamped_at::date AS day, COUNT(*) AS stamp_count
+        FROM deleted_user_store_stamps
+        WHERE stamped_at IS NOT NULL
+        GROUP BY tenant_id, stamped_at::date
+    ) AS removed
+    WHERE stats.tenant_id = removed.tenant_id
+      AND stats.day = removed.day
+      AND stats.slot = (
+          SELECT MIN(other.slot)
+          FROM tenant_daily_stats AS other
+          WHERE other.tenant_id = removed.tenant_id AND other.day = removed.day
+      );
+    -- Drop users from days where none of their stamps remain (users is decremented by the trigger below)
+    DELETE FROM tenant_daily_active_users AS active
+    USING (
+        SELECT DISTINCT tenant_id, stamped_at::date AS day, user_id
+        FROM deleted_user_store_stamps
+        WHERE stamped_at IS NOT NULL
+    ) AS removed
+    WHERE active.tenant_id = removed.tenant_id
+      AND active.day = removed.day
+      AND active.user_id = removed.user_id
+      AND NOT EXISTS (
+          SELECT 1
+          FROM user_store_stamps AS remaining
+          WHERE remaining.user_id = removed.user_id
+            AND remaining.tenant_id = removed.tenant_id
+            AND remaining.stamped_at >= removed.day
+            AND remaining.stamped_at < removed.day + 1
+      );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Active-user rows disappear on stamp deletion and via the users foreign key;
+-- decrementing from the removed rows counts each exactly once whichever runs first
+CREATE OR REPLACE FUNCTION rollup_removed_daily_active_users()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE tenant_daily_stats AS stats
+    SET users = stats.users - removed.user_count
+    FROM (
+        SELECT tenant_id, day, COUNT(*) AS user_count
+        FROM removed_daily_active_users
+        GROUP BY tenant_id, day
+    ) AS removed
+    WHERE stats.tenant_id = removed.tenant_id
+      AND stats.day = removed.day
+      AND stats.slot = (
+          SELECT MIN(other.slot)
+          FROM tenant_daily_stats AS other
+          WHERE other.tenant_id = removed.tenant_id AND other.day = removed.day
+      );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_user_coupon()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        -- Deletions are rare, so subtract from one existing slot of the day
+        IF OLD.created_at IS NOT NULL THEN
+            UPDATE tenant_daily_coupon_stats AS stats
+            SET acquired = stats.acquired - 1
+            WHERE stats.tenant_id = OLD.tenant_id
+              AND stats.day = OLD.created_at::date
+              AND stats.coupon_id = OLD.coupon_id
+              AND stats.slot = (
+                  SELECT MIN(other.slot)
+                  FROM tenant_daily_coupon_stats AS other
+                  WHERE other.tenant_id = OLD.tenant_id
+                    AND other.day = OLD.created_at::date
+                    AND other.coupon_id = OLD.coupon_id
+              );
+        END IF;
+        IF OLD.used AND OLD.used_at IS NOT NULL THEN
+            UPDATE tenant_daily_coupon_stats AS stats
+            SET used = stats.used - 1
+            WHERE stats.tenant_id = OLD.tenant_id
+              AND stats.day = OLD.used_at::date
+              AND stats.coupon_id = OLD.coupon_id
+              AND stats.slot = (
+                  SELECT MIN(other.slot)
+                  FROM tenant_daily_coupon_stats AS other
+                  WHERE other.tenant_id = OLD.tenant_id
+                    AND other.day = OLD.used_at::date
+                    AND other.coupon_id = OLD.coupon_id
+              );
+        END IF;
+        -- Drop days whose slots now sum to zero so the coupon leaves the dashboard list
+        DELETE FROM tenant_daily_coupon_stats AS stats
+        WHERE stats.tenant_id = OLD.tenant_id
+          AND stats.coupon_id = OLD.coupon_id
+          AND stats.day IN (OLD.created_at::date, OLD.used_at::date)
+          AND (
+              SELECT SUM(other.acquired) <= 0 AND SUM(other.used) <= 0
+              FROM tenant_daily_coupon_stats AS other
+              WHERE other.tenant_id = stats.tenant_id
+                AND other.day = stats.day
+                AND other.coupon_id = stats.coupon_id
+          );
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO tenant_daily_coupon_stats (tenant_id, day, coupon_id, slot, title, description, acquired, used)
+        VALUES (
+            NEW.tenant_id,
+            COALESCE(NEW.created_at, CURRENT_TIMESTAMP)::date,
+            NEW.coupon_id,
+            (pg_backend_pid() % 16)::smallint,
+            NEW.title,
+            NEW.description,
+            1,
+            0
+        )
+        ON CONFLICT (tenant_id, day, coupon_id, slot) DO UPDATE
+            SET acquired = tenant_daily_coupon_stats.acquired + 1;
+    END IF;
+    IF NEW.used AND (TG_OP = 'INSERT' OR NOT OLD.used) THEN
+        INSERT INTO tenant_daily_coupon_stats (tenant_id, day, coupon_id, slot, title, description, acquired, used)
+        VALUES (
+            NEW.tenant_id,
+            COALESCE(NEW.used_at, CURRENT_TIMESTAMP)::date,
+            NEW.coupon_id,
+            (pg_backend_pid() % 16)::smallint,
+            NEW.title,
+            NEW.description,
+            0,
+            1
+        )
+        ON CONFLICT (tenant_id, day, coupon_id, slot) DO UPDATE
+            SET used = tenant_daily_coupon_stats.used + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER rollup_inserted_user_store_stamps AFTER INSERT ON user_store_stamps
+    REFERENCING NEW TABLE AS inserted_user_store_stamps
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_inserted_user_store_stamps();
+
+CREATE OR REPLACE TRIGGER rollup_deleted_user_store_stamps AFTER DELETE ON user_store_stamps
+    REFERENCING OLD TABLE AS deleted_user_store_stamps
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_deleted_user_store_stamps();
+
+CREATE OR REPLACE TRIGGER rollup_tenant_daily_active_users AFTER DELETE ON tenant_daily_active_users
+    REFERENCING OLD TABLE AS removed_daily_active_users
+    FOR EACH STATEMENT EXECUTE FUNCTION rollup_removed_daily_active_users();
+
+CREATE OR REPLACE TRIGGER rollup_user_coupons AFTER INSERT OR UPDATE OF used OR DELETE ON user_coupons
+    FOR EACH ROW EXECUTE FUNCTION rollup_user_coupon();
+
 -- #############################
--- # Schema alignment (idempotent alters)
+-- # Schema changes
 -- #############################
 
-ALTER TABLE tenants ALTER COLUMN tenant_id TYPE VARCHAR(32);
-ALTER TABLE tenants ADD COLUMN IF NOT EXISTS admin_password_hash VARCHAR(255);
-ALTER TABLE tenants ADD COLUMN IF NOT EXISTS admin_password_must_change BOOLEAN DEFAULT FALSE;
-ALTER TABLE tenants ADD COLUMN IF NOT EXISTS config JSONB DEFAULT '{}'::jsonb;
-
-ALTER TABLE users ALTER COLUMN tenant_id TYPE VARCHAR(32);
-ALTER TABLE users ADD COLUMN IF NOT EXISTS gender VARCHAR(20);
-ALTER TABLE users ADD COLUMN IF NOT EXISTS age INTEGER CHECK (age >= 0 AND age <= 120);
-ALTER TABLE users DROP CONSTRAINT IF EXISTS users_username_key;
-ALTER TABLE users DROP CONSTRAINT IF EXISTS users_email_key;
-ALTER TABLE users ADD CONSTRAINT IF NOT EXISTS users_tenant_username_unique UNIQUE (tenant_id, username);
-ALTER TABLE users ADD CONSTRAINT IF NOT EXISTS users_tenant_email_unique UNIQUE (tenant_id, email);
-
-ALTER TABLE stores ALTER COLUMN tenant_id TYPE VARCHAR(32);
-ALTER TABLE reward_rules ALTER COLUMN tenant_id TYPE VARCHAR(32);
-ALTER TABLE user_progress ALTER COLUMN tenant_id TYPE VARCHAR(32);
-ALTER TABLE user_coupons ALTER COLUMN tenant_id TYPE VARCHAR(32);
-ALTER TABLE user_store_stamps ALTER COLUMN tenant_id TYPE VARCHAR(32);
+-- 既存環境のスキーマ変更は fastapi/database/migrations/versions/ に番号付きで追加する
+-- (python -m database.migrations upgrade)。このファイルは常に最新の完成形を作る。
 
 -- #############################
 -- # Seed data (development)
@@ -319,3 +543,6 @@ COMMENT ON TABLE reward_rules IS 'Reward thresholds per tenant.';
 COMMENT ON TABLE user_progress IS 'Aggregate stamp counters per user.';
 COMMENT ON TABLE user_coupons IS 'Issued coupons per user.';
 COMMENT ON TABLE user_store_stamps IS 'Store visit history per user.';
+COMMENT ON TABLE tenant_daily_stats IS 'Daily stamp and active user counts per tenant.';
+COMMENT ON TABLE tenant_daily_active_users IS 'Distinct stamping users per tenant and day.';
+COMMENT ON TABLE tenant_daily_coupon_stats IS 'Daily coupon acquisition and usage counts per tenant.';
@@ -0,0 +1,4 @@
+#!/bin/bash
+# 読み取りレプリカ (docker-compose の replica プロファイル) からのストリーミング複製を許可する
+set -e
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"